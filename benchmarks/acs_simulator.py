@@ -0,0 +1,403 @@
+"""
+   Copyright 2017 Globo.com
+
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+
+       http://www.apache.org/licenses/LICENSE-2.0
+
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+
+   Local HTTP simulator of the ACS API, to exercise the driver at scale
+   without a real Cloudstack. Serves listAccounts, listProjects,
+   listVirtualMachines and listZones over a deterministic inventory, checks
+   request signatures and can add latency and inject errors.
+
+   Run with: python -m benchmarks.acs_simulator --vms 50000 --port 8080
+"""
+import argparse
+import base64
+import hashlib
+import hmac
+import itertools
+import json
+import random
+import socketserver
+import threading
+import time
+import urllib.parse
+import uuid
+from http.server import BaseHTTPRequestHandler
+from http.server import HTTPServer
+
+API_PATH = '/client/api'
+ERROR_CODES = (404, 431, 530)
+NAMESPACE = uuid.UUID('6ba7b811-9dad-11d1-80b4-00c04fd430c8')
+
+
+def create_id(kind, index):
+    return str(uuid.uuid5(NAMESPACE, '%s-%s' % (kind, index)))
+
+
+class Inventory(object):
+    """
+    Deterministic set of zones, accounts, projects and virtual machines.
+    One in every four VMs belongs straight to an account, the others to a
+    project, as ACS lists them separately.
+    """
+
+    def __init__(self, accounts=10, projects=100, vms=1000, zones=3):
+        self.zones = [{
+            'id': create_id('zone', index),
+            'name': 'zone-%s' % index,
+            'allocationstate': 'Enabled'
+        } for index in range(zones)]
+        self.accounts = [{
+            'id': create_id('account', index),
+            'name': 'account-%s' % index,
+            'vmtotal': 0
+        } for index in range(accounts)]
+        self.projects = [{
+            'id': create_id('project', index),
+            'name': 'project-%s' % index,
+            'account': 'account-%s' % (index % accounts),
+            'businessserviceid': str(index % 7),
+            'clientid': str(index % 5),
+            'componentid': str(index % 11),
+            'subcomponentid': str(index % 13),
+            'productid': str(index % 3),
+            'vmtotal': 0
+        } for index in range(projects)]
+        self.vms = [self._create_vm(index) for index in range(vms)]
+        self.vms_by_id = {vm['id']: vm for vm in self.vms}
+
+    def _create_vm(self, index):
+        zone = self.zones[index % len(self.zones)]
+        vm = {
+            'id': create_id('vm', index),
+            'name': 'vm-%s' % index,
+            'created': '2017-07-31T10:54:59-0300',
+            'state': 'Running' if index % 10 else 'Stopped',
+            'cpunumber': 1 + index % 4,
+            'cpuspeed': 1000,
+            'memory': 512 * (1 + index % 8),
+            'serviceofferingname': 'e2.micro',
+            'templatename': 'RedHat 7 OFICIAL',
+            'zonename': zone['name'],
+            'zoneid': zone['id'],
+            'hostname': 'host-%s' % (index % 97),
+            'nic': [{
+                'id': create_id('nic', index),
+                'ipaddress': '10.%s.%s.%s' % (
+                    index // 65536 % 256, index // 256 % 256, index % 256),
+                'isdefault': True,
+                'traffictype': 'Guest',
+                'type': 'Shared'
+            }]
+        }
+        if index % 4 == 0 or not self.projects:
+            account = self.accounts[index % len(self.accounts)]
+            vm['account'] = account['name']
+            vm['accountid'] = account['id']
+            account['vmtotal'] += 1
+        else:
+            project = self.projects[index % len(self.projects)]
+            vm['project'] = project['name']
+            vm['projectid'] = project['id']
+            vm['account'] = project['account']
+            project['vmtotal'] += 1
+        return vm
+
+
+class _Server(socketserver.ThreadingMixIn, HTTPServer):
+
+    daemon_threads = True
+
+
+class ACSSimulator(object):
+    """
+    Serves the inventory on 127.0.0.1. Requests are rejected with 401 when
+    their apiKey or signature does not match. error_rate of the requests,
+    chosen by a seeded random, fail with the error_codes in turn. Errors
+    are only injected in error_commands when given.
+    """
+
+    def __init__(self, api_key='api-key', secret='secret-key',
+                 inventory=None, latency=0, error_rate=0,
+                 error_codes=ERROR_CODES, seed=0, port=0,
+                 error_commands=None):
+        self.api_key = api_key
+        self.secret = secret
+        self.inventory = inventory if inventory else Inventory()
+        self.latency = latency
+        self.error_rate = error_rate
+        self.error_codes = itertools.cycle(error_codes)
+        self.error_commands = error_commands
+        self.random = random.Random(seed)
+        self.requests = 0
+        self.errors = 0
+        self._lock = threading.Lock()
+        self.server = _Server(('127.0.0.1', port), _Handler)
+        self.server.simulator = self
+        self._thread = None
+
+    @property
+    def url(self):
+        return 'http://127.0.0.1:%s%s' % (self.server.server_port, API_PATH)
+
+    def start(self):
+        self._thread = threading.Thread(target=self.server.serve_forever)
+        self._thread.daemon = True
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *args):
+        self.stop()
+
+    def handle(self, params):
+        """
+        Returns the status and body of the response to the query params
+        """
+        if self.latency:
+            time.sleep(self.latency)
+        command = params.get('command', '')
+        with self._lock:
+            self.requests += 1
+            if self.error_rate and self.random.random() < self.error_rate \
+                    and self._injects_errors(command):
+                self.errors += 1
+                return next(self.error_codes), b''
+
+        if not self.verify(params):
+            return 401, self._error(401, 'unable to verify user credentials')
+
+        list_items = getattr(self, '_%s' % command, None)
+        if not command.startswith('list') or not list_items:
+            return 432, self._error(432, 'unknown command %s' % command)
+
+        key, items = list_items(params)
+        body = {'count': len(items)} if items else {}
+        if items:
+            body[key] = self._paginate(items, params)
+        response_key = command.lower() + 'response'
+        return 200, json.dumps({response_key: body}).encode('utf-8')
+
+    def _injects_errors(self, command):
+        return not self.error_commands or command in self.error_commands
+
+    def verify(self, params):
+        """
+        Checks the signature the way ACS does: HMAC-SHA1 of the sorted and
+        lower cased query string, encoded in base64
+        """
+        params = dict(params)
+        signature = params.pop('signature', '')
+        if params.get('apiKey') != self.api_key:
+            return False
+        query = '&'.join(
+            '%s=%s' % (key, urllib.parse.quote(params[key], safe=''))
+            for key in sorted(params)
+        ).lower()
+        digest = hmac.new(
+            self.secret.encode('utf-8'), query.encode('utf-8'),
+            hashlib.sha1
+        ).digest()
+        expected = base64.b64encode(digest).decode('ascii')
+        return hmac.compare_digest(expected, signature)
+
+    def _listZones(self, params):
+        zones = self.inventory.zones
+        if params.get('id'):
+            zones = [zone for zone in zones if zone['id'] == params['id']]
+        return 'zone', zones
+
+    def _listAccounts(self, params):
+        return 'account', self._filter_by_id(self.inventory.accounts, params)
+
+    def _listProjects(self, params):
+        return 'project', self._filter_by_id(self.inventory.projects, params)
+
+    def _listVirtualMachines(self, params):
+        vms_by_id = self.inventory.vms_by_id
+        if params.get('id'):
+            vms = [vms_by_id[params['id']]] \
+                if params['id'] in vms_by_id else []
+        elif params.get('ids'):
+            vms = [vms_by_id[id] for id in params['ids'].split(',')
+                   if id in vms_by_id]
+        elif params.get('projectid'):
+            vms = [vm for vm in self.inventory.vms
+                   if vm.get('projectid') == params['projectid']]
+        elif params.get('accountid'):
+            vms = [vm for vm in self.inventory.vms
+                   if vm.get('accountid') == params['accountid']]
+        else:
+            vms = self.inventory.vms
+        return 'virtualmachine', vms
+
+    def _filter_by_id(self, items, params):
+        if params.get('id'):
+            return [item for item in items if item['id'] == params['id']]
+        return items
+
+    def _paginate(self, items, params):
+        if not params.get('pagesize'):
+            return items
+        page_size = int(params['pagesize'])
+        start = (int(params.get('page', 1)) - 1) * page_size
+        return items[start:start + page_size]
+
+    def _error(self, code, text):
+        return json.dumps({'errorresponse': {
+            'errorcode': code, 'errortext': text
+        }}).encode('utf-8')
+
+
+class _Handler(BaseHTTPRequestHandler):
+
+    protocol_version = 'HTTP/1.1'
+    # Headers and body are written apart, which Nagle's algorithm would
+    # hold back until the client's delayed ACK
+    disable_nagle_algorithm = True
+
+    def do_GET(self):
+        parsed = urllib.parse.urlsplit(self.path)
+        if parsed.path != API_PATH:
+            return self._reply(404, b'')
+        params = dict(urllib.parse.parse_qsl(
+            parsed.query, keep_blank_values=True
+        ))
+        self._reply(*self.server.simulator.handle(params))
+
+    def _reply(self, status, body):
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class LoaderAPISink(object):
+    """
+    Stands in for the GloboMap loader API: accepts any credentials and
+    counts the documents posted to it
+    """
+
+    def __init__(self):
+        self.documents = 0
+        self.clears = 0
+        self.posts = 0
+        self.bytes = 0
+        self._lock = threading.Lock()
+        self.server = _Server(('127.0.0.1', 0), _SinkHandler)
+        self.server.sink = self
+
+    @property
+    def url(self):
+        return 'http://127.0.0.1:%s' % self.server.server_port
+
+    def start(self):
+        thread = threading.Thread(target=self.server.serve_forever)
+        thread.daemon = True
+        thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *args):
+        self.stop()
+
+    def add(self, documents, size):
+        with self._lock:
+            self.posts += 1
+            self.documents += len(documents)
+            self.clears += sum(
+                1 for document in documents
+                if document.get('action') == 'CLEAR'
+            )
+            self.bytes += size
+
+
+class _SinkHandler(BaseHTTPRequestHandler):
+
+    protocol_version = 'HTTP/1.1'
+    # Headers and body are written apart, which Nagle's algorithm would
+    # hold back until the client's delayed ACK
+    disable_nagle_algorithm = True
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers['Content-Length']))
+        if self.path.startswith('/v2/auth'):
+            return self._reply(200, {'token': 'token'})
+        self.server.sink.add(json.loads(body), len(body))
+        self._reply(202, {'jobid': str(uuid.uuid4())})
+
+    def _reply(self, status, content):
+        body = json.dumps(content).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+def split_commands(value):
+    return [command for command in value.split(',') if command]
+
+
+def main():
+    parser = argparse.ArgumentParser(description='ACS API simulator')
+    parser.add_argument('--port', type=int, default=8080)
+    parser.add_argument('--api-key', default='api-key')
+    parser.add_argument('--secret', default='secret-key')
+    parser.add_argument('--accounts', type=int, default=10)
+    parser.add_argument('--projects', type=int, default=100)
+    parser.add_argument('--vms', type=int, default=1000)
+    parser.add_argument('--zones', type=int, default=3)
+    parser.add_argument('--latency', type=float, default=0,
+                        help='seconds added to every request')
+    parser.add_argument('--error-rate', type=float, default=0,
+                        help='fraction of requests failing with 404/431/530')
+    parser.add_argument('--error-commands', type=split_commands,
+                        help='comma separated commands errors are injected '
+                             'in, all of them if unset')
+    args = parser.parse_args()
+
+    simulator = ACSSimulator(
+        args.api_key, args.secret,
+        Inventory(args.accounts, args.projects, args.vms, args.zones),
+        args.latency, args.error_rate, port=args.port,
+        error_commands=args.error_commands
+    )
+    print('Serving %s VMs on %s' % (args.vms, simulator.url))
+    try:
+        simulator.server.serve_forever()
+    except KeyboardInterrupt:
+        simulator.server.server_close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,121 @@
+"""
+   Copyright 2017 Globo.com
+
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+
+       http://www.apache.org/licenses/LICENSE-2.0
+
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+
+   Measures time and retained memory per VM.CREATE event when building its
+   update documents. Run with: python -m benchmarks.bench_documents
+"""
+import argparse
+import gc
+import time
+import tracemalloc
+
+from globomap_driver_acs.update_handlers import RegionUpdateHandler
+from globomap_driver_acs.update_handlers import VirtualMachineUpdateHandler
+
+EVENT = {
+    'event': 'VM.CREATE',
+    'resource': 'com.cloud.vm.VirtualMachine',
+    'eventDateTime': '2017-07-31 10:54:59 -0300',
+    'id': '3018bdf1-4843-43b3-bdcf-ba1beb63c930'
+}
+
+VM = {
+    'id': '3018bdf1-4843-43b3-bdcf-ba1beb63c930',
+    'created': '2017-07-31T10:54:59-0300',
+    'name': 'vm_name',
+    'cpunumber': 1,
+    'cpuspeed': 1000,
+    'memory': 512,
+    'account': 'account',
+    'projectid': '1',
+    'serviceofferingname': 'e2.micro',
+    'templatename': 'RedHat 7 OFICIAL',
+    'zonename': 'zone_name',
+    'hostname': 'hostname',
+    'state': 'Running'
+}
+
+PROJECT = {
+    'id': '1',
+    'name': 'project_name',
+    'account': 'account',
+    'businessserviceid': '1',
+    'clientid': '1',
+    'componentid': '1',
+    'subcomponentid': '1',
+    'productid': '1'
+}
+
+ZONE = {
+    'id': '35ae56ee-273a-46da-8422-fe2b3490c76a',
+    'name': 'zone_name',
+    'allocationstate': 'Enabled'
+}
+
+
+class FakeCloudstackService(object):
+
+    def get_zone_by_name(self, name):
+        return ZONE
+
+
+def create_updates(vm_handler, region_handler):
+    updates = []
+    with vm_handler.builder.batch():
+        vm_handler.create_vm_updates(updates, EVENT, PROJECT, VM)
+        region_handler.create_region_update(updates)
+    return updates
+
+
+def run(events):
+    service = FakeCloudstackService()
+    vm_handler = VirtualMachineUpdateHandler('ENV', service)
+    region_handler = RegionUpdateHandler('ENV', service)
+    create_updates(vm_handler, region_handler)
+
+    gc.collect()
+    start = time.perf_counter()
+    for _ in range(events):
+        create_updates(vm_handler, region_handler)
+    elapsed = time.perf_counter() - start
+
+    gc.collect()
+    tracemalloc.start()
+    retained = [create_updates(vm_handler, region_handler)
+                for _ in range(events)]
+    size, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return {
+        'events': events,
+        'documents_per_event': len(retained[0]),
+        'us_per_event': elapsed / events * 1000000,
+        'bytes_per_event': size / events
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Document building benchmark'
+    )
+    parser.add_argument('--events', type=int, default=10000)
+    result = run(parser.parse_args().events)
+    print('%(events)s events, %(documents_per_event)s documents each' % result)
+    print('%.1f us per event' % result['us_per_event'])
+    print('%.0f bytes retained per event' % result['bytes_per_event'])
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,162 @@
+"""
+   Copyright 2017 Globo.com
+
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+
+       http://www.apache.org/licenses/LICENSE-2.0
+
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+
+   Measures the throughput and peak memory of a full load against the ACS
+   simulator, which runs in its own process so only the driver is measured.
+   Documents are posted to a local stand-in of the loader API. Runs after
+   the first show the traffic of incremental loads with --state-file.
+   With --error-rate, loads that hit an ACS error abort without a clear and
+   are reported as failed.
+   Run with: python -m benchmarks.bench_full_load --vms 50000 --workers 4
+"""
+import argparse
+import multiprocessing
+import os
+import resource
+import time
+import tracemalloc
+
+from benchmarks.acs_simulator import ACSSimulator
+from benchmarks.acs_simulator import Inventory
+from benchmarks.acs_simulator import LoaderAPISink
+from benchmarks.acs_simulator import split_commands
+from globomap_driver_acs import load
+from globomap_driver_acs.cloudstack import ACSError
+from globomap_driver_acs.driver import Cloudstack
+
+ENV = 'SIMULATOR'
+
+
+class SimulatedCloudstack(Cloudstack):
+    """
+    Driver without a RabbitMQ connection, for full loads only
+    """
+
+    def _connect_rabbit(self):
+        self.rabbitmq = None
+
+    def _create_queue_binds(self):
+        pass
+
+
+def serve(options, urls):
+    simulator = ACSSimulator(
+        inventory=Inventory(
+            options.accounts, options.projects, options.vms, options.zones
+        ),
+        latency=options.latency, error_rate=options.error_rate,
+        error_commands=options.error_commands
+    )
+    urls.put(simulator.url)
+    simulator.server.serve_forever()
+
+
+def configure(options, acs_url, loader_url):
+    settings = {
+        'API_URL': acs_url,
+        'API_KEY': 'api-key',
+        'API_SECRET_KEY': 'secret-key',
+        'API_PAGE_SIZE': options.page_size,
+        'API_POOL_SIZE': options.workers + 2,
+        'LOADER_WORKERS': options.workers,
+        'MEMORY_REPORT': options.memory_report or '',
+        'LOADER_STATE_FILE': options.state_file or ''
+    }
+    for key, value in settings.items():
+        os.environ['ACS_%s_%s' % (ENV, key)] = str(value)
+    load.GLOBOMAP_LOADER_API_URL = loader_url
+
+
+def run_load(trace_memory):
+    """
+    Returns the seconds the load took, its traced peak and the ACSError it
+    failed with, if any
+    """
+    driver = SimulatedCloudstack({'env': ENV})
+    if trace_memory:
+        tracemalloc.start()
+    start = time.perf_counter()
+    error = None
+    try:
+        driver.full_load()
+    except ACSError as e:
+        error = e
+    finally:
+        elapsed = time.perf_counter() - start
+        peak = tracemalloc.get_traced_memory()[1] if trace_memory else None
+        tracemalloc.stop()
+        driver._close_cloudstack()
+    return elapsed, peak, error
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Full load benchmark')
+    parser.add_argument('--accounts', type=int, default=20)
+    parser.add_argument('--projects', type=int, default=200)
+    parser.add_argument('--vms', type=int, default=10000)
+    parser.add_argument('--zones', type=int, default=3)
+    parser.add_argument('--page-size', type=int, default=500)
+    parser.add_argument('--workers', type=int, default=1)
+    parser.add_argument('--latency', type=float, default=0)
+    parser.add_argument('--error-rate', type=float, default=0)
+    parser.add_argument('--error-commands', type=split_commands,
+                        help='comma separated ACS commands errors are '
+                             'injected in, all of them if unset')
+    parser.add_argument('--tracemalloc', action='store_true',
+                        help='report the traced peak, slowing the load down')
+    parser.add_argument('--memory-report',
+                        help='file to write the memory report of each phase')
+    parser.add_argument('--state-file',
+                        help='load state file, to publish changes only')
+    parser.add_argument('--runs', type=int, default=1)
+    options = parser.parse_args()
+
+    urls = multiprocessing.Queue()
+    server = multiprocessing.Process(target=serve, args=(options, urls))
+    server.daemon = True
+    server.start()
+    try:
+        with LoaderAPISink() as sink:
+            configure(options, urls.get(timeout=60), sink.url)
+            failed = 0
+            for run in range(options.runs):
+                posted = sink.documents, sink.posts, sink.bytes, sink.clears
+                elapsed, peak, error = run_load(options.tracemalloc)
+                if error:
+                    failed += 1
+                    print('run %s: failed after %.2f s: %s' % (
+                        run + 1, elapsed, error))
+                else:
+                    print('run %s: %s VMs in %.2f s: %.0f VMs/s' % (
+                        run + 1, options.vms, elapsed,
+                        options.vms / elapsed))
+                print('%s documents in %s posts, %.0f KiB, %s clears' % (
+                    sink.documents - posted[0], sink.posts - posted[1],
+                    (sink.bytes - posted[2]) / 1024,
+                    sink.clears - posted[3]))
+    finally:
+        server.terminate()
+
+    if failed:
+        print('%s of %s loads failed' % (failed, options.runs))
+
+    print('max RSS %.0f MiB' % (
+        resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024))
+    if peak is not None:
+        print('traced peak %.0f KiB' % (peak / 1024))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,84 @@
+"""
+   Copyright 2017 Globo.com
+
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+
+       http://www.apache.org/licenses/LICENSE-2.0
+
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+
+   Compares the decode and encode times of the installed JSON backends on
+   the payloads recorded in tests/json: a listVirtualMachines page of 500
+   VMs, a RabbitMQ event and a batch of loader documents.
+   Run with: python -m benchmarks.bench_json
+"""
+import argparse
+import copy
+import json
+import time
+
+from globomap_driver_acs import codec
+
+
+def load_payloads():
+    with open('tests/json/vm.json') as json_file:
+        vms = json.load(json_file)
+    with open('tests/json/vm_create_event.json') as json_file:
+        event = json.load(json_file)
+
+    vm = vms['virtualmachine'][0]
+    page = []
+    for index in range(500):
+        page.append(copy.deepcopy(vm))
+        page[-1]['id'] = '%s-%s' % (vm['id'][:-4], index)
+    documents = [{
+        'action': 'UPDATE',
+        'collection': 'comp_unit',
+        'type': 'collections',
+        'key': 'globomap_%s' % item['id'],
+        'element': item
+    } for item in page[:100]]
+
+    return [
+        ('listVirtualMachines', {
+            'listvirtualmachinesresponse': {
+                'count': len(page), 'virtualmachine': page
+            }
+        }),
+        ('event', event),
+        ('documents', documents)
+    ]
+
+
+def measure(function, value, repeat):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        function(value)
+    return (time.perf_counter() - start) / repeat * 1000000
+
+
+def main():
+    parser = argparse.ArgumentParser(description='JSON backends benchmark')
+    parser.add_argument('--repeat', type=int, default=200)
+    repeat = parser.parse_args().repeat
+
+    print('%-20s %-8s %8s %12s %12s' % (
+        'payload', 'backend', 'bytes', 'decode us', 'encode us'))
+    for name, payload in load_payloads():
+        encoded = json.dumps(payload).encode('utf-8')
+        for json_codec in codec.available_codecs():
+            print('%-20s %-8s %8s %12.1f %12.1f' % (
+                name, json_codec.name, len(encoded),
+                measure(json_codec.loads, encoded, repeat),
+                measure(json_codec.dumps, payload, repeat)
+            ))
+
+
+if __name__ == '__main__':
+    main()
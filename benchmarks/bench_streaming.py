@@ -0,0 +1,75 @@
+"""
+   Copyright 2017 Globo.com
+
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+
+       http://www.apache.org/licenses/LICENSE-2.0
+
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+
+   Compares the peak memory and time of reading a listVirtualMachines page
+   whole and of streaming its virtual machines.
+   Run with: python -m benchmarks.bench_streaming
+"""
+import argparse
+import copy
+import io
+import json
+import time
+import tracemalloc
+
+from globomap_driver_acs import codec
+from globomap_driver_acs.streaming import iter_json_array
+
+
+def create_page(size):
+    with open('tests/json/vm.json') as json_file:
+        vm = json.load(json_file)['virtualmachine'][0]
+    vms = []
+    for index in range(size):
+        vms.append(copy.deepcopy(vm))
+        vms[-1]['id'] = '%s-%s' % (vm['id'][:-4], index)
+    return json.dumps({'listvirtualmachinesresponse': {
+        'count': size, 'virtualmachine': vms
+    }}).encode('utf-8')
+
+
+def read_whole(stream):
+    response = codec.loads(stream.read())['listvirtualmachinesresponse']
+    return sum(1 for _ in response['virtualmachine'])
+
+
+def read_streamed(stream):
+    return sum(1 for _ in iter_json_array(stream, 'virtualmachine'))
+
+
+def measure(function, body):
+    tracemalloc.start()
+    start = time.perf_counter()
+    function(io.BytesIO(body))
+    elapsed = time.perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return elapsed * 1000, peak / 1024
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Streaming benchmark')
+    parser.add_argument('--page-size', type=int, default=500)
+    body = create_page(parser.parse_args().page_size)
+
+    print('page of %s bytes' % len(body))
+    for name, function in [('whole', read_whole),
+                           ('streamed', read_streamed)]:
+        print('%-10s %8.1f ms %10.0f KiB peak' % (
+            (name,) + measure(function, body)))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,297 @@
+"""
+   Copyright 2017 Globo.com
+
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+
+       http://www.apache.org/licenses/LICENSE-2.0
+
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+
+   Times and allocation-profiles the update building hot path against the
+   recorded ACS fixtures in tests/json, without RabbitMQ or ACS. Results
+   are compared with benchmarks/baseline.json and the run fails when a
+   case got slower or allocates more than the threshold allows.
+
+   Run with: make bench
+   Save a new baseline with: make bench_baseline
+"""
+import argparse
+import json
+import os
+import sys
+import time
+import tracemalloc
+
+from globomap_driver_acs.cloudstack import CloudstackService
+from globomap_driver_acs.cloudstack import SignedAPICall
+from globomap_driver_acs.driver import Cloudstack
+from globomap_driver_acs.router import EventRouter
+from globomap_driver_acs.update_handlers import EventTypeHandler
+from globomap_driver_acs.update_handlers import parse_timestamp
+from globomap_driver_acs.update_handlers import VirtualMachineUpdateHandler
+
+FIXTURES = 'tests/json'
+BASELINE = os.path.join(os.path.dirname(__file__), 'baseline.json')
+DEFAULT_THRESHOLD = 0.3
+
+EVENTS = [
+    'vm_create_event.json',
+    'vm_power_state_event.json',
+    'vm_upgrade_event.json',
+    'vm_destroy_event.json',
+    'vm_create_wrong_event.json'
+]
+
+
+def load_fixture(name):
+    with open(os.path.join(FIXTURES, name)) as json_file:
+        return json.load(json_file)
+
+
+class FixtureClient(object):
+    """
+    Answers the ACS commands used by the driver with recorded responses
+    """
+
+    def __init__(self):
+        self.responses = {
+            'listVirtualMachines': load_fixture('vm.json'),
+            'listProjects': load_fixture('project.json'),
+            'listZones': load_fixture('zone.json')
+        }
+        # Zones are looked up by the name the VM reports
+        zone = self.responses['listZones']['zone'][0]
+        zone['name'] = self.responses[
+            'listVirtualMachines']['virtualmachine'][0]['zonename']
+
+    def __getattr__(self, command):
+        response = self.responses[command]
+        return lambda args: response
+
+    def close(self):
+        pass
+
+
+class OfflineCloudstack(Cloudstack):
+    """
+    Driver with the recorded ACS responses and no RabbitMQ connection
+    """
+
+    def _connect_rabbit(self):
+        self.rabbitmq = None
+
+    def _create_queue_binds(self):
+        pass
+
+    def _get_cloudstack_service(self):
+        return CloudstackService(FixtureClient())
+
+
+def sign_case():
+    api_call = SignedAPICall(
+        'http://acs/client/api', 'api-key', 'secret-key'
+    )
+
+    def sign():
+        api_call.request({
+            'command': 'listVirtualMachines',
+            'id': '3018bdf1-4843-43b3-bdcf-ba1beb63c930',
+            'listall': 'true',
+            'response': 'json'
+        }, 'GET')
+    return sign
+
+
+def create_vm_updates_case():
+    service = CloudstackService(FixtureClient())
+    handler = VirtualMachineUpdateHandler('BENCH', service)
+    event = load_fixture('vm_create_event.json')
+    vm = load_fixture('vm.json')['virtualmachine'][0]
+    project = load_fixture('project.json')['project'][0]
+
+    def create_vm_updates():
+        handler.create_vm_updates([], event, project, vm)
+    return create_vm_updates
+
+
+def parse_date_case():
+    dates = [load_fixture(name).get('eventDateTime') for name in EVENTS]
+    dates.append(load_fixture('vm.json')['virtualmachine'][0]['created'])
+
+    def parse_date():
+        for date in dates:
+            VirtualMachineUpdateHandler._parse_date(date)
+    return parse_date
+
+
+def parse_date_uncached_case():
+    dates = [load_fixture(name).get('eventDateTime') for name in EVENTS]
+    dates.append(load_fixture('vm.json')['virtualmachine'][0]['created'])
+
+    def parse_date_uncached():
+        for date in dates:
+            parse_timestamp.__wrapped__(date)
+    return parse_date_uncached
+
+
+def classify_case():
+    events = [load_fixture(name) for name in EVENTS]
+
+    def classify():
+        for event in events:
+            EventTypeHandler.is_vm_update_event(event)
+            EventTypeHandler.is_vm_delete_event(event)
+            EventTypeHandler.is_zone_change_state_event(event)
+    return classify
+
+
+def route_case():
+    events = [load_fixture(name) for name in EVENTS]
+    router = EventRouter()
+    for key in [('VM.CREATE', EventTypeHandler.VM_RESOURCE, '*'),
+                ('VM.UPGRADE', '*', 'Completed'),
+                ('*', 'VirtualMachine', 'postStateTransitionEvent'),
+                ('VM.DESTROY', EventTypeHandler.VM_RESOURCE, '*')]:
+        router.register(list, *key)
+
+    def route():
+        for event in events:
+            router.route(event)
+    return route
+
+
+def create_updates_case():
+    driver = OfflineCloudstack({'env': 'BENCH'})
+    events = [load_fixture(name) for name in EVENTS]
+
+    def create_updates():
+        for event in events:
+            driver._create_updates(event)
+    return create_updates
+
+
+CASES = [
+    ('sign_request', sign_case),
+    ('create_vm_updates', create_vm_updates_case),
+    ('parse_date', parse_date_case),
+    ('parse_date_uncached', parse_date_uncached_case),
+    ('classify_events', classify_case),
+    ('route_events', route_case),
+    ('create_updates', create_updates_case)
+]
+
+
+def measure(function, number, repeat):
+    """
+    Returns the best time per call in microseconds out of `repeat` runs of
+    `number` calls, and the peak bytes allocated by a single call
+    """
+    function()
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for _ in range(number):
+            function()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+
+    tracemalloc.start()
+    before, _ = tracemalloc.get_traced_memory()
+    function()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return {'us': best / number * 1000000, 'bytes': peak - before}
+
+
+def run(names=None, number=2000, repeat=5):
+    results = {}
+    for name, create_case in CASES:
+        if names and name not in names:
+            continue
+        results[name] = measure(create_case(), number, repeat)
+    return results
+
+
+def compare(results, baseline, threshold):
+    """
+    Returns the (name, metric, baseline, result) of every regression
+    """
+    regressions = []
+    for name, result in sorted(results.items()):
+        expected = baseline.get(name)
+        if not expected:
+            continue
+        for metric in ('us', 'bytes'):
+            if result[metric] > expected[metric] * (1 + threshold):
+                regressions.append(
+                    (name, metric, expected[metric], result[metric])
+                )
+    return regressions
+
+
+def report(results, baseline):
+    print('%-22s %12s %12s %12s %12s' % (
+        'case', 'us/call', 'baseline', 'bytes/call', 'baseline'))
+    for name, result in sorted(results.items()):
+        expected = baseline.get(name, {})
+        print('%-22s %12.2f %12s %12d %12s' % (
+            name, result['us'], _format(expected.get('us'), '%.2f'),
+            result['bytes'], _format(expected.get('bytes'), '%d')
+        ))
+
+
+def _format(value, template):
+    return '-' if value is None else template % value
+
+
+def load_baseline(path):
+    if not os.path.exists(path):
+        return {}
+    with open(path) as baseline_file:
+        return json.load(baseline_file)
+
+
+def save_baseline(path, results):
+    results = {
+        name: {'us': round(result['us'], 2), 'bytes': result['bytes']}
+        for name, result in results.items()
+    }
+    with open(path, 'w') as baseline_file:
+        json.dump(results, baseline_file, indent=2, sort_keys=True)
+        baseline_file.write('\n')
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Hot path benchmarks')
+    parser.add_argument('cases', nargs='*', help='cases to run, all if none')
+    parser.add_argument('--number', type=int, default=2000)
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--baseline', default=BASELINE)
+    parser.add_argument('--save-baseline', action='store_true')
+    parser.add_argument('--threshold', type=float, default=DEFAULT_THRESHOLD,
+                        help='allowed slowdown, 0.3 is 30%%')
+    args = parser.parse_args(argv)
+
+    results = run(args.cases, args.number, args.repeat)
+    if args.save_baseline:
+        save_baseline(args.baseline, results)
+        print('Baseline saved to %s' % args.baseline)
+        return 0
+
+    baseline = load_baseline(args.baseline)
+    report(results, baseline)
+    regressions = compare(results, baseline, args.threshold)
+    for name, metric, expected, result in regressions:
+        print('REGRESSION %s: %s went from %.2f to %.2f' % (
+            name, metric, expected, result))
+    return 1 if regressions else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,181 @@
+"""
+   Copyright 2017 Globo.com
+
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+
+       http://www.apache.org/licenses/LICENSE-2.0
+
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+"""
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+
+from globomap_driver_acs.cloudstack import CloudStackClient
+from globomap_driver_acs.cloudstack import CloudstackService
+from globomap_driver_acs.transport import PooledTransport
+
+
+class AsyncCloudStackClient(object):
+    """
+    Asyncio version of CloudStackClient. Commands are resolved dynamically
+    the same way (client.listZones({...})) and return awaitables. Signing,
+    retries and response key mapping are delegated to a CloudStackClient
+    running on max_workers threads, over a pooled transport keeping as
+    many connections.
+    """
+
+    DEFAULT_MAX_WORKERS = 10
+
+    def __init__(self, api_url, apiKey, secret, verifysslcert=True,
+                 transport=None, max_workers=DEFAULT_MAX_WORKERS):
+        if not transport:
+            transport = PooledTransport(pool_size=max_workers)
+        self.client = CloudStackClient(
+            api_url, apiKey, secret, verifysslcert, transport=transport
+        )
+        self.max_workers = max_workers
+        self.executor = ThreadPoolExecutor(max_workers=max_workers)
+
+    def __getattr__(self, name):
+        def handlerFunction(*args, **kwargs):
+
+            args = list(args)
+            if len(args) == 1:
+                args.insert(0, 'GET')
+            action = args[0] or 'GET'
+            if kwargs:
+                return self._make_request(name, kwargs)
+            return self._make_request(name, args[1], action)
+        return handlerFunction
+
+    async def run(self, function, *args):
+        """
+        Runs a blocking call of the client on its threads
+        """
+        loop = asyncio.get_event_loop()
+        return await loop.run_in_executor(self.executor, function, *args)
+
+    def close(self):
+        self.executor.shutdown(wait=True)
+        self.client.close()
+
+    async def _make_request(self, command, args, action='GET'):
+        return await self.run(self.client._make_request, command, args, action)
+
+
+class AsyncCloudstackService(object):
+    """
+    Asyncio version of CloudstackService. Lookups go through a
+    CloudstackService over the same client, so they share its zone index
+    and project cache, and indexed zones are returned without a thread
+    hop. At most limit ACS calls are in flight at the
+    same time, never more than the threads and connections of the client.
+    """
+
+    def __init__(self, cloudstack_client, limit=None, project_cache=None,
+                 project_not_found_ttl=CloudstackService.PROJECT_NOT_FOUND_TTL,
+                 page_size=CloudstackService.PAGE_SIZE):
+        self.cloudstack_client = cloudstack_client
+        self.limit = min(limit or cloudstack_client.max_workers,
+                         cloudstack_client.max_workers)
+        self.service = CloudstackService(
+            cloudstack_client.client, project_cache=project_cache,
+            project_not_found_ttl=project_not_found_ttl,
+            page_size=page_size
+        )
+        self._semaphore = None
+        self._loop = None
+
+    @property
+    def project_cache(self):
+        return self.service.project_cache
+
+    async def get_virtual_machine(self, id):
+        return await self._call(self.service.get_virtual_machine, id)
+
+    async def get_virtual_machines(
+            self, ids, chunk_size=CloudstackService.IDS_PER_REQUEST):
+        """
+        Fetches many virtual machines with one listVirtualMachines call per
+        chunk of ids, running the chunks concurrently. Returns a dict of
+        virtual machines by id, leaving out the ones not found.
+        """
+        ids = list(dict.fromkeys(id for id in ids if id))
+        chunks = await asyncio.gather(*[
+            self._call(self.service.get_virtual_machines,
+                       ids[start:start + chunk_size])
+            for start in range(0, len(ids), chunk_size)
+        ])
+        virtual_machines = {}
+        for chunk in chunks:
+            virtual_machines.update(chunk)
+        return virtual_machines
+
+    async def list_virtual_machines_by_project(self, project_id, page=1,
+                                               pagesize=500):
+        return await self._call(
+            self.service.list_virtual_machines_by_project,
+            project_id, page, pagesize
+        )
+
+    async def list_virtual_machines_by_account(self, account_id, page=1,
+                                               pagesize=500):
+        return await self._call(
+            self.service.list_virtual_machines_by_account,
+            account_id, page, pagesize
+        )
+
+    async def get_project(self, id):
+        return await self._call(self.service.get_project, id)
+
+    async def get_projects(self, ids):
+        """
+        Fetches all projects concurrently, each id once. Returns a list in
+        the same order as ids, with an empty dict for projects not found.
+        """
+        unique_ids = list(dict.fromkeys(ids))
+        projects = await asyncio.gather(
+            *[self.get_project(id) for id in unique_ids]
+        )
+        projects = dict(zip(unique_ids, projects))
+        return [projects[id] for id in ids]
+
+    async def list_projects(self):
+        return await self._call(self.service.list_projects)
+
+    async def list_accounts(self):
+        return await self._call(self.service.list_accounts)
+
+    async def get_zone_by_name(self, name):
+        return await self._get_zone(
+            '_zones_by_name', name, self.service.get_zone_by_name
+        )
+
+    async def get_zone_by_id(self, id):
+        return await self._get_zone(
+            '_zones_by_id', id, self.service.get_zone_by_id
+        )
+
+    async def refresh_zones(self):
+        await self._call(self.service.refresh_zones)
+
+    async def _get_zone(self, index_name, value, get_zone):
+        zones = getattr(self.service, index_name)
+        if zones and value in zones:
+            return zones[value]
+        return await self._call(get_zone, value)
+
+    async def _call(self, function, *args):
+        loop = asyncio.get_event_loop()
+        # Created lazily so the semaphore is bound to the running loop
+        if self._loop is not loop:
+            self._semaphore = asyncio.Semaphore(self.limit)
+            self._loop = loop
+        async with self._semaphore:
+            return await self.cloudstack_client.run(function, *args)
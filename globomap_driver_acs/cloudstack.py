@@ -19,15 +19,57 @@
 import base64
 import hashlib
 import hmac
-import json
 import logging
-import ssl
-import sys
+import threading
+import time
 import urllib.parse
 import urllib.request
 
+from globomap_driver_acs import codec
+from globomap_driver_acs import metrics
+from globomap_driver_acs.cache import LRUCache
+from globomap_driver_acs.cache import MISSING
+from globomap_driver_acs.pagination import iter_pages
+from globomap_driver_acs.streaming import JSONArrayStream
+from globomap_driver_acs.transport import PooledTransport
+
 logger = logging.getLogger(__name__)
 
+# Statuses ACS answers when there is nothing to return
+EMPTY_RESPONSE_STATUSES = (404, 431, 530)
+
+RESPONSE_KEYS = {
+    'deletenetworkinglobonetworkresponse': 'deletenetworkresponse',
+    'listglobonetworkpoolsresponse': 'listglobonetworkpoolresponse',
+    'acquirenewlbipresponse': 'associateipaddressresponse',
+    'listcountersresponse': 'counterresponse',
+    'createconditionresponse': 'conditionresponse',
+    'createautoscalepolicyresponse': 'autoscalepolicyresponse',
+    'createautoscalevmprofileresponse': 'autoscalevmprofileresponse',
+    'createautoscalevmgroupresponse': 'autoscalevmgroupresponse',
+    'enableautoscalevmgroupresponse': 'enableautoscalevmGroupresponse',
+}
+
+
+class ACSError(Exception):
+    """
+    Error status answered by ACS that must not be taken for an empty
+    response
+    """
+
+    def __init__(self, command, status=None):
+        message = '%s failed' % command
+        if status:
+            message += ' with status %s' % status
+        super(ACSError, self).__init__(message)
+        self.command = command
+        self.status = status
+
+
+def response_key(command):
+    key = command.lower() + 'response'
+    return RESPONSE_KEYS.get(key, key)
+
 
 class SignedAPICall(object):
 
@@ -38,37 +80,52 @@ class SignedAPICall(object):
         self.verifysslcert = verifysslcert
 
     def request(self, args, action):
+        self.value, self.query = self.sign(args, action)
+
+    def sign(self, args, action='GET'):
+        """
+        Returns the signed url and query string. Keeps no state between
+        calls, so a single client can sign requests from many threads.
+        """
         args['apiKey'] = self.apiKey
 
-        self.params = []
-        self._sort_request(args)
-        self._create_signature()
-        self._build_post_request(action)
+        query = self._create_query(self._sort_request(args))
+        signature = self._create_signature(query)
+        return self._build_post_request(query, signature, action)
 
     def _sort_request(self, args):
         keys = sorted(args.keys())
-        for key in keys:
-            self.params.append(key + '=' + urllib.parse.quote_plus(args[key]))
+        return [key + '=' + urllib.parse.quote_plus(args[key])
+                for key in keys]
+
+    def _create_query(self, params):
+        return '&'.join(params).replace('+', '%20').replace(':', '%3A')
 
-    def _create_signature(self):
-        self.query = '&'.join(self.params).replace('+', '%20')\
-            .replace(':', '%3A')
+    def _create_signature(self, query):
         digest = hmac.new(
             bytes(self.secret, 'utf-8'),
-            msg=bytes(self.query.lower(), 'utf-8'),
+            msg=bytes(query.lower(), 'utf-8'),
             digestmod=hashlib.sha1).digest()
 
-        self.signature = base64.b64encode(digest)
+        return base64.b64encode(digest)
 
-    def _build_post_request(self, action='GET'):
-        self.query += '&signature=' + urllib.parse.quote_plus(self.signature)
-        self.value = self.api_url
+    def _build_post_request(self, query, signature, action='GET'):
+        query += '&signature=' + urllib.parse.quote_plus(signature)
+        value = self.api_url
         if action == 'GET':
-            self.value += '?' + self.query
+            value += '?' + query
+        return value, query
 
 
 class CloudStackClient(SignedAPICall):
 
+    def __init__(self, api_url, apiKey, secret, verifysslcert=True,
+                 transport=None):
+        super(CloudStackClient, self).__init__(
+            api_url, apiKey, secret, verifysslcert
+        )
+        self.transport = transport if transport else PooledTransport()
+
     def __getattr__(self, name):
         def handlerFunction(*args, **kwargs):
 
@@ -81,95 +138,149 @@ class CloudStackClient(SignedAPICall):
             return self._make_request(name, args[1], action)
         return handlerFunction
 
-    def _http_get(self, url):
-        if self.verifysslcert and sys.version_info < (2, 7, 9):
-            response = urllib.request.urlopen(url)
-        else:
-            ctx = ssl.create_default_context()
-            ctx.check_hostname = False
-            ctx.verify_mode = ssl.CERT_NONE
+    def close(self):
+        self.transport.close()
 
-            response = urllib.request.urlopen(url, context=ctx)
-        return response.read()
+    def _http_get(self, url):
+        return self.transport.get(url)
 
     def _http_post(self, url, data):
-        if self.verifysslcert and sys.version_info < (2, 7, 9):
-            response = urllib.request.urlopen(url, data)
-        else:
-            ctx = ssl.create_default_context()
-            ctx.check_hostname = False
-            ctx.verify_mode = ssl.CERT_NONE
-            response = urllib.request.urlopen(url, data, context=ctx)
-        return response.read()
+        return self.transport.post(url, data)
 
     def _make_request(self, command, args, action='GET'):
         args['response'] = 'json'
         args['command'] = command
-        self.request(args, action)
+        url, query = self.sign(args, action)
+        with metrics.ACS_REQUEST_SECONDS.time(command=command):
+            data = self._send_request(command, url, query, action)
+        if data is None:
+            return None
+
+        key = response_key(command)
+        return codec.loads(data)[key]
+
+    def _send_request(self, command, url, query, action):
+        if action == 'GET':
+            return self._call(command, lambda: self._http_get(url))
+        return self._call(
+            command, lambda: self._http_post(url, query), check_status=False
+        )
+
+    def _call(self, command, send, check_status=True, strict=False):
+        """
+        Returns send(), retrying it up to three times on connection errors.
+        With check_status, error statuses are not retried: the ones in
+        EMPTY_RESPONSE_STATUSES return None, or raise ACSError when
+        strict, and the others raise.
+        """
         tries = 3
         while True:
             try:
-                if action == 'GET':
-                    try:
-                        data = self._http_get(self.value)
-                    except urllib.request.HTTPError as err:
-                        if err.status in (404, 431, 530):
-                            logger.warning('Erro get informations in ACS')
-                            return None
-                        else:
-                            logger.exception('Erro get informations in ACS')
-                            raise Exception(err.msg)
-                else:
-                    data = self._http_post(self.value, self.query)
-                break
+                return send()
             except IOError as e:
+                if check_status and isinstance(e, urllib.request.HTTPError):
+                    metrics.ACS_ERRORS.inc(command=command, code=e.code)
+                    if e.code in EMPTY_RESPONSE_STATUSES:
+                        logger.warning('Erro get informations in ACS')
+                        if strict:
+                            raise ACSError(command, e.code)
+                        return None
+                    logger.exception('Erro get informations in ACS')
+                    raise Exception(e.msg)
+                metrics.ACS_ERRORS.inc(command=command, code='io')
                 tries -= 1
                 if not tries:
                     raise e
 
-        key = command.lower() + 'response'
-        if key == 'deletenetworkinglobonetworkresponse':
-            key = 'deletenetworkresponse'
-        if key == 'listglobonetworkpoolsresponse':
-            key = 'listglobonetworkpoolresponse'
-        if key == 'acquirenewlbipresponse':
-            key = 'associateipaddressresponse'
-        if key == 'listcountersresponse':
-            key = 'counterresponse'
-        if key == 'createconditionresponse':
-            key = 'conditionresponse'
-        if key == 'createautoscalepolicyresponse':
-            key = 'autoscalepolicyresponse'
-        if key == 'createautoscalevmprofileresponse':
-            key = 'autoscalevmprofileresponse'
-        if key == 'createautoscalevmgroupresponse':
-            key = 'autoscalevmgroupresponse'
-        if key == 'enableautoscalevmgroupresponse':
-            key = 'enableautoscalevmGroupresponse'
-
-        return json.loads(data)[key]
+    def stream(self, command, args, item_key, strict=False):
+        """
+        Yields the items of a GET list command one by one as they are
+        parsed from the response body, without reading it whole. When
+        strict, the error statuses that otherwise yield nothing raise
+        ACSError, so a failed page is not taken for an empty one.
+        """
+        args['response'] = 'json'
+        args['command'] = command
+        url, _ = self.sign(args, 'GET')
+        start = time.perf_counter()
+        opened = self._call(
+            command, lambda: self.transport.open('GET', url), strict=strict
+        )
+        if opened is None:
+            return
+        response, release = opened
+
+        items = JSONArrayStream(response, item_key)
+        try:
+            yield from items
+        finally:
+            # A partially read body cannot be reused by the next request
+            release(reuse=items.completed)
+            if items.completed:
+                metrics.ACS_REQUEST_SECONDS.observe(
+                    time.perf_counter() - start, command=command
+                )
+
+
+def single_result(response, key):
+    if response and response.get('count') == 1:
+        return response[key][0]
+    return None
+
+
+def list_result(response, key):
+    if not response or not response.get(key):
+        return []
+    return response[key]
 
 
 class CloudstackService(object):
 
-    def __init__(self, cloudstack_client):
+    PROJECT_NOT_FOUND_TTL = 60
+    # Keeps the signed url of a bulk lookup far below common url limits
+    IDS_PER_REQUEST = 40
+    PAGE_SIZE = 500
+    PREFETCH_PAGES = 1
+
+    def __init__(self, cloudstack_client, project_cache=None,
+                 project_not_found_ttl=PROJECT_NOT_FOUND_TTL,
+                 page_size=PAGE_SIZE, prefetch_pages=PREFETCH_PAGES):
         self.cloudstack_client = cloudstack_client
+        self.project_cache = project_cache if project_cache else LRUCache()
+        self.project_not_found_ttl = project_not_found_ttl
+        self.page_size = page_size
+        self.prefetch_pages = prefetch_pages
+        self._zones_by_name = None
+        self._zones_by_id = None
+        self._zones_lock = threading.Lock()
 
     def get_router(self, id):
         routers = self.cloudstack_client.\
             listRouters({'id': id, 'listall': 'true'})
-        if not routers:
-            return None
-        if routers.get('count') == 1:
-            return routers['router'][0]
+        return single_result(routers, 'router')
 
     def get_virtual_machine(self, id):
         virtual_machines = self.cloudstack_client.\
             listVirtualMachines({'id': id, 'listall': 'true'})
-        if not virtual_machines:
-            return None
-        if virtual_machines.get('count') == 1:
-            return virtual_machines['virtualmachine'][0]
+        return single_result(virtual_machines, 'virtualmachine')
+
+    def get_virtual_machines(self, ids, chunk_size=IDS_PER_REQUEST):
+        """
+        Fetches many virtual machines with one listVirtualMachines call per
+        chunk of ids. Returns a dict of virtual machines by id, leaving out
+        the ones not found.
+        """
+        ids = list(dict.fromkeys(id for id in ids if id))
+        virtual_machines = {}
+        for start in range(0, len(ids), chunk_size):
+            chunk = ids[start:start + chunk_size]
+            response = self.cloudstack_client.listVirtualMachines({
+                'ids': ','.join(chunk),
+                'listall': 'true'
+            })
+            for vm in list_result(response, 'virtualmachine'):
+                virtual_machines[vm['id']] = vm
+        return virtual_machines
 
     def list_virtual_machines_by_project(self, project_id, page=1, pagesize=500):
         virtual_machines = self.cloudstack_client. \
@@ -179,9 +290,7 @@ class CloudstackService(object):
                 'page': str(page),
                 'pagesize': str(pagesize)
             })
-        if not virtual_machines or not virtual_machines.get('virtualmachine'):
-            return []
-        return virtual_machines['virtualmachine']
+        return list_result(virtual_machines, 'virtualmachine')
 
     def list_virtual_machines_by_account(self, account_id, page=1, pagesize=500):
         virtual_machines = self.cloudstack_client. \
@@ -191,18 +300,61 @@ class CloudstackService(object):
                 'page': str(page),
                 'pagesize': str(pagesize)
             })
-        if not virtual_machines or not virtual_machines.get('virtualmachine'):
-            return []
-        return virtual_machines['virtualmachine']
+        return list_result(virtual_machines, 'virtualmachine')
+
+    def iter_virtual_machines_by_project(self, project_id, page_size=None):
+        """
+        Yields every virtual machine of the project, going through the
+        pages until the last one. Up to prefetch_pages pages are fetched
+        in background. Raises ACSError when a page fails, instead of ending there.
+        """
+        return self._iter_pages('listVirtualMachines', {
+            'listall': 'true', 'projectid': project_id
+        }, 'virtualmachine', page_size)
+
+    def iter_virtual_machines_by_account(self, account_id, page_size=None):
+        return self._iter_pages('listVirtualMachines', {
+            'listall': 'true', 'accountid': account_id
+        }, 'virtualmachine', page_size)
+
+    def iter_projects(self, page_size=None):
+        return self._iter_pages('listProjects', {
+            'listall': 'true', 'simple': 'true'
+        }, 'project', page_size)
+
+    def iter_accounts(self, page_size=None):
+        return self._iter_pages('listAccounts', {
+            'listall': 'true', 'simple': 'true'
+        }, 'account', page_size)
+
+    def _iter_pages(self, command, args, key, page_size=None):
+        page_size = page_size or self.page_size
+
+        def fetch_page(page):
+            return self.cloudstack_client.stream(command, dict(
+                args, page=str(page), pagesize=str(page_size)
+            ), key, strict=True)
+
+        return iter_pages(fetch_page, page_size, self.prefetch_pages)
 
     def get_project(self, id):
         if id:
+            project = self.project_cache.get(id)
+            if project is not MISSING:
+                return project
+
             projects = self.cloudstack_client.\
                 listProjects({'id': id, 'listall': 'true'})
-            if projects and projects.get('count') == 1:
-                return projects['project'][0]
-            else:
-                return dict()
+            project = single_result(projects, 'project')
+            if project:
+                self.project_cache.set(id, project)
+            elif projects is not None:
+                # Project does not exist, avoid asking ACS again right away
+                project = dict()
+                self.project_cache.set(
+                    id, project, self.project_not_found_ttl
+                )
+            return project or dict()
         else:
             return dict()
 
@@ -217,9 +369,33 @@ class CloudstackService(object):
         return accounts['account']
 
     def get_zone_by_name(self, name):
-        zones = self.cloudstack_client.listZones({'keyword': name})
-        return zones['zone'][0]
+        return self._get_zone('_zones_by_name', name)
 
     def get_zone_by_id(self, id):
-        zones = self.cloudstack_client.listZones({'id': id})
-        return zones['zone'][0]
+        return self._get_zone('_zones_by_id', id)
+
+    def refresh_zones(self):
+        """
+        Reloads the zone index with a single listZones call. A region has
+        only a handful of zones, so all of them are kept in memory. Raises
+        ACSError when listZones fails, keeping the previous index, so a
+        zone is only taken as missing after a successful reload.
+        """
+        response = self.cloudstack_client.listZones({})
+        if response is None:
+            raise ACSError('listZones')
+        zones = list_result(response, 'zone')
+        with self._zones_lock:
+            self._zones_by_name = {zone['name']: zone for zone in zones}
+            self._zones_by_id = {zone['id']: zone for zone in zones}
+        logger.debug('Zone index loaded with %s zones', len(zones))
+
+    def _get_zone(self, index_name, value):
+        if getattr(self, index_name) is None:
+            self.refresh_zones()
+        zone = getattr(self, index_name).get(value)
+        if not zone:
+            logger.debug('Zone %s not indexed, reloading zones', value)
+            self.refresh_zones()
+            zone = getattr(self, index_name).get(value)
+        return zone
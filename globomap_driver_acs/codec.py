@@ -0,0 +1,105 @@
+"""
+   Copyright 2017 Globo.com
+
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+
+       http://www.apache.org/licenses/LICENSE-2.0
+
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+
+   JSON encoding and decoding with the fastest backend installed: orjson,
+   then ujson, then the standard library. Use the module level loads and
+   dumps functions.
+"""
+import importlib
+import logging
+
+from globomap_driver_acs.settings import JSON_BACKEND
+
+logger = logging.getLogger(__name__)
+
+BACKENDS = ['orjson', 'ujson', 'json']
+
+
+class JSONCodec(object):
+    """
+    loads accepts str or bytes. dumps returns UTF-8 encoded bytes.
+    """
+
+    def __init__(self, name, loads, dumps):
+        self.name = name
+        self.loads = loads
+        self.dumps = dumps
+
+
+def _orjson_codec(module):
+    options = module.OPT_NON_STR_KEYS
+    return JSONCodec(
+        'orjson', module.loads,
+        lambda obj: module.dumps(obj, option=options)
+    )
+
+
+def _ujson_codec(module):
+    return JSONCodec(
+        'ujson', module.loads,
+        lambda obj: module.dumps(
+            obj, ensure_ascii=False, escape_forward_slashes=False
+        ).encode('utf-8')
+    )
+
+
+def _json_codec(module):
+    return JSONCodec(
+        'json', module.loads,
+        lambda obj: module.dumps(obj).encode('utf-8')
+    )
+
+
+_FACTORIES = {
+    'orjson': _orjson_codec,
+    'ujson': _ujson_codec,
+    'json': _json_codec
+}
+
+
+def create_codec(name):
+    """
+    Returns the codec of the backend or raises ImportError when it is not
+    installed
+    """
+    if name not in _FACTORIES:
+        raise ValueError('Unknown JSON backend %s' % name)
+    return _FACTORIES[name](importlib.import_module(name))
+
+
+def available_codecs():
+    codecs = []
+    for name in BACKENDS:
+        try:
+            codecs.append(create_codec(name))
+        except ImportError:
+            pass
+    return codecs
+
+
+def get_codec(name=None):
+    """
+    Returns the codec of the given backend, or the first one installed
+    """
+    if name:
+        return create_codec(name)
+    return available_codecs()[0]
+
+
+default_codec = get_codec(JSON_BACKEND)
+logger.debug('Using %s JSON backend', default_codec.name)
+
+loads = default_codec.loads
+dumps = default_codec.dumps
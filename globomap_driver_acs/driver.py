@@ -14,14 +14,22 @@
    limitations under the License.
 """
 import logging
+import time
+from collections import OrderedDict
 
 from pika.exceptions import ConnectionClosed
 
+from globomap_driver_acs import metrics
+from globomap_driver_acs import tracing
+from globomap_driver_acs.cache import LRUCache
 from globomap_driver_acs.cloudstack import CloudStackClient
 from globomap_driver_acs.cloudstack import CloudstackService
 from globomap_driver_acs.load import CloudstackDataLoader
 from globomap_driver_acs.rabbitmq import RabbitMQClient
+from globomap_driver_acs.router import EventRouter
 from globomap_driver_acs.settings import get_setting
+from globomap_driver_acs.transport import PooledTransport
+from globomap_driver_acs.update_handlers import DocumentBuilder
 from globomap_driver_acs.update_handlers import EventTypeHandler
 from globomap_driver_acs.update_handlers import RegionUpdateHandler
 from globomap_driver_acs.update_handlers import VirtualMachineUpdateHandler
@@ -32,77 +40,423 @@ logger = logging.getLogger(__name__)
 
 class Cloudstack(object):
 
+    # Statuses the body must contain, by routing key prefix
+    BODY_FILTERS = [
+        ('management-server.ResourceStateEvent.',
+         EventTypeHandler.POST_STATE_TRANSITION.encode()),
+        ('management-server.ActionEvent.VM-UPGRADE.',
+         EventTypeHandler.UPGRADE_COMPLETED.encode()),
+        ('management-server.ActionEvent.ZONE-EDIT.',
+         EventTypeHandler.ZONE_EDIT_COMPLETED.encode())
+    ]
+
     def __init__(self, params):
         self.env = params.get('env')
+        self.document_builder = DocumentBuilder.for_env(self.env)
+        self.router = self._create_router()
+        self.tracer = self._create_tracer()
+        self._unacked = {}
+        metrics.start_exporter()
         self._connect_rabbit()
         self._create_queue_binds()
+        self._connect_cloudstack()
+
+    def reconnect(self):
+        """
+        Replaces the ACS client, service and handlers by new ones, dropping
+        pooled connections and cached zones and projects
+        """
+        self._close_cloudstack()
+        self._connect_cloudstack()
+
+    def close(self):
+        self._close_cloudstack()
+        self.rabbitmq.close()
 
     def process_updates(self, callback):
         """
         Reads and processes messages from the Cloudstack event bus until
         there's no message left in the target queue. Only acks message if
         processed successfully by the callback.
+
+        Messages are polled one by one with basic_get unless RMQ_CONSUMER
+        is 'push', which consumes them with basic_consume and acks every
+        RMQ_ACK_BATCH successfully processed messages at once. With a
+        COALESCE_WINDOW, events of the same VM inside the window are
+        processed once and acked together.
         """
         while True:
-            delivery_tag = None
             try:
-                raw_msg, delivery_tag = self.rabbitmq.get_message()
-                if raw_msg:
-                    for update in self._create_updates(raw_msg):
-                        callback(update)
-
-                    self.rabbitmq.ack_message(delivery_tag)
-                else:
-                    return
+                self._process_messages(callback)
+                logger.debug('Dispatched events: %s', self.router.stats())
+                return
             except ConnectionClosed:
                 logger.error('Error connecting to RabbitMQ, reconnecting')
+                self._unacked = {}
                 self._connect_rabbit()
-            except Exception:
-                logger.exception('Error processing message')
-                self.rabbitmq.nack_message(delivery_tag)
-                raise
 
-    def full_load(self):
-        CloudstackDataLoader(self.env, self._create_updates).run()
+    def _process_messages(self, callback):
+        push = self._get_setting('RMQ_CONSUMER', 'poll') == 'push'
+        window = float(self._get_setting('COALESCE_WINDOW', '0'))
+
+        if window > 0:
+            self._process_coalesced(callback, window, push)
+            return
+
+        messages = self._read_messages(push)
+        try:
+            self._process_one_by_one(messages, callback, push)
+        finally:
+            messages.close()
+
+    def _process_one_by_one(self, messages, callback, push):
+        ack_batch = 1
+        if push:
+            # The broker stops pushing at the prefetch count until an ack
+            ack_batch = min(int(self._get_setting('RMQ_ACK_BATCH', 50)),
+                            self._get_prefetch_count())
+        last_tag = None
+        unacked = 0
+        delivery_tag = None
+        try:
+            for raw_msg, delivery_tag in messages:
+                self._process_message(raw_msg, callback)
+
+                last_tag = delivery_tag
+                unacked += 1
+                if unacked >= ack_batch:
+                    self._ack(last_tag, push)
+                    unacked = 0
+                delivery_tag = None
+            if unacked:
+                self._ack(last_tag, push)
+        except ConnectionClosed:
+            raise
+        except Exception:
+            logger.exception('Error processing message')
+            if unacked:
+                self._ack(last_tag, push)
+            self._nack(delivery_tag)
+            raise
+
+    def _process_coalesced(self, callback, window, push):
+        """
+        Buffers messages for up to `window` seconds from the first one and
+        processes each virtual machine once per window with its newest
+        event
+        """
+        max_messages = int(self._get_setting('COALESCE_MAX_MESSAGES', 500))
+        if push:
+            # The broker stops pushing at the prefetch count until an ack,
+            # so a larger batch would only wait for the window to end
+            prefetch_count = self._get_prefetch_count()
+            max_messages = min(max_messages, prefetch_count)
+            self.rabbitmq.set_prefetch(prefetch_count)
+        try:
+            drained = False
+            while not drained:
+                batch, drained = self._read_window(window, max_messages, push)
+                if not batch:
+                    return
+                self._process_window(batch, callback)
+        finally:
+            if push:
+                self.rabbitmq.cancel_consumer()
+
+    def _read_window(self, window, max_messages, push):
+        """
+        Returns the messages of a window and whether polling found the
+        queue empty. Pushed messages are waited for up to
+        RMQ_INACTIVITY_TIMEOUT for the first one, then until the window
+        ends.
+        """
+        inactivity_timeout = float(
+            self._get_setting('RMQ_INACTIVITY_TIMEOUT', 1)
+        )
+        batch = []
+        deadline = None
+        while len(batch) < max_messages:
+            if not push:
+                delivery = self.rabbitmq.get_delivery()
+            elif deadline is None:
+                delivery = self.rabbitmq.wait_delivery(inactivity_timeout)
+            else:
+                delivery = self.rabbitmq.wait_delivery(
+                    deadline - time.monotonic()
+                )
+            if not delivery:
+                return batch, not push
+            batch.append(self._read_message(delivery))
+            if deadline is None:
+                deadline = time.monotonic() + window
+            if time.monotonic() >= deadline:
+                break
+        return batch, False
+
+    def _process_window(self, batch, callback):
+        units = self._coalesce(batch)
+        logger.debug('Coalesced %s messages into %s', len(batch), len(units))
+        processed = set()
+        try:
+            vms = self._prefetch_virtual_machines(
+                [raw_msg for raw_msg, _ in units]
+            )
+            for raw_msg, delivery_tags in units:
+                self._process_message(raw_msg, callback, vms)
+                processed.update(delivery_tags)
+        except ConnectionClosed:
+            raise
+        except Exception:
+            logger.exception('Error processing message')
+            for _, delivery_tag in batch:
+                if delivery_tag in processed:
+                    self._ack(delivery_tag, False)
+                else:
+                    self._nack(delivery_tag)
+            raise
+
+        self._ack(max(tag for _, tag in batch), True)
+
+    def _prefetch_virtual_machines(self, raw_msgs):
+        vm_ids = [VirtualMachineUpdateHandler.get_vm_id(raw_msg)
+                  for raw_msg in raw_msgs
+                  if EventTypeHandler.is_vm_update_event(raw_msg)]
+        if len(vm_ids) < 2:
+            return None
+        return self.acs_service.get_virtual_machines(vm_ids)
 
-    def _create_updates(self, raw_msg):
+    def _coalesce(self, batch):
+        """
+        Groups VM update events by VM id. Each group is placed where its
+        newest event arrived, so it keeps its order relative to zone
+        events. A VM.DESTROY closes the group of its VM: later events
+        start a new one, so a create before it does not put back the
+        edges it deletes. Returns (raw_msg, delivery_tags) tuples.
+        """
+        groups = OrderedDict()
+        open_groups = {}
+        for index, (raw_msg, delivery_tag) in enumerate(batch):
+            key = index
+            if EventTypeHandler.is_vm_update_event(raw_msg):
+                vm_id = VirtualMachineUpdateHandler.get_vm_id(raw_msg)
+                if vm_id:
+                    key = open_groups.setdefault(vm_id, index)
+            elif EventTypeHandler.is_vm_delete_event(raw_msg):
+                open_groups.pop(
+                    VirtualMachineUpdateHandler.get_vm_id(raw_msg), None
+                )
+            raw_msgs, delivery_tags = groups.pop(key, ([], []))
+            groups[key] = (
+                raw_msgs + [raw_msg], delivery_tags + [delivery_tag]
+            )
+
+        return [(self._merge_events(raw_msgs), delivery_tags)
+                for raw_msgs, delivery_tags in groups.values()]
+
+    def _merge_events(self, raw_msgs):
+        newest = raw_msgs[-1]
+        if EventTypeHandler.is_vm_create_event(newest):
+            return newest
+        for raw_msg in raw_msgs:
+            if EventTypeHandler.is_vm_create_event(raw_msg):
+                # Keeps the create so dictionary edges are still emitted
+                return dict(raw_msg, eventDateTime=newest.get('eventDateTime'))
+        return newest
+
+    def _read_messages(self, push):
+        for delivery in self._read_deliveries(push):
+            yield self._read_message(delivery)
+
+    def _read_message(self, delivery):
+        if self._is_relevant(delivery):
+            raw_msg = delivery.json()
+            event = self._event_name(raw_msg)
+        else:
+            # Not parsed, but still acked along with the other messages
+            raw_msg, event = {}, 'ignored'
+        metrics.MESSAGES_CONSUMED.inc(event=event)
+        self._unacked[delivery.delivery_tag] = event
+        return raw_msg, delivery.delivery_tag
+
+    def _read_deliveries(self, push):
+        if push:
+            yield from self.rabbitmq.consume_deliveries(
+                prefetch_count=self._get_prefetch_count(),
+                inactivity_timeout=float(
+                    self._get_setting('RMQ_INACTIVITY_TIMEOUT', 1)
+                )
+            )
+            return
+
+        while True:
+            delivery = self.rabbitmq.get_delivery()
+            if not delivery:
+                return
+            yield delivery
+
+    def _get_prefetch_count(self):
+        return int(self._get_setting('RMQ_PREFETCH', 100))
+
+    def _is_relevant(self, delivery):
+        """
+        Checks the body of messages whose routing key is shared with
+        events the driver ignores for the status it needs, before
+        spending time parsing it
+        """
+        for prefix, status in self.BODY_FILTERS:
+            if delivery.routing_key.startswith(prefix):
+                return status in delivery.body
+        return True
+
+    def _ack(self, delivery_tag, multiple):
+        # Broker deliveries on a channel are ordered, so a multiple ack
+        # covers exactly the contiguous range processed so far
+        if multiple:
+            self.rabbitmq.ack_message(delivery_tag, multiple=True)
+            tags = [tag for tag in self._unacked if tag <= delivery_tag]
+        else:
+            self.rabbitmq.ack_message(delivery_tag)
+            tags = [delivery_tag]
+        for tag in tags:
+            self._count_message(metrics.MESSAGES_ACKED, tag)
+
+    def _nack(self, delivery_tag):
+        self.rabbitmq.nack_message(delivery_tag)
+        self._count_message(metrics.MESSAGES_NACKED, delivery_tag)
+
+    def _count_message(self, counter, delivery_tag):
+        event = self._unacked.pop(delivery_tag, None)
+        if event:
+            counter.inc(event=event)
+
+    def _process_message(self, raw_msg, callback, vms=None):
+        with self.tracer.trace('event', event=self._event_name(raw_msg),
+                               id=raw_msg.get('id')):
+            for update in self._create_updates(raw_msg, vms):
+                self._emit(callback, update)
+
+    def _emit(self, callback, update):
+        with tracing.span('callback'), metrics.CALLBACK_SECONDS.time():
+            callback(update)
+
+    @staticmethod
+    def _event_name(raw_msg):
+        return raw_msg.get('event') or raw_msg.get('resource') or 'unknown'
+
+    def full_load(self, force_full=False):
+        """
+        Loads every virtual machine. With a LOADER_STATE_FILE only the
+        documents changed since the last load are published, unless
+        force_full is given.
+        """
+        CloudstackDataLoader(
+            self.env, self._create_updates, self._create_loaded_vm_updates,
+            acs_service=self.acs_service, force_full=force_full
+        ).run()
+
+    def _create_updates(self, raw_msg, vms=None):
         """
         Creates update documents for every create, upgrade or power
         state change events for Cloudstack virtual machines. On newly created
         virtual machines also creates edges documents so the VM can be
-        linked to it's client business service and business process
+        linked to it's client business service and business process.
+        Virtual machines already fetched can be given by id in vms.
         """
-        acs_service = self._get_cloudstack_service()
-        updates = []
+        with self.tracer.trace('create_updates'), \
+                self.document_builder.batch():
+            return self._count_documents(self._build_updates(raw_msg, vms))
 
-        vm_update_handler = VirtualMachineUpdateHandler(self.env, acs_service)
+    def _build_updates(self, raw_msg, vms):
+        updates = self.router.dispatch(raw_msg, vms)
+        return [] if updates is None else updates
 
-        if EventTypeHandler.is_vm_update_event(raw_msg):
-            vm_id = vm_update_handler.get_vm_id(raw_msg)
+    def _create_router(self):
+        """
+        Routes each kind of event to its handler. New kinds of events can
+        be added with self.router.register.
+        """
+        router = EventRouter()
+        router.register(
+            self._create_vm_event_updates, name='vm_create',
+            event=EventTypeHandler.VM_CREATE_EVENT,
+            resource=EventTypeHandler.VM_RESOURCE
+        )
+        router.register(
+            self._create_vm_event_updates, name='vm_upgrade',
+            event=EventTypeHandler.VM_UPGRADE_EVENT,
+            status=EventTypeHandler.UPGRADE_COMPLETED
+        )
+        router.register(
+            self._create_vm_event_updates, name='vm_power_state',
+            resource=EventTypeHandler.VM_STATE_RESOURCE,
+            status=EventTypeHandler.POST_STATE_TRANSITION
+        )
+        router.register(
+            self._create_vm_cleanup_updates, name='vm_delete',
+            event=EventTypeHandler.VM_DELETE_EVENT,
+            resource=EventTypeHandler.VM_RESOURCE
+        )
+        router.register(
+            self._create_zone_updates, name='zone_edit',
+            event=EventTypeHandler.ZONE_EDIT,
+            status=EventTypeHandler.ZONE_EDIT_COMPLETED
+        )
+        return router
 
-            if vm_id:
-                vm = acs_service.get_virtual_machine(vm_id)
-                if vm:
-                    logger.debug('Creating updates for event: %s' % raw_msg)
-                    project = acs_service.get_project(vm.get('projectid'))
-                    vm_update_handler.create_vm_updates(
-                        updates, raw_msg, project, vm
-                    )
+    def _create_vm_event_updates(self, raw_msg, vms=None):
+        vm_id = self.vm_update_handler.get_vm_id(raw_msg)
+        if not vm_id:
+            logger.error('VM Id not found in message: %s', raw_msg)
+            return []
 
-                    region_handler = RegionUpdateHandler(self.env, acs_service)
-                    region_handler.create_region_update(updates)
-            else:
-                logger.error('VM Id not found in message: %s', raw_msg)
+        vm = vms.get(vm_id) if vms else None
+        if not vm:
+            with tracing.span('acs_fetch'):
+                vm = self.acs_service.get_virtual_machine(vm_id)
+        if not vm:
+            return []
+        logger.debug('Creating updates for event: %s' % raw_msg)
+        with tracing.span('project_lookup'):
+            project = self.acs_service.get_project(vm.get('projectid'))
+        return self._create_vm_updates(raw_msg, vm, project)
 
-        elif EventTypeHandler.is_vm_delete_event(raw_msg):
-            logger.debug('Creating cleanup updates for event: %s' % raw_msg)
-            vm_update_handler.create_vm_cleanup_updates(updates, raw_msg)
+    def _create_vm_cleanup_updates(self, raw_msg, vms=None):
+        logger.debug('Creating cleanup updates for event: %s' % raw_msg)
+        updates = []
+        self.vm_update_handler.create_vm_cleanup_updates(updates, raw_msg)
+        return updates
 
-        elif EventTypeHandler.is_zone_change_state_event(raw_msg):
-            zone_handler = ZoneUpdateHandler(self.env, acs_service)
-            zone_id = raw_msg.get('entityuuid')
-            zone_handler.create_zone_status_update(updates, zone_id)
+    def _create_zone_updates(self, raw_msg, vms=None):
+        self.acs_service.refresh_zones()
+        updates = []
+        self.zone_handler.create_zone_status_update(
+            updates, raw_msg.get('entityuuid')
+        )
+        return updates
 
+    def _create_loaded_vm_updates(self, raw_msg, vm, project):
+        with self.tracer.trace('full_load_vm', id=vm.get('id')):
+            return self._count_documents(
+                self._create_vm_updates(raw_msg, vm, project)
+            )
+
+    def _count_documents(self, updates):
+        metrics.DOCUMENTS.inc_each(
+            update.get('collection') for update in updates
+        )
+        return updates
+
+    def _create_vm_updates(self, raw_msg, vm, project):
+        """
+        Creates the update documents of an already fetched virtual machine
+        and its project, without calling ACS for them again
+        """
+        updates = []
+        with tracing.span('documents'), self.document_builder.batch():
+            self.vm_update_handler.create_vm_updates(
+                updates, raw_msg, project, vm
+            )
+            self.region_handler.create_region_update(updates)
         return updates
 
     def _connect_rabbit(self):
@@ -137,12 +491,69 @@ class Cloudstack(object):
             'ZONE-EDIT.DataCenter.*'
         ])
 
+    def _connect_cloudstack(self):
+        # Shared by every message so pooled connections and cached zones
+        # and projects survive between events
+        self.acs_service = self._get_cloudstack_service()
+        self.vm_update_handler = VirtualMachineUpdateHandler(
+            self.env, self.acs_service
+        )
+        self.zone_handler = ZoneUpdateHandler(self.env, self.acs_service)
+        self.region_handler = RegionUpdateHandler(self.env, self.acs_service)
+        metrics.CACHE_HIT_RATIO.set_function(
+            self.acs_service.project_cache.hit_ratio,
+            cache='project', env=self.env
+        )
+
+    def _close_cloudstack(self):
+        self.acs_service.cloudstack_client.close()
+
     def _get_cloudstack_service(self):
-        return CloudstackService(CloudStackClient(
-            self._get_setting('API_URL'),
-            self._get_setting('API_KEY'),
-            self._get_setting('API_SECRET_KEY')
-        ))
+        return CloudstackService(
+            CloudStackClient(
+                self._get_setting('API_URL'),
+                self._get_setting('API_KEY'),
+                self._get_setting('API_SECRET_KEY'),
+                transport=self._get_transport()
+            ),
+            project_cache=self._get_project_cache(),
+            project_not_found_ttl=int(
+                self._get_setting('PROJECT_NOT_FOUND_CACHE_TTL', 60)
+            ),
+            page_size=int(self._get_setting('API_PAGE_SIZE', 500)),
+            prefetch_pages=int(self._get_setting('API_PREFETCH_PAGES', 1))
+        )
+
+    def _create_tracer(self):
+        """
+        Traces each event when TRACE_SINKS names sinks, and profiles a
+        PROFILE_SAMPLE_RATE part of them, keeping the profile of the ones
+        slower than PROFILE_THRESHOLD seconds
+        """
+        return tracing.Tracer(
+            tracing.create_sinks(
+                self._get_setting('TRACE_SINKS'),
+                float(self._get_setting('TRACE_LOG_THRESHOLD', '0'))
+            ),
+            profile_threshold=float(
+                self._get_setting('PROFILE_THRESHOLD', 1)
+            ),
+            profile_rate=float(self._get_setting('PROFILE_SAMPLE_RATE', '0')),
+            profile_dir=self._get_setting('PROFILE_DIR')
+        )
+
+    def _get_project_cache(self):
+        return LRUCache(
+            max_size=int(self._get_setting('PROJECT_CACHE_SIZE', 5000)),
+            ttl=int(self._get_setting('PROJECT_CACHE_TTL', 300))
+        )
+
+    def _get_transport(self):
+        return PooledTransport(
+            pool_size=int(self._get_setting('API_POOL_SIZE', 10)),
+            idle_timeout=int(self._get_setting('API_POOL_IDLE_TIMEOUT', 60)),
+            timeout=int(self._get_setting('API_TIMEOUT', 60))
+        )
 
     def _get_setting(self, key, default=None):
         return get_setting(self.env, key, default)
@@ -14,20 +14,26 @@
    limitations under the License.
 """
 import datetime
-import json
 import logging
-import math
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
 from time import time
 
 from globomap_loader_api_client import auth
 from globomap_loader_api_client.update import Update
 
+from globomap_driver_acs import codec
 from globomap_driver_acs.cloudstack import CloudStackClient
 from globomap_driver_acs.cloudstack import CloudstackService
+from globomap_driver_acs.memory import MemoryProfiler
+from globomap_driver_acs.publisher import BatchPublisher
 from globomap_driver_acs.settings import get_setting
 from globomap_driver_acs.settings import GLOBOMAP_LOADER_API_PASSWORD
 from globomap_driver_acs.settings import GLOBOMAP_LOADER_API_URL
 from globomap_driver_acs.settings import GLOBOMAP_LOADER_API_USERNAME
+from globomap_driver_acs.state import LoadState
+from globomap_driver_acs.transport import PooledTransport
 from globomap_driver_acs.update_handlers import Collection
 from globomap_driver_acs.update_handlers import Edge
 from globomap_driver_acs.update_handlers import GloboMapActions
@@ -38,56 +44,158 @@ logger = logging.getLogger(__name__)
 
 class CloudstackDataLoader(object):
 
-    def __init__(self, env, create_updates):
+    def __init__(self, env, create_updates, create_vm_updates=None,
+                 acs_service=None, force_full=False):
         self.env = env
         self.create_updates = create_updates
+        self.create_vm_updates = create_vm_updates
+        self.acs_service = acs_service
+        self.workers = int(self._get_setting('LOADER_WORKERS', 1))
 
-        auth_inst = auth.Auth(
+        self.auth = auth.Auth(
             api_url=GLOBOMAP_LOADER_API_URL,
             username=GLOBOMAP_LOADER_API_USERNAME,
             password=GLOBOMAP_LOADER_API_PASSWORD
         )
-        self.update = Update(auth=auth_inst, driver_name='cloudstack')
+        self._local = threading.local()
+        self.update = self._get_update()
+        self.publisher = BatchPublisher(
+            self._send,
+            max_documents=int(self._get_setting('LOADER_BATCH_SIZE', 1000)),
+            max_bytes=int(self._get_setting('LOADER_BATCH_BYTES', 4194304)),
+            linger=float(self._get_setting('LOADER_BATCH_LINGER', 5))
+        )
+        self._executor = None
+        self._futures = []
+        self.memory_profiler = self._create_memory_profiler()
+        self.state = self._create_state(force_full)
 
     def run(self):
         start_time = int(time())
-        acs_service = self._get_cloudstack_service()
-        self._process_accounts(acs_service)
-        self._process_projects(acs_service)
-        self._clear_not_updated_elements(start_time)
+        acs_service = self.acs_service or self._get_cloudstack_service()
+        if self.workers > 1:
+            logger.info('Loading with %s workers' % self.workers)
+            self._executor = ThreadPoolExecutor(max_workers=self.workers)
+        if self.memory_profiler:
+            self.memory_profiler.start()
+        try:
+            self._load(acs_service, start_time)
+        finally:
+            if self.memory_profiler:
+                self.memory_profiler.stop()
         logger.info('Processing finished')
 
+    def _load(self, acs_service, start_time):
+        try:
+            with self._phase('accounts'):
+                self._process_accounts(acs_service)
+            with self._phase('projects'):
+                self._process_projects(acs_service)
+            self._wait_workers()
+        finally:
+            self._shutdown_workers()
+            self.publisher.flush()
+        with self._phase('clear'):
+            if not self.state or self.state.needs_clear:
+                self._clear_not_updated_elements(start_time)
+            else:
+                self._delete_missing_elements()
+        if self.state:
+            self.state.save()
+
+    @contextmanager
+    def _phase(self, name):
+        # While profiling, workers finish each phase before the next one
+        # starts so its memory is not counted in the next phase
+        if not self.memory_profiler:
+            yield
+            return
+        with self.memory_profiler.phase(name):
+            yield
+            self._wait_workers()
+
     def _process_projects(self, acs_service):
-        projects = acs_service.list_projects()
-        logger.info('%s projects found. Processing:' % len(projects))
-        for project in projects:
+        count = 0
+        for project in acs_service.iter_projects():
             prj_name = project.get('name', project.get('displaytext'))
             logger.info('Processing project %s' % prj_name)
-            pages = math.ceil(project.get('vmtotal', 0) / 500)
-            for page in range(1, pages + 1):
-                vms = acs_service.list_virtual_machines_by_project(
-                    project['id'], page, 500)
-                logger.info('Creating %s VM events' % len(vms))
-
-                for vm in vms:
-                    event = self._create_event(vm['id'])
-                    self._publish_updates(self.create_updates(event))
+            if project.get('vmtotal'):
+                self._process_owner(
+                    acs_service,
+                    acs_service.iter_virtual_machines_by_project,
+                    project['id']
+                )
+            count += 1
+        logger.info('%s projects found' % count)
 
     def _process_accounts(self, acs_service):
-        accounts = acs_service.list_accounts()
-        logger.info('%s accounts found. Processing:' % len(accounts))
-        for account in accounts:
+        count = 0
+        for account in acs_service.iter_accounts():
             prj_name = account.get('name', account.get('displaytext'))
             logger.info('Processing account %s' % prj_name)
-            pages = math.ceil(account.get('vmtotal', 0) / 500)
-            for page in range(1, pages + 1):
-                vms = acs_service.list_virtual_machines_by_account(
-                    account['id'], page, 500)
-                logger.info('Creating %s VM events' % len(vms))
+            if account.get('vmtotal'):
+                self._process_owner(
+                    acs_service,
+                    acs_service.iter_virtual_machines_by_account,
+                    account['id']
+                )
+            count += 1
+        logger.info('%s accounts found' % count)
+
+    def _process_owner(self, acs_service, iter_vms, owner_id):
+        """
+        Processes the VMs of a project or account right away, or hands
+        them to the worker pool when running with more than one worker
+        """
+        if self._executor:
+            self._futures.append(self._executor.submit(
+                self._load_vms, acs_service, iter_vms, owner_id
+            ))
+        else:
+            self._load_vms(acs_service, iter_vms, owner_id)
+
+    def _load_vms(self, acs_service, iter_vms, owner_id):
+        # The next pages are read in background, up to API_PREFETCH_PAGES
+        # ahead, while these VMs are processed
+        count = 0
+        for vm in iter_vms(owner_id):
+            self._publish_updates(self._create_vm_updates(acs_service, vm))
+            count += 1
+            if self.memory_profiler and not count % self.page_size:
+                self._end_page(owner_id, count)
+        if self.memory_profiler and count % self.page_size:
+            self._end_page(owner_id, count)
+        logger.info('Created %s VM events' % count)
+
+    def _end_page(self, owner_id, count):
+        self.memory_profiler.page('%s page %s' % (
+            owner_id, (count - 1) // self.page_size + 1))
+
+    def _wait_workers(self):
+        # Raises the first worker error so old elements are not cleared
+        # after an incomplete load
+        for future in self._futures:
+            future.result()
 
-                for vm in vms:
-                    event = self._create_event(vm['id'])
-                    self._publish_updates(self.create_updates(event))
+    def _shutdown_workers(self):
+        if self._executor:
+            for future in self._futures:
+                future.cancel()
+            self._executor.shutdown(wait=True)
+            self._executor = None
+        self._futures = []
+
+    def _create_vm_updates(self, acs_service, vm):
+        """
+        Builds the updates straight from the listed VM. The project comes
+        from the service cache, so there is one listProjects call per
+        project instead of two ACS calls per VM.
+        """
+        event = self._create_event(vm['id'])
+        if not self.create_vm_updates:
+            return self.create_updates(event)
+        project = acs_service.get_project(vm.get('projectid'))
+        return self.create_vm_updates(event, vm, project)
 
     def _create_event(self, vm_id):
         event_date = datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')
@@ -99,8 +207,10 @@ class CloudstackDataLoader(object):
         }
 
     def _publish_updates(self, updates):
+        if self.state:
+            updates = self.state.filter(updates)
         try:
-            self._send(updates)
+            self.publisher.publish(updates)
         except Exception:
             logger.exception('Unable to publish event. Aborting execution')
             raise
@@ -135,7 +245,14 @@ class CloudstackDataLoader(object):
         clears.append(self._clear(
             Edge.HOST_COMP_UNIT, Edge.type_name(), start_time
         ))
-        self._send(clears)
+        if self._send(clears) and self.state:
+            self.state.mark_cleared()
+
+    def _delete_missing_elements(self):
+        deletions = self.state.deletions()
+        logger.info('[Delete] Deleting %s missing elements' % len(deletions))
+        self.publisher.publish(deletions)
+        self.publisher.flush()
 
     def _clear(self, collection, type, timestamp):
         logger.info("Cleaning '%s' before %s" % (collection, timestamp))
@@ -153,13 +270,68 @@ class CloudstackDataLoader(object):
     def _filter(self, field, value, operator):
         return {'field': field, 'value': value, 'operator': operator}
 
-    def _send(self, data):
+    def _send(self, data, body=None):
+        # The client posts already encoded bodies as they are
+        if body is None:
+            body = codec.dumps(data)
         try:
-            res = self.update.post(data)
+            res = self._get_update().post(body)
         except Exception:
-            logger.exception('Message dont sent %s', json.dumps(data))
+            logger.exception('Message dont sent %s', body)
+            if self.state:
+                self.state.discard(data)
+            return False
         else:
             logger.debug('Message was sent %s', res)
+            return True
+
+    def _get_update(self):
+        # requests sessions are not shared between worker threads
+        if not hasattr(self._local, 'update'):
+            self._local.update = Update(
+                auth=self.auth, driver_name='cloudstack'
+            )
+        return self._local.update
+
+    def _create_memory_profiler(self):
+        """
+        Profiles the memory of each phase and page of the load with
+        tracemalloc when MEMORY_REPORT names the file of the report
+        """
+        report_path = self._get_setting('MEMORY_REPORT')
+        if not report_path:
+            return None
+        self.page_size = int(self._get_setting('API_PAGE_SIZE', 500))
+        return MemoryProfiler(
+            report_path,
+            top=int(self._get_setting('MEMORY_REPORT_TOP', 20)),
+            frames=int(self._get_setting('MEMORY_REPORT_FRAMES', 1))
+        )
+
+    def _create_state(self, force_full):
+        """
+        Publishes only the documents changed since the last load when
+        LOADER_STATE_FILE names where their hashes are kept. Everything
+        is published when forced, or when the last full publish is older
+        than LOADER_STATE_MAX_AGE seconds. With LOADER_CLEAR_INTERVAL,
+        missing documents are deleted by key and the timestamp clear only
+        runs once per interval.
+        """
+        state_file = self._get_setting('LOADER_STATE_FILE')
+        if not state_file:
+            return None
+        force_full = force_full or self._get_setting(
+            'LOADER_FORCE_FULL', '0').lower() in ('1', 'true', 'yes')
+        return LoadState(
+            state_file, force_full=force_full,
+            max_age=int(self._get_setting('LOADER_STATE_MAX_AGE', '86400')),
+            clear_interval=int(
+                self._get_setting('LOADER_CLEAR_INTERVAL', '0')
+            ),
+            max_delete_ratio=float(
+                self._get_setting('LOADER_MAX_DELETE_RATIO', '0.5')
+            )
+        )
 
     def _get_cloudstack_service(self):
         acs_url = self._get_setting('API_URL')
@@ -167,9 +339,21 @@ class CloudstackDataLoader(object):
         acs_client = CloudStackClient(
             acs_url,
             self._get_setting('API_KEY'),
-            self._get_setting('API_SECRET_KEY'), True
+            self._get_setting('API_SECRET_KEY'), True,
+            transport=self._get_transport()
+        )
+        return CloudstackService(
+            acs_client,
+            page_size=int(self._get_setting('API_PAGE_SIZE', 500)),
+            prefetch_pages=int(self._get_setting('API_PREFETCH_PAGES', 1))
+        )
+
+    def _get_transport(self):
+        return PooledTransport(
+            pool_size=int(self._get_setting('API_POOL_SIZE', 10)),
+            idle_timeout=int(self._get_setting('API_POOL_IDLE_TIMEOUT', 60)),
+            timeout=int(self._get_setting('API_TIMEOUT', 60))
         )
-        return CloudstackService(acs_client)
 
     def _get_setting(self, key, default=None):
         return get_setting(self.env, key, default)
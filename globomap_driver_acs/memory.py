@@ -0,0 +1,164 @@
+"""
+   Copyright 2017 Globo.com
+
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+
+       http://www.apache.org/licenses/LICENSE-2.0
+
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+"""
+import logging
+import threading
+import tracemalloc
+from contextlib import contextmanager
+
+logger = logging.getLogger(__name__)
+
+IGNORED_TRACES = (
+    tracemalloc.Filter(False, tracemalloc.__file__),
+    tracemalloc.Filter(False, __file__),
+    tracemalloc.Filter(False, '<frozen importlib._bootstrap>'),
+    tracemalloc.Filter(False, '<frozen importlib._bootstrap_external>'),
+    tracemalloc.Filter(False, '<unknown>')
+)
+
+# tracemalloc.reset_peak was only added in Python 3.9.
+RESETS_PEAK = hasattr(tracemalloc, 'reset_peak')
+
+
+class PhaseStats(object):
+
+    def __init__(self, name, peak, retained, top=None):
+        self.name = name
+        self.peak = peak
+        self.retained = retained
+        self.top = top or []
+
+
+class MemoryProfiler(object):
+    """
+    Follows the memory of a run with tracemalloc. Each phase records the
+    peak memory traced while it ran, the memory still retained when it
+    ended and the allocation sites that grew the most since the run
+    started. Pages only record their peak and retained memory, as they
+    are too many to snapshot, except for the page with the largest peak.
+    The report is written to report_path after every phase, so a run
+    killed midway still leaves one. Before Python 3.9 the peak cannot be
+    reset, so a phase or page whose peak does not rise above the earlier
+    ones records the memory traced when it ends instead.
+    """
+
+    def __init__(self, report_path=None, top=20, frames=1):
+        self.report_path = report_path
+        self.top = top
+        self.frames = frames
+        self.phases = []
+        self.pages = []
+        self.largest_page = None
+        self._baseline = None
+        self._phase_peak = 0
+        self._last_peak = 0
+        self._started_tracing = False
+        self._lock = threading.Lock()
+
+    def start(self):
+        if not tracemalloc.is_tracing():
+            tracemalloc.start(self.frames)
+            self._started_tracing = True
+        self._baseline = self._snapshot()
+        self._reset_peak()
+
+    def stop(self):
+        self.write_report()
+        if self._started_tracing:
+            tracemalloc.stop()
+            self._started_tracing = False
+
+    @contextmanager
+    def phase(self, name):
+        with self._lock:
+            self._reset_peak()
+            self._phase_peak = 0
+        try:
+            yield
+        finally:
+            with self._lock:
+                retained, peak = self._traced_memory()
+                peak = max(peak, self._phase_peak)
+            self.phases.append(PhaseStats(name, peak, retained, self._top()))
+            if self.report_path:
+                self.write_report()
+
+    def page(self, name):
+        """
+        Records the memory of the page that just ended. Pages loaded in
+        parallel share their peaks.
+        """
+        with self._lock:
+            retained, peak = self._traced_memory()
+            self._reset_peak()
+            self._phase_peak = max(self._phase_peak, peak)
+            page = PhaseStats(name, peak, retained)
+            self.pages.append(page)
+            if not self.largest_page or peak > self.largest_page.peak:
+                page.top = self._top()
+                self.largest_page = page
+
+    def _reset_peak(self):
+        if RESETS_PEAK:
+            tracemalloc.reset_peak()
+        self._last_peak = tracemalloc.get_traced_memory()[1]
+
+    def _traced_memory(self):
+        retained, peak = tracemalloc.get_traced_memory()
+        if not RESETS_PEAK and peak <= self._last_peak:
+            peak = retained
+        return retained, peak
+
+    def _snapshot(self):
+        return tracemalloc.take_snapshot().filter_traces(IGNORED_TRACES)
+
+    def _top(self):
+        stats = self._snapshot().compare_to(self._baseline, 'lineno')
+        return [stat for stat in stats if stat.size_diff > 0][:self.top]
+
+    def report(self):
+        lines = ['%-30s %12s %12s' % ('phase', 'peak KiB', 'retained KiB')]
+        for phase in self.phases:
+            lines.append('%-30s %12.0f %12.0f' % (
+                phase.name, phase.peak / 1024, phase.retained / 1024))
+
+        phases = list(self.phases)
+        if self.pages:
+            largest = self.largest_page
+            average = sum(page.peak for page in self.pages) / len(self.pages)
+            lines.append('')
+            lines.append('%s pages, average peak %.0f KiB, largest %.0f KiB '
+                         'on %s' % (len(self.pages), average / 1024,
+                                    largest.peak / 1024, largest.name))
+            phases.append(largest)
+
+        for phase in phases:
+            lines.append('')
+            lines.append('Top allocation sites retained after %s:' %
+                         phase.name)
+            for stat in phase.top:
+                frame = stat.traceback[0]
+                lines.append('  %s:%s %.1f KiB in %s blocks' % (
+                    frame.filename, frame.lineno,
+                    stat.size_diff / 1024, stat.count_diff))
+        return '\n'.join(lines) + '\n'
+
+    def write_report(self):
+        report = self.report()
+        if not self.report_path:
+            logger.info('Memory report:\n%s', report)
+            return
+        with open(self.report_path, 'w') as report_file:
+            report_file.write(report)
@@ -0,0 +1,339 @@
+"""
+   Copyright 2017 Globo.com
+
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+
+       http://www.apache.org/licenses/LICENSE-2.0
+
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+"""
+import bisect
+import logging
+import socketserver
+import threading
+import time
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler
+from http.server import HTTPServer
+
+from globomap_driver_acs.settings import METRICS_PORT
+
+logger = logging.getLogger(__name__)
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+DEFAULT_BUCKETS = (
+    .005, .01, .025, .05, .075, .1, .25, .5, .75, 1, 2.5, 5, 7.5, 10
+)
+
+
+class Metric(object):
+    """
+    Base of the metric types. Values are kept by the tuple of label
+    values, in the order of label_names.
+    """
+
+    type = None
+
+    def __init__(self, name, documentation, label_names=()):
+        self.name = name
+        self.documentation = documentation
+        self.label_names = tuple(label_names)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def _key(self, labels):
+        try:
+            if len(labels) == len(self.label_names):
+                return tuple([str(labels[name]) for name in self.label_names])
+        except KeyError:
+            pass
+        raise ValueError('%s expects labels %s, got %s' % (
+            self.name, self.label_names, tuple(labels)))
+
+    def _format_labels(self, key, extra=()):
+        pairs = list(zip(self.label_names, key)) + list(extra)
+        if not pairs:
+            return ''
+        return '{%s}' % ','.join(
+            '%s="%s"' % (name, _escape(value)) for name, value in pairs
+        )
+
+    def render(self):
+        lines = [
+            '# HELP %s %s' % (self.name, self.documentation),
+            '# TYPE %s %s' % (self.name, self.type)
+        ]
+        for name, labels, value in self.samples():
+            lines.append('%s%s %s' % (name, labels, _format_value(value)))
+        return lines
+
+    def samples(self):
+        raise NotImplementedError()
+
+
+class Counter(Metric):
+
+    type = 'counter'
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def inc_each(self, values):
+        """
+        Increments by one the series of each value of the single label of
+        the counter, taking the lock once
+        """
+        if len(self.label_names) != 1:
+            raise ValueError(
+                '%s has labels %s' % (self.name, self.label_names)
+            )
+        counts = self._values
+        with self._lock:
+            for value in values:
+                key = (str(value),)
+                counts[key] = counts.get(key, 0) + 1
+
+    def get(self, **labels):
+        return self._values.get(self._key(labels), 0)
+
+    def samples(self):
+        with self._lock:
+            values = sorted(self._values.items())
+        return [(self.name, self._format_labels(key), value)
+                for key, value in values]
+
+
+class Gauge(Metric):
+    """
+    Gauge set directly, or read from a function when rendered
+    """
+
+    type = 'gauge'
+
+    def set(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+    def set_function(self, function, **labels):
+        self.set(function, **labels)
+
+    def get(self, **labels):
+        value = self._values.get(self._key(labels), 0)
+        return value() if callable(value) else value
+
+    def samples(self):
+        with self._lock:
+            values = sorted(self._values.items())
+        return [(self.name, self._format_labels(key),
+                 value() if callable(value) else value)
+                for key, value in values]
+
+
+class Histogram(Metric):
+
+    type = 'histogram'
+
+    def __init__(self, name, documentation, label_names=(),
+                 buckets=DEFAULT_BUCKETS):
+        super(Histogram, self).__init__(name, documentation, label_names)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            counts, total = self._values.get(
+                key, ([0] * (len(self.buckets) + 1), 0)
+            )
+            counts[index] += 1
+            self._values[key] = (counts, total + value)
+
+    @contextmanager
+    def time(self, **labels):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def get_count(self, **labels):
+        counts, _ = self._values.get(self._key(labels), ([0], 0))
+        return sum(counts)
+
+    def samples(self):
+        with self._lock:
+            values = sorted(
+                (key, (list(counts), total))
+                for key, (counts, total) in self._values.items()
+            )
+        samples = []
+        for key, (counts, total) in values:
+            cumulative = 0
+            for bound, count in zip(self.buckets + ('+Inf',), counts):
+                cumulative += count
+                samples.append((
+                    self.name + '_bucket',
+                    self._format_labels(key, [('le', _format_value(bound))]),
+                    cumulative
+                ))
+            samples.append((
+                self.name + '_sum', self._format_labels(key), total
+            ))
+            samples.append((
+                self.name + '_count', self._format_labels(key), cumulative
+            ))
+        return samples
+
+
+class Registry(object):
+
+    def __init__(self):
+        self._metrics = []
+        self._names = set()
+        self._lock = threading.Lock()
+
+    def counter(self, name, documentation, label_names=()):
+        return self.register(Counter(name, documentation, label_names))
+
+    def gauge(self, name, documentation, label_names=()):
+        return self.register(Gauge(name, documentation, label_names))
+
+    def histogram(self, name, documentation, label_names=(),
+                  buckets=DEFAULT_BUCKETS):
+        return self.register(
+            Histogram(name, documentation, label_names, buckets)
+        )
+
+    def register(self, metric):
+        with self._lock:
+            if metric.name in self._names:
+                raise ValueError('Metric %s already registered' % metric.name)
+            self._names.add(metric.name)
+            self._metrics.append(metric)
+        return metric
+
+    def render(self):
+        """
+        Returns every metric in the Prometheus text exposition format
+        """
+        lines = []
+        for metric in list(self._metrics):
+            lines.extend(metric.render())
+        return '\n'.join(lines) + '\n'
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n')\
+        .replace('"', '\\"')
+
+
+def _format_value(value):
+    if isinstance(value, str):
+        return value
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+registry = Registry()
+
+MESSAGES_CONSUMED = registry.counter(
+    'acs_driver_messages_consumed_total',
+    'Messages read from the event queue', ('event',)
+)
+MESSAGES_ACKED = registry.counter(
+    'acs_driver_messages_acked_total',
+    'Messages acked after being processed', ('event',)
+)
+MESSAGES_NACKED = registry.counter(
+    'acs_driver_messages_nacked_total',
+    'Messages nacked after a processing error', ('event',)
+)
+DOCUMENTS = registry.counter(
+    'acs_driver_documents_total',
+    'Update documents created', ('collection',)
+)
+CALLBACK_SECONDS = registry.histogram(
+    'acs_driver_callback_seconds',
+    'Time spent by the callback on each update document'
+)
+ACS_REQUEST_SECONDS = registry.histogram(
+    'acs_api_request_seconds',
+    'Duration of ACS API requests', ('command',)
+)
+ACS_ERRORS = registry.counter(
+    'acs_api_errors_total',
+    'Failed ACS API requests by HTTP status, or io for connection errors',
+    ('command', 'code')
+)
+STAGE_SECONDS = registry.histogram(
+    'acs_driver_stage_seconds',
+    'Time spent in each stage of a traced event', ('trace', 'stage')
+)
+CACHE_HIT_RATIO = registry.gauge(
+    'acs_driver_cache_hit_ratio',
+    'Ratio of lookups answered by a cache', ('cache', 'env')
+)
+
+
+class _MetricsServer(socketserver.ThreadingMixIn, HTTPServer):
+
+    daemon_threads = True
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+
+    def do_GET(self):
+        body = self.server.registry.render().encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', CONTENT_TYPE)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+_exporter = None
+_exporter_lock = threading.Lock()
+
+
+def start_exporter(port=None, address='', metrics_registry=None):
+    """
+    Serves the metrics for Prometheus on a background thread. Starts a
+    single exporter per process, on ACS_METRICS_PORT unless a port is
+    given, and does nothing without a port. Returns the server.
+    """
+    global _exporter
+    port = port if port is not None else METRICS_PORT
+    if port is None:
+        return None
+    with _exporter_lock:
+        if _exporter is None:
+            server = _MetricsServer((address, int(port)), _MetricsHandler)
+            server.registry = metrics_registry or registry
+            thread = threading.Thread(target=server.serve_forever)
+            thread.daemon = True
+            thread.start()
+            logger.info('Serving metrics on port %s', server.server_port)
+            _exporter = server
+    return _exporter
+
+
+def stop_exporter():
+    global _exporter
+    with _exporter_lock:
+        if _exporter is not None:
+            _exporter.shutdown()
+            _exporter.server_close()
+            _exporter = None
@@ -0,0 +1,112 @@
+"""
+   Copyright 2017 Globo.com
+
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+
+       http://www.apache.org/licenses/LICENSE-2.0
+
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+"""
+import queue
+import threading
+
+_DONE = object()
+
+
+class _Failure(object):
+
+    def __init__(self, error):
+        self.error = error
+
+
+def iter_pages(fetch_page, page_size, prefetch_pages=1):
+    """
+    Yields the items of fetch_page(1), fetch_page(2)... until a page comes
+    with less than page_size items. Errors are raised to the caller.
+
+    With prefetch_pages, a background thread reads up to that many pages
+    ahead of the caller. Each page is read whole before it is queued, so
+    its connection is released right away however slow the caller is,
+    at the cost of keeping up to prefetch_pages + 2 decoded pages in
+    memory. With 0, items are streamed from the connection as the caller
+    takes them, keeping a single item in memory but the connection open
+    while the page is processed.
+    """
+    if prefetch_pages < 1:
+        return _stream_pages(fetch_page, page_size)
+    return _prefetch_pages(fetch_page, page_size, prefetch_pages)
+
+
+def _close(page_items):
+    # Releases the connection of a page left unread
+    close = getattr(page_items, 'close', None)
+    if close:
+        close()
+
+
+def _stream_pages(fetch_page, page_size):
+    page = 1
+    while True:
+        count = 0
+        page_items = fetch_page(page) or []
+        try:
+            for item in page_items:
+                count += 1
+                yield item
+        finally:
+            _close(page_items)
+        if count < page_size:
+            return
+        page += 1
+
+
+def _prefetch_pages(fetch_page, page_size, prefetch_pages):
+    pages = queue.Queue(maxsize=prefetch_pages)
+    stop = threading.Event()
+
+    def put(page):
+        while not stop.is_set():
+            try:
+                pages.put(page, timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def fetch_pages():
+        try:
+            page = 1
+            while True:
+                page_items = fetch_page(page) or []
+                try:
+                    items = list(page_items)
+                finally:
+                    _close(page_items)
+                if not put(items):
+                    return
+                if len(items) < page_size:
+                    break
+                page += 1
+            put(_DONE)
+        except Exception as error:
+            put(_Failure(error))
+
+    thread = threading.Thread(target=fetch_pages, daemon=True)
+    thread.start()
+    try:
+        while True:
+            items = pages.get()
+            if items is _DONE:
+                return
+            if isinstance(items, _Failure):
+                raise items.error
+            yield from items
+    finally:
+        stop.set()
+        thread.join()
@@ -0,0 +1,96 @@
+"""
+   Copyright 2017 Globo.com
+
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+
+       http://www.apache.org/licenses/LICENSE-2.0
+
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+"""
+import logging
+import threading
+import time
+
+from globomap_driver_acs import codec
+
+logger = logging.getLogger(__name__)
+
+
+class BatchPublisher(object):
+    """
+    Accumulates update documents and sends them in a single call once
+    max_documents or max_bytes is reached, or when the oldest buffered
+    document is older than linger seconds. Documents are grouped by type
+    and collection when sent so the loader can bulk insert them. Each
+    document is encoded once, when published, and send gets the documents
+    together with the encoded JSON array of the batch. Can be shared
+    between threads.
+    """
+
+    DEFAULT_MAX_DOCUMENTS = 1000
+    DEFAULT_MAX_BYTES = 4 * 1024 * 1024
+    DEFAULT_LINGER = 5
+
+    def __init__(self, send, max_documents=DEFAULT_MAX_DOCUMENTS,
+                 max_bytes=DEFAULT_MAX_BYTES, linger=DEFAULT_LINGER,
+                 clock=time.monotonic):
+        self.send = send
+        self.max_documents = max_documents
+        self.max_bytes = max_bytes
+        self.linger = linger
+        self.clock = clock
+        self._lock = threading.Lock()
+        self._reset()
+
+    def publish(self, documents):
+        if not documents:
+            return
+        entries = [(document, codec.dumps(document)) for document in documents]
+        size = sum(len(encoded) for _, encoded in entries)
+        with self._lock:
+            if not self._entries:
+                self._started_at = self.clock()
+            self._entries.extend(entries)
+            self._size += size
+            batch = self._take() if self._is_full() else None
+        if batch:
+            self._send(batch)
+
+    def flush(self):
+        with self._lock:
+            batch = self._take()
+        if batch:
+            self._send(batch)
+
+    def _take(self):
+        if not self._entries:
+            return None
+        batch = self._entries, self._size
+        self._reset()
+        return batch
+
+    def _send(self, batch):
+        entries, size = batch
+        entries.sort(key=lambda entry: (
+            entry[0]['type'], entry[0]['collection']
+        ))
+        logger.debug('Sending batch of %s documents (%s bytes)',
+                     len(entries), size)
+        body = b'[' + b','.join(encoded for _, encoded in entries) + b']'
+        self.send([document for document, _ in entries], body)
+
+    def _is_full(self):
+        return len(self._entries) >= self.max_documents or \
+            self._size >= self.max_bytes or \
+            self.clock() - self._started_at >= self.linger
+
+    def _reset(self):
+        self._entries = []
+        self._size = 0
+        self._started_at = None
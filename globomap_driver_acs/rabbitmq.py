@@ -13,10 +13,35 @@
    See the License for the specific language governing permissions and
    limitations under the License.
 """
-import json
-
 import pika
 
+from globomap_driver_acs import codec
+
+
+class Delivery(object):
+    """
+    Message delivered by the broker, with its body still unparsed so it
+    can be dropped or routed by its routing key and headers first
+    """
+
+    __slots__ = ('delivery_tag', 'routing_key', 'headers', 'body')
+
+    def __init__(self, delivery_tag, routing_key, headers, body):
+        self.delivery_tag = delivery_tag
+        self.routing_key = routing_key
+        self.headers = headers or {}
+        self.body = body
+
+    @classmethod
+    def from_frames(cls, method_frame, header_frame, body):
+        headers = header_frame.headers if header_frame else None
+        return cls(
+            method_frame.delivery_tag, method_frame.routing_key, headers, body
+        )
+
+    def json(self):
+        return codec.loads(self.body)
+
 
 class RabbitMQClient(object):
 
@@ -32,14 +57,62 @@ class RabbitMQClient(object):
         self.channel.confirm_delivery()
 
     def get_message(self):
-        method_frame, _, body = self.channel.basic_get(self.queue_name)
-        if body:
-            return json.loads(body.decode('utf-8')), method_frame.delivery_tag
+        delivery = self.get_delivery()
+        if delivery:
+            return delivery.json(), delivery.delivery_tag
         else:
             return None, None
 
-    def ack_message(self, delivery_tag):
-        self.channel.basic_ack(delivery_tag)
+    def get_delivery(self):
+        method_frame, header_frame, body = \
+            self.channel.basic_get(self.queue_name)
+        if body:
+            return Delivery.from_frames(method_frame, header_frame, body)
+        return None
+
+    def consume_deliveries(self, prefetch_count=100, inactivity_timeout=1):
+        """
+        Yields unparsed Delivery objects pushed by the broker, keeping up
+        to prefetch_count unacked messages in flight. Stops once no
+        message arrives for inactivity_timeout seconds.
+        """
+        self.channel.basic_qos(prefetch_count=prefetch_count)
+        try:
+            for method_frame, header_frame, body in self.channel.consume(
+                    self.queue_name, inactivity_timeout=inactivity_timeout):
+                if not method_frame:
+                    return
+                yield Delivery.from_frames(method_frame, header_frame, body)
+        finally:
+            self.cancel_consumer()
+
+    def set_prefetch(self, prefetch_count):
+        self.channel.basic_qos(prefetch_count=prefetch_count)
+
+    def wait_delivery(self, timeout):
+        """
+        Returns the next message pushed by the broker, or None when none
+        arrives within timeout seconds. Every call resumes the same
+        consumer, so each one can wait for a different time. Call
+        cancel_consumer once done.
+        """
+        frames = next(self.channel.consume(
+            self.queue_name, inactivity_timeout=max(timeout, 0)
+        ), None)
+        if not frames or not frames[0]:
+            return None
+        return Delivery.from_frames(*frames)
+
+    def cancel_consumer(self):
+        # Prefetched messages not yielded yet are requeued
+        if self.channel.is_open:
+            self.channel.cancel()
+
+    def ack_message(self, delivery_tag, multiple=False):
+        if multiple:
+            self.channel.basic_ack(delivery_tag, multiple=True)
+        else:
+            self.channel.basic_ack(delivery_tag)
 
     def nack_message(self, delivery_tag):
         self.channel.basic_nack(delivery_tag)
@@ -52,6 +125,10 @@ class RabbitMQClient(object):
             mandatory=True,
         )
 
+    def close(self):
+        if self.connection.is_open:
+            self.connection.close()
+
     def bind_routing_keys(self, exchange, keys):
         for key in keys:
             self.channel.queue_bind(
@@ -0,0 +1,79 @@
+"""
+   Copyright 2017 Globo.com
+
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+
+       http://www.apache.org/licenses/LICENSE-2.0
+
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+"""
+import threading
+from collections import Counter
+
+ANY = '*'
+
+
+class EventRouter(object):
+    """
+    Maps (event, resource, status) keys to handlers. Any part of a key can
+    be ANY, and the most specific registered key matching a message wins,
+    so a message is routed with at most eight dict lookups. Counts how many
+    messages were dispatched to each handler, by its name or its key.
+    """
+
+    UNROUTED = 'unrouted'
+
+    def __init__(self):
+        self._handlers = {}
+        self._lock = threading.Lock()
+        self.dispatches = Counter()
+
+    def register(self, handler, event=ANY, resource=ANY, status=ANY,
+                 name=None):
+        key = (event, resource, status)
+        if key in self._handlers:
+            raise ValueError('Handler already registered for %s' % (key,))
+        self._handlers[key] = (name or '/'.join(key), handler)
+
+    def route(self, raw_msg):
+        """
+        Returns the (name, handler) registered for the message or None
+        """
+        event = raw_msg.get('event')
+        resource = raw_msg.get('resource')
+        status = raw_msg.get('status')
+        # From the most to the least specific key
+        for key in ((event, resource, status),
+                    (event, resource, ANY),
+                    (event, ANY, status),
+                    (ANY, resource, status),
+                    (event, ANY, ANY),
+                    (ANY, resource, ANY),
+                    (ANY, ANY, status),
+                    (ANY, ANY, ANY)):
+            route = self._handlers.get(key)
+            if route:
+                return route
+        return None
+
+    def dispatch(self, raw_msg, *args, **kwargs):
+        """
+        Calls the handler of the message with it and the given arguments.
+        Returns None when no handler matches.
+        """
+        route = self.route(raw_msg)
+        name, handler = route if route else (self.UNROUTED, None)
+        with self._lock:
+            self.dispatches[name] += 1
+        if handler:
+            return handler(raw_msg, *args, **kwargs)
+
+    def stats(self):
+        with self._lock:
+            return dict(self.dispatches)
@@ -18,6 +18,14 @@ Used environment variables
 ACS_$env_API_URL
 ACS_$env_API_KEY
 ACS_$env_API_SECRET_KEY
+ACS_$env_API_POOL_SIZE
+ACS_$env_API_POOL_IDLE_TIMEOUT
+ACS_$env_API_TIMEOUT
+ACS_$env_API_PAGE_SIZE
+ACS_$env_API_PREFETCH_PAGES
+ACS_$env_PROJECT_CACHE_SIZE
+ACS_$env_PROJECT_CACHE_TTL
+ACS_$env_PROJECT_NOT_FOUND_CACHE_TTL
 ACS_$env_RMQ_USER
 ACS_$env_RMQ_PASSWORD
 ACS_$env_RMQ_HOST
@@ -26,6 +34,31 @@ ACS_$env_RMQ_QUEUE
 ACS_$env_RMQ_EXCHANGE
 ACS_$env_RMQ_LOADER_EXCHANGE
 ACS_$env_RMQ_VIRTUAL_HOST
+ACS_$env_RMQ_CONSUMER
+ACS_$env_RMQ_PREFETCH
+ACS_$env_RMQ_ACK_BATCH
+ACS_$env_RMQ_INACTIVITY_TIMEOUT
+ACS_$env_COALESCE_WINDOW
+ACS_$env_COALESCE_MAX_MESSAGES
+ACS_$env_TRACE_SINKS
+ACS_$env_TRACE_LOG_THRESHOLD
+ACS_$env_PROFILE_SAMPLE_RATE
+ACS_$env_PROFILE_THRESHOLD
+ACS_$env_PROFILE_DIR
+ACS_$env_LOADER_BATCH_SIZE
+ACS_$env_LOADER_BATCH_BYTES
+ACS_$env_LOADER_BATCH_LINGER
+ACS_$env_LOADER_WORKERS
+ACS_$env_LOADER_STATE_FILE
+ACS_$env_LOADER_STATE_MAX_AGE
+ACS_$env_LOADER_FORCE_FULL
+ACS_$env_LOADER_CLEAR_INTERVAL
+ACS_$env_LOADER_MAX_DELETE_RATIO
+ACS_$env_MEMORY_REPORT
+ACS_$env_MEMORY_REPORT_TOP
+ACS_$env_MEMORY_REPORT_FRAMES
+ACS_JSON_BACKEND
+ACS_METRICS_PORT
 """
 import os
 
@@ -36,6 +69,10 @@ GLOBOMAP_LOADER_API_URL = os.getenv('GLOBOMAP_LOADER_API_URL')
 GLOBOMAP_LOADER_API_USERNAME = os.getenv('GLOBOMAP_LOADER_API_USERNAME')
 GLOBOMAP_LOADER_API_PASSWORD = os.getenv('GLOBOMAP_LOADER_API_PASSWORD')
 
+JSON_BACKEND = os.getenv('ACS_JSON_BACKEND')
+
+METRICS_PORT = os.getenv('ACS_METRICS_PORT')
+
 
 def get_setting(env, key, default=None):
     value = os.getenv('ACS_%s_%s' % (env, key))
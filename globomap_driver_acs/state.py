@@ -0,0 +1,224 @@
+"""
+   Copyright 2017 Globo.com
+
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+
+       http://www.apache.org/licenses/LICENSE-2.0
+
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+"""
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+
+from globomap_driver_acs import codec
+from globomap_driver_acs.update_handlers import GloboMapActions
+
+logger = logging.getLogger(__name__)
+
+STATE_VERSION = 1
+UPSERT_ACTIONS = (
+    GloboMapActions.PATCH, GloboMapActions.UPDATE, GloboMapActions.CREATE
+)
+
+
+def content_hash(document):
+    """
+    Hashes a document leaving out the timestamp of its element, which
+    changes on every load even when nothing else did
+    """
+    element = document.get('element')
+    if isinstance(element, dict) and 'timestamp' in element:
+        element = dict(element)
+        del element['timestamp']
+    content = (document.get('action'), document.get('type'),
+               document.get('collection'), document.get('key'), element)
+    return hashlib.blake2b(codec.dumps(content), digest_size=16).hexdigest()
+
+
+class LoadState(object):
+    """
+    Content hashes of the documents published by the last full load of an
+    env, stored as JSON in path. filter() drops the documents already
+    published in this load and the ones unchanged since the last load.
+    The hashes of this load replace the stored ones on save().
+
+    When the load ends with a timestamp clear (needs_clear), unchanged
+    documents are replaced by a PATCH of their timestamp only, so the
+    clear keeps them. With a clear_interval, loads in between skip them
+    and the clear, and deletions() gives the DELETE documents of the keys
+    that disappeared since the last load instead.
+    """
+
+    def __init__(self, path, force_full=False, max_age=None,
+                 clear_interval=None, max_delete_ratio=0.5,
+                 clock=time.time):
+        self.path = path
+        self.clock = clock
+        self.max_age = max_age
+        self.clear_interval = clear_interval
+        self.max_delete_ratio = max_delete_ratio
+        self.created = None
+        self.cleared = None
+        self.previous = {}
+        self.current = {}
+        self.stats = {
+            'changed': 0, 'unchanged': 0, 'duplicated': 0, 'deleted': 0
+        }
+        self._lock = threading.Lock()
+        self._load()
+        self.force_full = force_full or self._is_expired()
+        if self.force_full:
+            logger.info('Publishing every document of the full load')
+            self.previous = {}
+            self.created = self.clock()
+        self.needs_clear = self.force_full or self._is_clear_due()
+
+    def filter(self, documents):
+        published = []
+        for document in documents:
+            key = document_key(document)
+            if key is None:
+                published.append(document)
+                continue
+            if document.get('action') not in UPSERT_ACTIONS:
+                with self._lock:
+                    self.current.pop(key, None)
+                published.append(document)
+                continue
+
+            digest = content_hash(document)
+            with self._lock:
+                if self.current.get(key) == digest:
+                    self.stats['duplicated'] += 1
+                    continue
+                self.current[key] = digest
+                unchanged = self.previous.get(key) == digest
+                self.stats['unchanged' if unchanged else 'changed'] += 1
+            if not unchanged:
+                published.append(document)
+            elif self.needs_clear:
+                published.append(self._liveness(document))
+        return published
+
+    def discard(self, documents):
+        """
+        Forgets the content of documents the loader API did not get, so
+        the next load publishes them whole. Their keys are kept, as the
+        documents may still exist. The keys of failed deletions get their
+        previous hash back, so the next load finds them missing again and
+        retries the DELETE.
+        """
+        with self._lock:
+            for document in documents:
+                key = document_key(document)
+                if key is None:
+                    continue
+                if document.get('action') in UPSERT_ACTIONS:
+                    if key in self.current:
+                        self.current[key] = ''
+                elif key not in self.current and key in self.previous:
+                    self.current[key] = self.previous[key]
+
+    def deletions(self):
+        """
+        Returns DELETE documents for the keys of the last load missing
+        from this one. When more than max_delete_ratio of the keys are
+        missing, which rather means ACS listed too little, none is
+        deleted and the keys are kept for the next load to check.
+        """
+        with self._lock:
+            missing = [key for key in self.previous if key not in self.current]
+            if self.previous and self.max_delete_ratio is not None and \
+                    len(missing) > len(self.previous) * self.max_delete_ratio:
+                logger.error('%s of %s documents are gone since the last '
+                             'load, not deleting them', len(missing),
+                             len(self.previous))
+                for key in missing:
+                    self.current[key] = self.previous[key]
+                return []
+            self.stats['deleted'] += len(missing)
+        return [{
+            'action': GloboMapActions.DELETE,
+            'type': type,
+            'collection': collection,
+            'key': key,
+            'element': {}
+        } for type, collection, key in missing]
+
+    def mark_cleared(self):
+        self.cleared = self.clock()
+
+    def save(self):
+        content = {
+            'version': STATE_VERSION,
+            'created': self.created,
+            'cleared': self.cleared,
+            'hashes': {
+                '\t'.join(key): digest
+                for key, digest in self.current.items()
+            }
+        }
+        directory = os.path.dirname(os.path.abspath(self.path))
+        os.makedirs(directory, exist_ok=True)
+        temp_path = '%s.%s.tmp' % (self.path, os.getpid())
+        with open(temp_path, 'w') as state_file:
+            json.dump(content, state_file)
+        os.replace(temp_path, self.path)
+        logger.info('Load state saved, %(changed)s documents changed, '
+                    '%(unchanged)s unchanged, %(duplicated)s duplicated and '
+                    '%(deleted)s deleted', self.stats)
+
+    def _load(self):
+        try:
+            with open(self.path) as state_file:
+                content = json.load(state_file)
+        except FileNotFoundError:
+            return
+        except ValueError:
+            logger.warning('Ignoring unreadable load state %s', self.path)
+            return
+        if content.get('version') != STATE_VERSION:
+            return
+        self.created = content.get('created')
+        self.cleared = content.get('cleared')
+        self.previous = {
+            tuple(key.split('\t')): digest
+            for key, digest in content.get('hashes', {}).items()
+        }
+
+    def _is_expired(self):
+        if self.created is None:
+            return True
+        return bool(self.max_age) and \
+            self.clock() - self.created >= self.max_age
+
+    def _is_clear_due(self):
+        if not self.clear_interval or self.cleared is None:
+            return True
+        return self.clock() - self.cleared >= self.clear_interval
+
+    def _liveness(self, document):
+        return {
+            'action': GloboMapActions.PATCH,
+            'collection': document['collection'],
+            'type': document['type'],
+            'key': document['key'],
+            'element': {'timestamp': document['element'].get('timestamp')}
+        }
+
+
+def document_key(document):
+    key = document.get('key')
+    if key is None:
+        return None
+    return document.get('type'), document.get('collection'), key
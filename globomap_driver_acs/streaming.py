@@ -0,0 +1,138 @@
+"""
+   Copyright 2017 Globo.com
+
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+
+       http://www.apache.org/licenses/LICENSE-2.0
+
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+"""
+import codecs
+import json
+import re
+
+CHUNK_SIZE = 64 * 1024
+
+_WHITESPACE = re.compile(r'[ \t\n\r,]*')
+
+
+class JSONArrayStream(object):
+    """
+    Incrementally parses the items of the array stored under `key` in a
+    JSON document read from a binary stream, such as the list responses of
+    ACS:
+
+        {"listvirtualmachinesresponse": {"count": 2, "virtualmachine": [
+            {...}, {...}
+        ]}}
+
+    The array must be at the given depth, 2 by default. Iterating yields
+    one decoded item at a time, so only a chunk of the raw body and the
+    current item are held in memory. Yields nothing when the document has
+    no such array.
+    """
+
+    def __init__(self, stream, key, depth=2, chunk_size=CHUNK_SIZE):
+        self.stream = stream
+        self.key_regex = re.compile(r'"%s"\s*:\s*\[' % re.escape(key))
+        self.depth = depth
+        self.chunk_size = chunk_size
+        self.decoder = json.JSONDecoder()
+        self.completed = False
+        self._text = codecs.getincrementaldecoder('utf-8')()
+        self._buffer = ''
+        self._eof = False
+
+    def __iter__(self):
+        position = self._find_array()
+        if position is None:
+            self._drain()
+            return
+
+        while True:
+            position = _WHITESPACE.match(self._buffer, position).end()
+            if position == len(self._buffer):
+                position = self._read(position)
+                if self._eof and position == len(self._buffer):
+                    raise ValueError('JSON array is not closed')
+                continue
+
+            if self._buffer[position] == ']':
+                self._drain()
+                return
+
+            try:
+                item, end = self.decoder.raw_decode(self._buffer, position)
+            except json.JSONDecodeError:
+                if self._eof:
+                    raise
+                # Item is not complete yet
+                position = self._read(position)
+                continue
+            position = end
+            yield item
+
+    def _find_array(self):
+        start = 0
+        while True:
+            for match in self.key_regex.finditer(self._buffer, start):
+                if _depth(self._buffer, match.start()) == self.depth:
+                    return match.end()
+            if self._eof:
+                return None
+            # Keeps the prefix, it is needed to know the depth of a match,
+            # and looks again at a tail where a split key can still match
+            start = max(0, len(self._buffer) - 256)
+            self._read(0)
+
+    def _read(self, position):
+        """
+        Drops the consumed part of the buffer, appends the next chunk and
+        returns the position translated to the new buffer
+        """
+        chunk = self.stream.read(self.chunk_size)
+        if not chunk:
+            self._eof = True
+        data = self._text.decode(chunk or b'', final=self._eof)
+        if position:
+            self._buffer = self._buffer[position:]
+        self._buffer += data
+        return 0
+
+    def _drain(self):
+        # Reads what is left so the connection can be reused
+        while not self._eof:
+            if not self.stream.read(self.chunk_size):
+                self._eof = True
+        self.completed = True
+
+
+def _depth(text, end):
+    depth = 0
+    in_string = False
+    escaped = False
+    for char in text[:end]:
+        if in_string:
+            if escaped:
+                escaped = False
+            elif char == '\\':
+                escaped = True
+            elif char == '"':
+                in_string = False
+        elif char == '"':
+            in_string = True
+        elif char in '{[':
+            depth += 1
+        elif char in '}]':
+            depth -= 1
+    return depth
+
+
+def iter_json_array(stream, key, depth=2, chunk_size=CHUNK_SIZE):
+    return iter(JSONArrayStream(stream, key, depth, chunk_size))
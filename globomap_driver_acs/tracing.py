@@ -0,0 +1,249 @@
+"""
+   Copyright 2017 Globo.com
+
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+
+       http://www.apache.org/licenses/LICENSE-2.0
+
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+"""
+import contextlib
+import cProfile
+import io
+import logging
+import os
+import pstats
+import random
+import threading
+import time
+
+from globomap_driver_acs import metrics
+
+logger = logging.getLogger(__name__)
+
+_local = threading.local()
+
+
+class _NoSpan(object):
+
+    __slots__ = ()
+
+    def __enter__(self):
+        pass
+
+    def __exit__(self, *args):
+        pass
+
+
+_NO_SPAN = _NoSpan()
+
+
+class Trace(object):
+    """
+    Timings of the stages of one event. Spans are kept as (path, seconds),
+    the path joining the names of the enclosing spans with dots.
+    """
+
+    def __init__(self, name, attributes):
+        self.name = name
+        self.attributes = attributes
+        self.spans = []
+        self.duration = None
+        self.profile = None
+        self._stack = []
+
+    def stages(self):
+        """
+        Returns the total seconds spent in each span path
+        """
+        stages = {}
+        for path, seconds in self.spans:
+            stages[path] = stages.get(path, 0) + seconds
+        return stages
+
+
+class _Span(object):
+
+    __slots__ = ('trace', 'name', 'start')
+
+    def __init__(self, trace, name):
+        self.trace = trace
+        self.name = name
+
+    def __enter__(self):
+        self.trace._stack.append(self.name)
+        self.start = time.perf_counter()
+
+    def __exit__(self, *args):
+        seconds = time.perf_counter() - self.start
+        self.trace.spans.append(('.'.join(self.trace._stack), seconds))
+        self.trace._stack.pop()
+
+
+def span(name):
+    """
+    Times a stage of the trace running on this thread. Does nothing when
+    there is none, so stages can be marked anywhere at no cost.
+    """
+    trace = getattr(_local, 'trace', None)
+    if trace is None:
+        return _NO_SPAN
+    return _Span(trace, name)
+
+
+def current_trace():
+    return getattr(_local, 'trace', None)
+
+
+class Tracer(object):
+    """
+    Starts traces and hands them to its sinks once finished. A sampled
+    part of the traces runs under cProfile, and the profile of those
+    slower than profile_threshold seconds is kept: dumped to profile_dir
+    when given, or else logged. Disabled without sinks or sampling.
+    """
+
+    PROFILE_LINES = 25
+
+    def __init__(self, sinks=None, profile_threshold=1.0, profile_rate=0,
+                 profile_dir=None, sample=random.random):
+        self.sinks = list(sinks or [])
+        self.profile_threshold = profile_threshold
+        self.profile_rate = profile_rate
+        self.profile_dir = profile_dir
+        self.sample = sample
+
+    @property
+    def enabled(self):
+        return bool(self.sinks) or self.profile_rate > 0
+
+    def add_sink(self, sink):
+        self.sinks.append(sink)
+
+    def trace(self, name, **attributes):
+        """
+        Starts a trace on this thread. Inside another trace it is just a
+        span of it.
+        """
+        trace = current_trace()
+        if trace is not None:
+            return _Span(trace, name)
+        if not self.enabled:
+            return _NO_SPAN
+        return self._trace(name, attributes)
+
+    @contextlib.contextmanager
+    def _trace(self, name, attributes):
+        trace = Trace(name, attributes)
+        profile = self._start_profile()
+        _local.trace = trace
+        start = time.perf_counter()
+        try:
+            yield trace
+        finally:
+            trace.duration = time.perf_counter() - start
+            _local.trace = None
+            if profile:
+                profile.disable()
+                if trace.duration >= self.profile_threshold:
+                    trace.profile = self._keep_profile(trace, profile)
+            self._record(trace)
+
+    def _start_profile(self):
+        if self.profile_rate <= 0 or self.sample() >= self.profile_rate:
+            return None
+        profile = cProfile.Profile()
+        try:
+            profile.enable()
+        except ValueError:
+            # Another profiler is already running on this thread
+            return None
+        return profile
+
+    def _keep_profile(self, trace, profile):
+        if self.profile_dir:
+            path = os.path.join(self.profile_dir, '%s-%s-%s.prof' % (
+                trace.name, int(time.time() * 1000), threading.get_ident()))
+            profile.dump_stats(path)
+            logger.warning('Slow %s (%.3fs) %s, profile saved to %s',
+                           trace.name, trace.duration, trace.attributes, path)
+            return path
+
+        output = io.StringIO()
+        pstats.Stats(profile, stream=output).sort_stats('cumulative')\
+            .print_stats(self.PROFILE_LINES)
+        logger.warning('Slow %s (%.3fs) %s, profile:\n%s', trace.name,
+                       trace.duration, trace.attributes, output.getvalue())
+        return output.getvalue()
+
+    def _record(self, trace):
+        for sink in self.sinks:
+            try:
+                sink.record(trace)
+            except Exception:
+                logger.exception('Error recording trace on %s', sink)
+
+
+class LoggingSink(object):
+    """
+    Logs the stages of traces taking at least threshold seconds
+    """
+
+    def __init__(self, threshold=0, level=logging.INFO):
+        self.threshold = threshold
+        self.level = level
+
+    def record(self, trace):
+        if trace.duration < self.threshold:
+            return
+        stages = ' '.join(
+            '%s=%.4f' % stage for stage in sorted(trace.stages().items())
+        )
+        logger.log(self.level, '%s %.4fs %s %s', trace.name, trace.duration,
+                   trace.attributes, stages)
+
+
+class MetricsSink(object):
+    """
+    Observes the duration of traces and of each of their stages
+    """
+
+    def record(self, trace):
+        metrics.STAGE_SECONDS.observe(
+            trace.duration, trace=trace.name, stage='total'
+        )
+        for stage, seconds in trace.stages().items():
+            metrics.STAGE_SECONDS.observe(
+                seconds, trace=trace.name, stage=stage
+            )
+
+
+SINKS = {
+    'log': LoggingSink,
+    'metrics': MetricsSink
+}
+
+
+def create_sinks(names, log_threshold=0):
+    """
+    Creates the sinks named in a comma separated list
+    """
+    sinks = []
+    for name in (names or '').split(','):
+        name = name.strip()
+        if not name:
+            continue
+        if name not in SINKS:
+            raise ValueError('Unknown trace sink %s, expected one of %s' % (
+                name, ', '.join(sorted(SINKS))))
+        if name == 'log':
+            sinks.append(LoggingSink(log_threshold))
+        else:
+            sinks.append(SINKS[name]())
+    return sinks
@@ -0,0 +1,264 @@
+"""
+   Copyright 2017 Globo.com
+
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+
+       http://www.apache.org/licenses/LICENSE-2.0
+
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+"""
+import base64
+import http.client
+import logging
+import ssl
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+
+logger = logging.getLogger(__name__)
+
+REDIRECT_STATUSES = (301, 302, 303, 307, 308)
+# Redirects that urlopen follows with a GET when the request was a POST
+GET_REDIRECT_STATUSES = (301, 302, 303)
+
+
+def create_ssl_context():
+    ctx = ssl.create_default_context()
+    ctx.check_hostname = False
+    ctx.verify_mode = ssl.CERT_NONE
+    return ctx
+
+
+class HTTPTransport(object):
+    """
+    Base class of the HTTP layer used by CloudStackClient. Implementations
+    return the raw response body and raise urllib.error.HTTPError for
+    error status codes.
+    """
+
+    def get(self, url):
+        raise NotImplementedError()
+
+    def post(self, url, data):
+        raise NotImplementedError()
+
+    def open(self, method, url, body=None, headers=None):
+        """
+        Sends the request and returns the response, to be read as a
+        stream, together with a release function that must be called once
+        the body was consumed
+        """
+        raise NotImplementedError()
+
+    def close(self):
+        pass
+
+
+class PooledTransport(HTTPTransport):
+    """
+    Keeps idle keep-alive connections per host so consecutive requests
+    skip the TCP and TLS handshakes. Safe to share between threads: a
+    connection is owned by a single request until it is released back to
+    the pool. Goes through the proxies of the environment (HTTP_PROXY,
+    HTTPS_PROXY and NO_PROXY) like urlopen, unless proxies are given.
+    Follows up to MAX_REDIRECTS redirects like urlopen too: a POST
+    redirected with 301, 302 or 303 is sent again as a GET without its
+    body, and other redirects of a POST raise HTTPError.
+    """
+
+    DEFAULT_POOL_SIZE = 10
+    MAX_REDIRECTS = 10
+    DEFAULT_IDLE_TIMEOUT = 60
+    DEFAULT_TIMEOUT = 60
+
+    def __init__(self, pool_size=DEFAULT_POOL_SIZE,
+                 idle_timeout=DEFAULT_IDLE_TIMEOUT, timeout=DEFAULT_TIMEOUT,
+                 proxies=None):
+        self.ssl_context = create_ssl_context()
+        self.pool_size = pool_size
+        self.idle_timeout = idle_timeout
+        self.timeout = timeout
+        self.proxies = urllib.request.getproxies() \
+            if proxies is None else proxies
+        self._idle = {}
+        self._routes = {}
+        self._lock = threading.Lock()
+
+    def get(self, url):
+        return self._request('GET', url)
+
+    def post(self, url, data):
+        if isinstance(data, str):
+            data = data.encode('utf-8')
+        return self._request('POST', url, data, {
+            'Content-Type': 'application/x-www-form-urlencoded'
+        })
+
+    def close(self):
+        with self._lock:
+            idle, self._idle = self._idle, {}
+        for connections in idle.values():
+            for connection, _ in connections:
+                connection.close()
+
+    def _request(self, method, url, body=None, headers=None):
+        response, release = self.open(method, url, body, headers)
+        try:
+            data = response.read()
+        except Exception:
+            release(reuse=False)
+            raise
+        release()
+        return data
+
+    def open(self, method, url, body=None, headers=None):
+        for _ in range(self.MAX_REDIRECTS + 1):
+            response, release = self._open(method, url, body, headers)
+            location = response.getheader('Location')
+            if response.status not in REDIRECT_STATUSES or not location:
+                return response, release
+            response.read()
+            release()
+            if method not in ('GET', 'HEAD') and \
+                    response.status not in GET_REDIRECT_STATUSES:
+                break
+            if method not in ('GET', 'HEAD'):
+                method, body = 'GET', None
+                headers = dict(
+                    (name, value) for name, value in (headers or {}).items()
+                    if name.lower() not in ('content-type', 'content-length')
+                )
+            url = urllib.parse.urljoin(url, location)
+        raise urllib.error.HTTPError(
+            url, response.status, response.reason, response.msg, None
+        )
+
+    def _open(self, method, url, body=None, headers=None):
+        parsed = urllib.parse.urlsplit(url)
+        pool_key = (parsed.scheme, parsed.hostname, parsed.port)
+        path = parsed.path or '/'
+        if parsed.query:
+            path += '?' + parsed.query
+        proxy = self._get_proxy(pool_key)
+        if proxy and parsed.scheme == 'http':
+            # Plain HTTP proxies get the absolute url, https is tunneled
+            path = url
+            headers = dict(headers or {}, **proxy[2])
+
+        connection, reused = self._acquire(pool_key)
+        try:
+            response = self._send(
+                connection, method, path, body, headers or {}
+            )
+        except (http.client.HTTPException, OSError):
+            connection.close()
+            if not reused:
+                raise
+            # Keep-alive connection was closed by the server while idle
+            logger.debug('Stale connection to %s, reconnecting', pool_key[1])
+            connection = self._new_connection(pool_key)
+            try:
+                response = self._send(
+                    connection, method, path, body, headers or {}
+                )
+            except Exception:
+                connection.close()
+                raise
+
+        def release(reuse=True):
+            if reuse and not response.will_close:
+                self._release(pool_key, connection)
+            else:
+                connection.close()
+
+        if response.status >= 400:
+            response.read()
+            release()
+            raise urllib.error.HTTPError(
+                url, response.status, response.reason, response.msg, None
+            )
+        return response, release
+
+    def _send(self, connection, method, path, body, headers):
+        connection.request(method, path, body=body, headers=headers)
+        return connection.getresponse()
+
+    def _acquire(self, pool_key):
+        now = time.monotonic()
+        stale = []
+        connection = None
+        with self._lock:
+            connections = self._idle.get(pool_key, [])
+            while connections:
+                candidate, released_at = connections.pop()
+                if now - released_at <= self.idle_timeout:
+                    connection = candidate
+                    break
+                stale.append(candidate)
+        for candidate in stale:
+            candidate.close()
+        if connection is not None:
+            return connection, True
+        return self._new_connection(pool_key), False
+
+    def _release(self, pool_key, connection):
+        with self._lock:
+            connections = self._idle.setdefault(pool_key, [])
+            if len(connections) < self.pool_size:
+                connections.append((connection, time.monotonic()))
+                return
+        connection.close()
+
+    def _new_connection(self, pool_key):
+        scheme, host, port = pool_key
+        proxy = self._get_proxy(pool_key)
+        connect_host, connect_port = (proxy[0], proxy[1]) if proxy \
+            else (host, port)
+        if scheme == 'https':
+            connection = http.client.HTTPSConnection(
+                connect_host, connect_port, timeout=self.timeout,
+                context=self.ssl_context
+            )
+            if proxy:
+                connection.set_tunnel(host, port, proxy[2])
+            return connection
+        return http.client.HTTPConnection(
+            connect_host, connect_port, timeout=self.timeout
+        )
+
+    def _get_proxy(self, pool_key):
+        """
+        Returns the (host, port, headers) of the proxy to reach the host
+        through, or None to connect straight to it
+        """
+        try:
+            return self._routes[pool_key]
+        except KeyError:
+            pass
+        scheme, host, _ = pool_key
+        proxy_url = self.proxies.get(scheme)
+        proxy = None
+        if proxy_url and not urllib.request.proxy_bypass_environment(
+                host, self.proxies):
+            if '://' not in proxy_url:
+                proxy_url = 'http://' + proxy_url
+            parsed = urllib.parse.urlsplit(proxy_url)
+            headers = {}
+            if parsed.username:
+                credentials = '%s:%s' % (
+                    urllib.parse.unquote(parsed.username),
+                    urllib.parse.unquote(parsed.password or '')
+                )
+                headers['Proxy-Authorization'] = 'Basic %s' % \
+                    base64.b64encode(credentials.encode()).decode('ascii')
+            proxy = (parsed.hostname, parsed.port, headers)
+        self._routes[pool_key] = proxy
+        return proxy
@@ -14,13 +14,30 @@
    limitations under the License.
 """
 import datetime
+import functools
+import logging
+import re
+import threading
 import time
+from contextlib import contextmanager
 
 from dateutil.parser import parse
 
+from globomap_driver_acs import metrics
 from globomap_driver_acs import settings
+from globomap_driver_acs import tracing
 from globomap_driver_acs.settings import get_setting
 
+logger = logging.getLogger(__name__)
+
+# Formats emitted by ACS: '2017-07-31 10:54:59 -0300' on events and
+# '2017-07-31T10:54:59-0300' on resources
+ACS_DATE_REGEX = re.compile(
+    r'^(\d{4})-(\d{2})-(\d{2})[T ](\d{2}):(\d{2}):(\d{2})(?:\.\d+)?'
+    r'(?: ?(?:[+-]\d{2}:?\d{2}|Z))?$'
+)
+PARSED_DATES_CACHE_SIZE = 4096
+
 
 class GloboMapUpdateHandler(object):
 
@@ -32,6 +49,7 @@ class GloboMapUpdateHandler(object):
     def __init__(self, env, cloudstack_service):
         self.env = env
         self.cloudstack_service = cloudstack_service
+        self.builder = DocumentBuilder.for_env(env)
 
     def create_document(self, action, collection, type, element, key=None):
         document = {
@@ -45,26 +63,11 @@ class GloboMapUpdateHandler(object):
         return document
 
     def create_edge(self, id, collection, from_key, to_key):
-        edge_document = {
-            'id': id,
-            'provider': self.GLOBOMAP_PROVIDER,
-            'timestamp': self.now_timestamp(),
-            'from': from_key,
-            'to': to_key,
-            'properties': {
-                'environment': self.env,
-                'iaas_provider': self.IAAS_PROVIDER
-            },
-            'properties_metadata': {
-                'environment': {'description': 'Cloudstack Region'},
-                'iaas_provider': {'description': 'Iaas provider name'}
-            }
-        }
         return self.create_document(
             GloboMapActions.UPDATE,
             collection,
             Edge.type_name(),
-            edge_document,
+            self.builder.edge(id, from_key, to_key),
             self.create_key(id)
         )
 
@@ -81,18 +84,197 @@ class GloboMapUpdateHandler(object):
         return self.KEY_TEMPLATE % value
 
     def now_timestamp(self):
-        return int(time.mktime(datetime.datetime.now().timetuple()))
+        return self.builder.timestamp()
 
     def _get_setting(self, key, default=None):
         return get_setting(self.env, key, default)
 
 
+class DocumentBuilder(object):
+    """
+    Builds the documents of one env from templates computed once. Constant
+    properties and metadata are shared between documents, so built
+    documents must not be modified. Every document built inside batch()
+    gets the same timestamp.
+    """
+
+    COMP_UNIT_METADATA = {
+        'uuid': {'description': 'UUID'},
+        'state': {'description': 'Power state'},
+        'host': {'description': 'Host name'},
+        'zone': {'description': 'Zone name'},
+        'service_offering': {'description': 'Compute Offering'},
+        'cpu_cores': {'description': 'Number of CPU cores'},
+        'cpu_speed': {'description': 'CPU speed'},
+        'memory': {'description': 'RAM size'},
+        'template': {'description': 'Template name'},
+        'project': {'description': 'Project'},
+        'account': {'description': 'Account'},
+        'environment': {'description': 'Cloudstack Region'},
+        'iaas_provider': {'description': 'Iaas provider name'},
+        'creation_date': {'description': 'Creation Date'}
+    }
+    ZONE_METADATA = {
+        'uuid': {'description': 'UUID'},
+        'state': {'description': 'Zone state'},
+        'environment': {'description': 'Cloudstack Region'},
+        'iaas_provider': {'description': 'IaaS provider'}
+    }
+    REGION_METADATA = {
+        'environment': {'description': 'Cloudstack Region'},
+        'iaas_provider': {'description': 'IaaS provider'}
+    }
+    EDGE_METADATA = {
+        'environment': {'description': 'Cloudstack Region'},
+        'iaas_provider': {'description': 'Iaas provider name'}
+    }
+
+    _builders = {}
+    _builders_lock = threading.Lock()
+
+    def __init__(self, env):
+        self.env = env
+        self.iaas_provider = GloboMapUpdateHandler.IAAS_PROVIDER
+        self.provider = GloboMapUpdateHandler.GLOBOMAP_PROVIDER
+        self._properties = {
+            'environment': env,
+            'iaas_provider': self.iaas_provider
+        }
+        self._local = threading.local()
+
+    @classmethod
+    def for_env(cls, env):
+        builder = cls._builders.get(env)
+        if builder is None:
+            with cls._builders_lock:
+                builder = cls._builders.setdefault(env, cls(env))
+        return builder
+
+    @contextmanager
+    def batch(self):
+        if self._batch_timestamp() is not None:
+            # Nested batches keep the outer timestamp
+            yield
+            return
+        self._local.timestamp = now_timestamp()
+        try:
+            yield
+        finally:
+            self._local.timestamp = None
+
+    def timestamp(self):
+        timestamp = self._batch_timestamp()
+        return now_timestamp() if timestamp is None else timestamp
+
+    def edge(self, id, from_key, to_key):
+        return {
+            'id': id,
+            'provider': self.provider,
+            'timestamp': self.timestamp(),
+            'from': from_key,
+            'to': to_key,
+            'properties': self._properties,
+            'properties_metadata': self.EDGE_METADATA
+        }
+
+    def comp_unit(self, project, vm, timestamp, creation_date):
+        return {
+            'id': vm['id'],
+            'name': vm['name'],
+            'timestamp': timestamp,
+            'provider': self.provider,
+            'properties': {
+                'uuid': vm.get('id', ''),
+                'state': vm.get('state', ''),
+                'host': vm.get('hostname', ''),
+                'zone': vm.get('zonename', ''),
+                'service_offering': vm.get('serviceofferingname', ''),
+                'cpu_cores': vm.get('cpunumber', ''),
+                'cpu_speed': vm.get('cpuspeed', ''),
+                'memory': vm.get('memory', ''),
+                'template': vm.get('templatename', ''),
+                'project': project.get('name'),
+                'account': project.get('account', vm.get('account')),
+                'environment': self.env,
+                'iaas_provider': self.iaas_provider,
+                'creation_date': creation_date,
+            },
+            'properties_metadata': self.COMP_UNIT_METADATA
+        }
+
+    def zone(self, zone):
+        return {
+            'id': zone['id'],
+            'name': zone['name'],
+            'timestamp': self.timestamp(),
+            'provider': self.provider,
+            'properties': {
+                'uuid': zone['id'],
+                'state': zone['allocationstate'],
+                'environment': self.env,
+                'iaas_provider': self.iaas_provider
+            },
+            'properties_metadata': self.ZONE_METADATA
+        }
+
+    def region(self):
+        return {
+            'id': self.env,
+            'name': self.env,
+            'timestamp': self.timestamp(),
+            'provider': self.provider,
+            'properties': self._properties,
+            'properties_metadata': self.REGION_METADATA
+        }
+
+    def _batch_timestamp(self):
+        return getattr(self._local, 'timestamp', None)
+
+
+def now_timestamp():
+    return int(time.mktime(datetime.datetime.now().timetuple()))
+
+
+@functools.lru_cache(maxsize=PARSED_DATES_CACHE_SIZE)
+def parse_timestamp(value):
+    """
+    Returns the local timestamp of the date in value, ignoring its offset.
+    ACS formats are parsed with a regex and anything else with dateutil.
+    """
+    match = ACS_DATE_REGEX.match(value)
+    date = None
+    if match:
+        try:
+            date = datetime.datetime(*map(int, match.groups()))
+        except ValueError:
+            pass
+    if date is None:
+        date = parse(value).replace(tzinfo=None)
+    return int(time.mktime(date.timetuple()))
+
+
+def parsed_dates_hit_ratio():
+    info = parse_timestamp.cache_info()
+    total = info.hits + info.misses
+    return info.hits / total if total else 0.0
+
+
+metrics.CACHE_HIT_RATIO.set_function(
+    parsed_dates_hit_ratio, cache='parsed_dates', env=''
+)
+
+
 class VirtualMachineUpdateHandler(GloboMapUpdateHandler):
 
     def __init__(self, env, cloudstack_service):
         super(VirtualMachineUpdateHandler, self).__init__(
             env, cloudstack_service
         )
+        self.host_handler = HostUpdateHandler(env, cloudstack_service)
+        self.zone_handler = ZoneUpdateHandler(env, cloudstack_service)
+        self.dictionary_handler = DictionaryEntitiesUpdateHandler(
+            env, cloudstack_service, None
+        )
 
     def create_vm_updates(self, updates, raw_msg, project, vm):
         hostname = vm.get('hostname')
@@ -109,61 +291,29 @@ class VirtualMachineUpdateHandler(GloboMapUpdateHandler):
 
         if hostname:
             # Creates link between VM and Host
-            HostUpdateHandler(
-                self.env, self.cloudstack_service
-            ).create_host_update(updates, comp_unit_document, hostname)
+            self.host_handler.create_host_update(
+                updates, comp_unit_document, hostname
+            )
 
             # Creates link between Host and Cloudstack Zone
-            ZoneUpdateHandler(
-                self.env, self.cloudstack_service
-            ).create_zone_update(updates, comp_unit_document, hostname)
+            with tracing.span('zone_lookup'):
+                self.zone_handler.create_zone_update(
+                    updates, comp_unit_document, hostname
+                )
 
         # Creates link between VM and Dictionary entities
         is_vm_create_event = EventTypeHandler.is_vm_create_event(raw_msg)
         if is_vm_create_event:
-            DictionaryEntitiesUpdateHandler(
-                self.env, self.cloudstack_service, project
-            ).create_dictionary_updates(updates, comp_unit_document)
+            self.dictionary_handler.create_dictionary_updates(
+                updates, comp_unit_document, project
+            )
 
     def _create_comp_unit_document(self, project, vm, event_date=None):
-        return {
-            'id': vm['id'],
-            'name': vm['name'],
-            'timestamp': self._parse_date(event_date),
-            'provider': self.GLOBOMAP_PROVIDER,
-            'properties': {
-                'uuid': vm.get('id', ''),
-                'state': vm.get('state', ''),
-                'host': vm.get('hostname', ''),
-                'zone': vm.get('zonename', ''),
-                'service_offering': vm.get('serviceofferingname', ''),
-                'cpu_cores': vm.get('cpunumber', ''),
-                'cpu_speed': vm.get('cpuspeed', ''),
-                'memory': vm.get('memory', ''),
-                'template': vm.get('templatename', ''),
-                'project': project.get('name'),
-                'account': project.get('account', vm.get('account')),
-                'environment': self.env,
-                'iaas_provider': self.IAAS_PROVIDER,
-                'creation_date': self._parse_date(vm['created']),
-            },
-            'properties_metadata': {
-                'uuid': {'description': 'UUID'},
-                'state': {'description': 'Power state'},
-                'host': {'description': 'Host name'},
-                'zone': {'description': 'Zone name'},
-                'service_offering': {'description': 'Compute Offering'},
-                'cpu_cores': {'description': 'Number of CPU cores'},
-                'cpu_speed': {'description': 'CPU speed'},
-                'memory': {'description': 'RAM size'},
-                'template': {'description': 'Template name'},
-                'project': {'description': 'Project'},
-                'account': {'description': 'Account'},
-                'environment': {'description': 'Cloudstack Region'},
-                'iaas_provider': {'description': 'Iaas provider name'},
-                'creation_date': {'description': 'Creation Date'}
-            }
-        }
+        return self.builder.comp_unit(
+            project, vm,
+            self._parse_date(event_date),
+            self._parse_date(vm['created'])
+        )
 
     def create_vm_cleanup_updates(self, updates, raw_msg):
         key = self.create_key(self.get_vm_id(raw_msg))
@@ -194,10 +344,8 @@ class VirtualMachineUpdateHandler(GloboMapUpdateHandler):
     @staticmethod
     def _parse_date(event_time):
         if not event_time:
-            timetuple = datetime.datetime.now().timetuple()
-        else:
-            timetuple = parse(event_time).replace(tzinfo=None).timetuple()
-        return int(time.mktime(timetuple))
+            return now_timestamp()
+        return parse_timestamp(event_time)
 
 
 class HostUpdateHandler(GloboMapUpdateHandler):
@@ -228,13 +376,19 @@ class DictionaryEntitiesUpdateHandler(GloboMapUpdateHandler):
         )
         self.project = project
 
-    def create_dictionary_updates(self, updates, comp_unit):
+    def create_dictionary_updates(self, updates, comp_unit, project=None):
+        """
+        Uses the given project, or the one the handler was created with, so
+        a single handler can serve every virtual machine
+        """
+        if project is None:
+            project = self.project
         self._create_process_update(updates, comp_unit)
-        self._create_business_service_update(updates, comp_unit)
-        self._create_client_update(updates, comp_unit)
-        self._create_component_update(updates, comp_unit)
-        self._create_sub_component_update(updates, comp_unit)
-        self._create_product_update(updates, comp_unit)
+        self._create_business_service_update(updates, comp_unit, project)
+        self._create_client_update(updates, comp_unit, project)
+        self._create_component_update(updates, comp_unit, project)
+        self._create_sub_component_update(updates, comp_unit, project)
+        self._create_product_update(updates, comp_unit, project)
 
     def _create_process_update(self, updates, comp_unit):
         updates.append(self.create_edge(
@@ -245,9 +399,9 @@ class DictionaryEntitiesUpdateHandler(GloboMapUpdateHandler):
             self.link(Collection.COMP_UNIT, comp_unit['id'])
         ))
 
-    def _create_business_service_update(self, updates, comp_unit):
-        if self.project and self.project.get('businessserviceid'):
-            business_service_id = self.project['businessserviceid']
+    def _create_business_service_update(self, updates, comp_unit, project):
+        if project and project.get('businessserviceid'):
+            business_service_id = project['businessserviceid']
 
             from_link = self.link(
                 Collection.BUSINESS_SERVICE,
@@ -262,9 +416,9 @@ class DictionaryEntitiesUpdateHandler(GloboMapUpdateHandler):
                 self.link(Collection.COMP_UNIT, comp_unit['id'])
             ))
 
-    def _create_client_update(self, updates, comp_unit):
-        if self.project and self.project.get('clientid'):
-            client_id = self.project['clientid']
+    def _create_client_update(self, updates, comp_unit, project):
+        if project and project.get('clientid'):
+            client_id = project['clientid']
 
             updates.append(self.create_edge(
                 comp_unit['id'],
@@ -274,9 +428,9 @@ class DictionaryEntitiesUpdateHandler(GloboMapUpdateHandler):
                 self.link(Collection.COMP_UNIT, comp_unit['id']),
             ))
 
-    def _create_component_update(self, updates, comp_unit):
-        if self.project and self.project.get('componentid'):
-            component_id = self.project['componentid']
+    def _create_component_update(self, updates, comp_unit, project):
+        if project and project.get('componentid'):
+            component_id = project['componentid']
 
             updates.append(self.create_edge(
                 comp_unit['id'],
@@ -286,9 +440,9 @@ class DictionaryEntitiesUpdateHandler(GloboMapUpdateHandler):
                 self.link(Collection.COMP_UNIT, comp_unit['id']),
             ))
 
-    def _create_sub_component_update(self, updates, comp_unit):
-        if self.project and self.project.get('subcomponentid'):
-            sub_component_id = self.project['subcomponentid']
+    def _create_sub_component_update(self, updates, comp_unit, project):
+        if project and project.get('subcomponentid'):
+            sub_component_id = project['subcomponentid']
 
             updates.append(self.create_edge(
                 comp_unit['id'],
@@ -298,9 +452,9 @@ class DictionaryEntitiesUpdateHandler(GloboMapUpdateHandler):
                 self.link(Collection.COMP_UNIT, comp_unit['id']),
             ))
 
-    def _create_product_update(self, updates, comp_unit):
-        if self.project and self.project.get('productid'):
-            product_id = self.project['productid']
+    def _create_product_update(self, updates, comp_unit, project):
+        if project and project.get('productid'):
+            product_id = project['productid']
 
             updates.append(self.create_edge(
                 comp_unit['id'],
@@ -316,6 +470,9 @@ class ZoneUpdateHandler(GloboMapUpdateHandler):
     def create_zone_update(self, updates, comp_unit, hostname):
         zone_name = comp_unit['properties']['zone']
         zone = self.cloudstack_service.get_zone_by_name(zone_name)
+        if not zone:
+            logger.warning('Zone %s not found in ACS', zone_name)
+            return
 
         self._create_zone_document(updates, zone)
 
@@ -339,27 +496,13 @@ class ZoneUpdateHandler(GloboMapUpdateHandler):
 
     def create_zone_status_update(self, updates, zone_id):
         zone = self.cloudstack_service.get_zone_by_id(zone_id)
+        if not zone:
+            logger.warning('Zone %s not found in ACS', zone_id)
+            return
         self._create_zone_document(updates, zone)
 
     def _create_zone_document(self, updates, zone):
-        zone_document = {
-            'id': zone['id'],
-            'name': zone['name'],
-            'timestamp': self.now_timestamp(),
-            'provider': self.GLOBOMAP_PROVIDER,
-            'properties': {
-                'uuid': zone['id'],
-                'state': zone['allocationstate'],
-                'environment': self.env,
-                'iaas_provider': self.IAAS_PROVIDER
-            },
-            'properties_metadata': {
-                'uuid': {'description': 'UUID'},
-                'state': {'description': 'Zone state'},
-                'environment': {'description': 'Cloudstack Region'},
-                'iaas_provider': {'description': 'IaaS provider'}
-            }
-        }
+        zone_document = self.builder.zone(zone)
 
         updates.append(self.create_document(
             GloboMapActions.UPDATE,
@@ -381,20 +524,7 @@ class ZoneUpdateHandler(GloboMapUpdateHandler):
 class RegionUpdateHandler(GloboMapUpdateHandler):
 
     def create_region_update(self, updates):
-        region_document = {
-            'id': self.env,
-            'name': self.env,
-            'timestamp': self.now_timestamp(),
-            'provider': self.GLOBOMAP_PROVIDER,
-            'properties': {
-                'environment': self.env,
-                'iaas_provider': self.IAAS_PROVIDER
-            },
-            'properties_metadata': {
-                'environment': {'description': 'Cloudstack Region'},
-                'iaas_provider': {'description': 'IaaS provider'}
-            }
-        }
+        region_document = self.builder.region()
         updates.append(self.create_document(
             GloboMapActions.UPDATE,
             Collection.REGION,
@@ -411,10 +541,17 @@ class EventTypeHandler(object):
     VM_DELETE_EVENT = 'VM.DESTROY'
     ZONE_EDIT = 'ZONE.EDIT'
 
+    VM_RESOURCE = 'com.cloud.vm.VirtualMachine'
+    VM_STATE_RESOURCE = 'VirtualMachine'
+
+    UPGRADE_COMPLETED = 'Completed'
+    POST_STATE_TRANSITION = 'postStateTransitionEvent'
+    ZONE_EDIT_COMPLETED = 'completed'
+
     @staticmethod
     def is_vm_create_event(msg):
         is_create_event = msg.get('event') == EventTypeHandler.VM_CREATE_EVENT
-        is_vm_resource = msg.get('resource') == 'com.cloud.vm.VirtualMachine'
+        is_vm_resource = msg.get('resource') == EventTypeHandler.VM_RESOURCE
         return is_create_event and is_vm_resource
 
     @staticmethod
@@ -427,25 +564,29 @@ class EventTypeHandler(object):
     @staticmethod
     def is_vm_delete_event(msg):
         is_create_event = msg.get('event') == EventTypeHandler.VM_DELETE_EVENT
-        is_vm_resource = msg.get('resource') == 'com.cloud.vm.VirtualMachine'
+        is_vm_resource = msg.get('resource') == EventTypeHandler.VM_RESOURCE
         return is_create_event and is_vm_resource
 
     @staticmethod
     def is_vm_upgrade_event(msg):
         is_up_event = msg.get('event') == EventTypeHandler.VM_UPGRADE_EVENT
-        is_event_complete = msg.get('status') == 'Completed'
+        is_event_complete = \
+            msg.get('status') == EventTypeHandler.UPGRADE_COMPLETED
         return is_up_event and is_event_complete
 
     @staticmethod
     def is_vm_power_state_event(msg):
-        is_vm_upgrade_event = msg.get('resource') == 'VirtualMachine'
-        is_event_complete = msg.get('status') == 'postStateTransitionEvent'
+        is_vm_upgrade_event = \
+            msg.get('resource') == EventTypeHandler.VM_STATE_RESOURCE
+        is_event_complete = \
+            msg.get('status') == EventTypeHandler.POST_STATE_TRANSITION
         return is_vm_upgrade_event and is_event_complete
 
     @staticmethod
     def is_zone_change_state_event(msg):
         is_zone_edit_event = msg.get('event') == EventTypeHandler.ZONE_EDIT
-        is_event_complete = msg.get('status') == 'completed'
+        is_event_complete = \
+            msg.get('status') == EventTypeHandler.ZONE_EDIT_COMPLETED
         return is_zone_edit_event and is_event_complete
 
 
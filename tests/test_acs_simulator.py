@@ -0,0 +1,118 @@
+"""
+   Copyright 2017 Globo.com
+
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+
+       http://www.apache.org/licenses/LICENSE-2.0
+
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+"""
+import unittest
+
+from unittest.mock import patch
+
+from benchmarks.acs_simulator import ACSSimulator
+from benchmarks.acs_simulator import Inventory
+from benchmarks.acs_simulator import LoaderAPISink
+from benchmarks.bench_full_load import SimulatedCloudstack
+from globomap_driver_acs.cloudstack import CloudStackClient
+from globomap_driver_acs.cloudstack import CloudstackService
+from globomap_driver_acs.transport import PooledTransport
+
+
+class TestACSSimulator(unittest.TestCase):
+
+    def setUp(self):
+        self.simulator = ACSSimulator(inventory=Inventory(3, 5, 103, 2))
+        self.simulator.start()
+        self.client = CloudStackClient(
+            self.simulator.url, 'api-key', 'secret-key',
+            transport=PooledTransport(pool_size=2)
+        )
+
+    def tearDown(self):
+        self.client.close()
+        self.simulator.stop()
+
+    def test_inventory_is_deterministic(self):
+        inventory = Inventory(3, 5, 103, 2)
+
+        self.assertEqual(inventory.vms, self.simulator.inventory.vms)
+        self.assertEqual(103, sum(
+            owner['vmtotal']
+            for owner in inventory.accounts + inventory.projects
+        ))
+
+    def test_paginated_listing(self):
+        service = CloudstackService(self.client, page_size=10)
+
+        vms = [
+            vm['id'] for project in service.iter_projects()
+            for vm in service.iter_virtual_machines_by_project(project['id'])
+        ] + [
+            vm['id'] for account in service.iter_accounts()
+            for vm in service.iter_virtual_machines_by_account(account['id'])
+        ]
+
+        self.assertEqual(
+            sorted(vm['id'] for vm in self.simulator.inventory.vms),
+            sorted(vms)
+        )
+
+    def test_get_by_id(self):
+        service = CloudstackService(self.client)
+        vm = self.simulator.inventory.vms[5]
+
+        self.assertEqual('vm-5', service.get_virtual_machine(vm['id'])['name'])
+        self.assertEqual('zone-1', service.get_zone_by_name('zone-1')['name'])
+
+    def test_rejects_wrong_signature(self):
+        client = CloudStackClient(self.simulator.url, 'api-key', 'wrong')
+
+        with self.assertRaises(Exception):
+            client.listZones({})
+        client.close()
+
+    def test_injected_errors(self):
+        self.simulator.error_rate = 1
+
+        self.assertIsNone(self.client.listZones({}))
+        self.assertEqual(1, self.simulator.errors)
+
+    def test_injected_errors_given_error_commands(self):
+        self.simulator.error_rate = 1
+        self.simulator.error_commands = ['listProjects']
+
+        self.assertIsNotNone(self.client.listZones({}))
+        self.assertIsNone(self.client.listProjects({}))
+        self.assertEqual(1, self.simulator.errors)
+
+
+class TestFullLoad(unittest.TestCase):
+
+    def test_full_load(self):
+        settings = {
+            'ACS_SIM_API_KEY': 'api-key',
+            'ACS_SIM_API_SECRET_KEY': 'secret-key',
+            'ACS_SIM_API_PAGE_SIZE': '7',
+            'ACS_SIM_LOADER_WORKERS': '2'
+        }
+        with ACSSimulator(inventory=Inventory(3, 5, 40, 2)) as simulator, \
+                LoaderAPISink() as sink:
+            settings['ACS_SIM_API_URL'] = simulator.url
+            with patch.dict('os.environ', settings), patch(
+                'globomap_driver_acs.load.GLOBOMAP_LOADER_API_URL', sink.url
+            ):
+                driver = SimulatedCloudstack({'env': 'SIM'})
+                driver.full_load()
+                driver._close_cloudstack()
+
+        self.assertGreater(sink.documents, 40)
+        self.assertGreater(sink.clears, 0)
+        self.assertEqual(0, simulator.errors)
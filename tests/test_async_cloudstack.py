@@ -0,0 +1,134 @@
+"""
+   Copyright 2017 Globo.com
+
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+
+       http://www.apache.org/licenses/LICENSE-2.0
+
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+"""
+import asyncio
+import json
+import threading
+import time
+import unittest
+import urllib.parse
+
+from globomap_driver_acs.async_cloudstack import AsyncCloudStackClient
+from globomap_driver_acs.async_cloudstack import AsyncCloudstackService
+from tests.util import open_json
+
+
+class FakeTransport(object):
+
+    def __init__(self):
+        self.commands = []
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self._lock = threading.Lock()
+
+    def get(self, url):
+        query = urllib.parse.parse_qs(urllib.parse.urlsplit(url).query)
+        command = query['command'][0]
+        with self._lock:
+            self.commands.append(command)
+            self.in_flight += 1
+            self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        time.sleep(0.01)
+        with self._lock:
+            self.in_flight -= 1
+        if command == 'listVirtualMachines':
+            vms = [{'id': id} for id in query['ids'][0].split(',')]
+            response = {'count': len(vms), 'virtualmachine': vms}
+        elif command == 'listProjects':
+            response = open_json('tests/json/project.json')
+        else:
+            response = open_json('tests/json/zone.json')
+        return json.dumps({command.lower() + 'response': response})
+
+    def close(self):
+        pass
+
+
+def run(coroutine):
+    loop = asyncio.new_event_loop()
+    try:
+        return loop.run_until_complete(coroutine)
+    finally:
+        loop.close()
+
+
+class TestAsyncCloudStackClient(unittest.TestCase):
+
+    def test_make_request(self):
+        transport = FakeTransport()
+        client = AsyncCloudStackClient(
+            'http://acs/client/api', 'key', 'secret', transport=transport
+        )
+
+        response = run(client.listZones({'id': '1'}))
+        client.close()
+
+        self.assertEqual(open_json('tests/json/zone.json'), response)
+        self.assertEqual(['listZones'], transport.commands)
+
+
+class TestAsyncCloudstackService(unittest.TestCase):
+
+    def setUp(self):
+        self.transport = FakeTransport()
+        self.client = AsyncCloudStackClient(
+            'http://acs/client/api', 'key', 'secret',
+            transport=self.transport, max_workers=4
+        )
+
+    def tearDown(self):
+        self.client.close()
+
+    def test_get_virtual_machines(self):
+        service = AsyncCloudstackService(self.client, limit=3)
+
+        vms = run(service.get_virtual_machines(
+            ['1', '2', '3', '4', '5', '6', '1', None], chunk_size=1
+        ))
+
+        self.assertEqual(['1', '2', '3', '4', '5', '6'], sorted(vms))
+        self.assertEqual(6, len(self.transport.commands))
+        self.assertEqual(3, self.transport.max_in_flight)
+
+    def test_limit_given_more_than_workers(self):
+        service = AsyncCloudstackService(self.client, limit=50)
+
+        run(service.get_virtual_machines(
+            [str(id) for id in range(20)], chunk_size=1
+        ))
+
+        self.assertEqual(4, service.limit)
+        self.assertEqual(4, self.transport.max_in_flight)
+
+    def test_get_projects_uses_project_cache(self):
+        service = AsyncCloudstackService(self.client)
+
+        projects = run(service.get_projects(['1', '1', None]))
+        project = run(service.get_project('1'))
+
+        self.assertEqual('project_name', projects[0]['name'])
+        self.assertEqual(dict(), projects[2])
+        self.assertEqual(project, projects[0])
+        self.assertEqual(1, self.transport.commands.count('listProjects'))
+
+    def test_get_zone_uses_zone_index(self):
+        service = AsyncCloudstackService(self.client)
+
+        zone = run(service.get_zone_by_name('zone_a'))
+        same_zone = run(service.get_zone_by_id(zone['id']))
+
+        self.assertEqual('zone_a', zone['name'])
+        self.assertIs(zone, same_zone)
+        self.assertEqual(['listZones'], self.transport.commands)
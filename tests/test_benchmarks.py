@@ -0,0 +1,45 @@
+"""
+   Copyright 2017 Globo.com
+
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+
+       http://www.apache.org/licenses/LICENSE-2.0
+
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+"""
+import unittest
+
+from benchmarks import suite
+
+
+class TestBenchmarkSuite(unittest.TestCase):
+
+    def test_run(self):
+        results = suite.run(number=1, repeat=1)
+
+        self.assertEqual(
+            set(name for name, _ in suite.CASES), set(results.keys())
+        )
+        for result in results.values():
+            self.assertGreater(result['us'], 0)
+
+    def test_compare(self):
+        baseline = {
+            'a': {'us': 10, 'bytes': 100},
+            'b': {'us': 10, 'bytes': 100}
+        }
+        results = {
+            'a': {'us': 12, 'bytes': 100},
+            'b': {'us': 14, 'bytes': 200},
+            'c': {'us': 100, 'bytes': 100}
+        }
+
+        self.assertEqual([
+            ('b', 'us', 10, 14), ('b', 'bytes', 100, 200)
+        ], suite.compare(results, baseline, 0.3))
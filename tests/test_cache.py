@@ -0,0 +1,76 @@
+"""
+   Copyright 2017 Globo.com
+
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+
+       http://www.apache.org/licenses/LICENSE-2.0
+
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+"""
+import unittest
+
+from globomap_driver_acs.cache import LRUCache
+from globomap_driver_acs.cache import MISSING
+
+
+class FakeClock(object):
+
+    def __init__(self):
+        self.now = 0
+
+    def __call__(self):
+        return self.now
+
+
+class TestLRUCache(unittest.TestCase):
+
+    def test_get(self):
+        cache = LRUCache()
+        cache.set('a', 1)
+
+        self.assertEqual(1, cache.get('a'))
+        self.assertIs(MISSING, cache.get('b'))
+        self.assertEqual(1, cache.hits)
+        self.assertEqual(1, cache.misses)
+        self.assertEqual(0.5, cache.hit_ratio())
+
+    def test_get_given_falsy_value(self):
+        cache = LRUCache()
+        cache.set('a', dict())
+
+        self.assertEqual(dict(), cache.get('a'))
+
+    def test_get_given_expired_entry(self):
+        clock = FakeClock()
+        cache = LRUCache(ttl=10, clock=clock)
+        cache.set('a', 1)
+        cache.set('b', 2, ttl=20)
+        clock.now = 15
+
+        self.assertIs(MISSING, cache.get('a'))
+        self.assertEqual(2, cache.get('b'))
+        self.assertEqual(1, len(cache))
+
+    def test_set_evicts_least_recently_used(self):
+        cache = LRUCache(max_size=2)
+        cache.set('a', 1)
+        cache.set('b', 2)
+        cache.get('a')
+        cache.set('c', 3)
+
+        self.assertEqual(1, cache.get('a'))
+        self.assertIs(MISSING, cache.get('b'))
+        self.assertEqual(3, cache.get('c'))
+
+    def test_invalidate(self):
+        cache = LRUCache()
+        cache.set('a', 1)
+        cache.invalidate('a')
+
+        self.assertIs(MISSING, cache.get('a'))
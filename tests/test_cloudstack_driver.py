@@ -13,15 +13,23 @@
    See the License for the specific language governing permissions and
    limitations under the License.
 """
+import json
+import time
 import unittest
 from unittest.mock import MagicMock
 from unittest.mock import Mock
 from unittest.mock import patch
 
+from dateutil.parser import parse
+
+from globomap_driver_acs import metrics
 from globomap_driver_acs.driver import Cloudstack
+from globomap_driver_acs.rabbitmq import Delivery
 from globomap_driver_acs.update_handlers import DictionaryEntitiesUpdateHandler
+from globomap_driver_acs.update_handlers import DocumentBuilder
 from globomap_driver_acs.update_handlers import EventTypeHandler
 from globomap_driver_acs.update_handlers import HostUpdateHandler
+from globomap_driver_acs.update_handlers import parse_timestamp
 from globomap_driver_acs.update_handlers import RegionUpdateHandler
 from globomap_driver_acs.update_handlers import VirtualMachineUpdateHandler
 from globomap_driver_acs.update_handlers import ZoneUpdateHandler
@@ -83,6 +91,23 @@ class TestCloudstackDriver(unittest.TestCase):
         self.assertTrue(cloudstack_mock.get_virtual_machine.called)
         self.assertTrue(cloudstack_mock.get_project.called)
 
+    def test_create_vm_updates_given_listed_vm(self):
+        self._mock_rabbitmq_client()
+        cloudstack_mock = self._mock_cloudstack_service(
+            None, None, open_json('tests/json/zone.json')['zone'][0]
+        )
+        updates = self._create_driver()._create_vm_updates(
+            open_json('tests/json/vm_create_event.json'),
+            open_json('tests/json/vm.json')['virtualmachine'][0],
+            open_json('tests/json/project.json')['project'][0]
+        )
+
+        self.assertEqual(12, len(updates))
+        self.assertEqual('PATCH', updates[0]['action'])
+        self.assertEqual('region', updates[-1]['collection'])
+        self.assertFalse(cloudstack_mock.get_virtual_machine.called)
+        self.assertFalse(cloudstack_mock.get_project.called)
+
     def test_format_create_vm_delete_document(self):
         self._mock_cloudstack_service(None, None, None)
         self._mock_rabbitmq_client()
@@ -226,6 +251,35 @@ class TestCloudstackDriver(unittest.TestCase):
         self.assertFalse(cloudstack_mock.get_virtual_machine.called)
         self.assertFalse(cloudstack_mock.get_project.called)
 
+    def test_format_zone_edit_update(self):
+        self._mock_rabbitmq_client()
+        cloudstack_mock = self._mock_cloudstack_service(
+            None, None, open_json('tests/json/zone.json')['zone'][0]
+        )
+        updates = self._create_driver()._create_updates({
+            'event': 'ZONE.EDIT',
+            'status': 'completed',
+            'entityuuid': '35ae56ee-273a-46da-8422-fe2b3490c76a'
+        })
+
+        self.assertEqual(1, len(updates))
+        self.assertEqual('zone', updates[0]['collection'])
+        self.assertTrue(cloudstack_mock.refresh_zones.called)
+        cloudstack_mock.get_zone_by_id.assert_called_once_with(
+            '35ae56ee-273a-46da-8422-fe2b3490c76a')
+
+    def test_create_zone_update_given_zone_not_found(self):
+        self._mock_rabbitmq_client()
+        cloudstack_mock = self._mock_cloudstack_service(None, None, None)
+
+        handler = self._create_zone_update_handler(
+            cloudstack_service=cloudstack_mock)
+        updates = []
+        handler.create_zone_update(
+            updates, {'id': '123', 'properties': {'zone': 'zone_a'}}, 'hostname')
+
+        self.assertEqual([], updates)
+
     def test_process_updates(self):
         rabbit_client_mock = self._mock_rabbitmq_client(
             open_json('tests/json/vm_create_event.json'))
@@ -333,6 +387,409 @@ class TestCloudstackDriver(unittest.TestCase):
         self.assertEqual(0, rabbit_client_mock.ack_message.call_count)
         self.assertEqual(1, rabbit_client_mock.nack_message.call_count)
 
+    def test_process_updates_given_push_consumer(self):
+        rabbit_client_mock = self._mock_rabbitmq_client()
+        event = open_json('tests/json/vm_create_event.json')
+        rabbit_client_mock.consume_deliveries.return_value = iter(self._deliveries(
+            [(event, 1), (event, 2), (event, 3)]))
+        self._mock_cloudstack_service(
+            open_json('tests/json/vm.json')['virtualmachine'][0],
+            open_json('tests/json/project.json')['project'][0],
+            open_json('tests/json/zone.json')['zone'][0]
+        )
+        self._patch_env({
+            'ACS_ENV_RMQ_CONSUMER': 'push', 'ACS_ENV_RMQ_ACK_BATCH': '2'
+        })
+
+        self._create_driver().process_updates(lambda update: None)
+
+        self.assertFalse(rabbit_client_mock.get_delivery.called)
+        self.assertEqual([
+            ((2,), {'multiple': True}), ((3,), {'multiple': True})
+        ], rabbit_client_mock.ack_message.call_args_list)
+        self.assertEqual(0, rabbit_client_mock.nack_message.call_count)
+
+    def test_process_updates_given_ack_batch_above_prefetch(self):
+        rabbit_client_mock = self._mock_rabbitmq_client()
+        event = open_json('tests/json/vm_create_event.json')
+        rabbit_client_mock.consume_deliveries.return_value = iter(self._deliveries(
+            [(event, 1), (event, 2), (event, 3)]))
+        self._mock_cloudstack_service(
+            open_json('tests/json/vm.json')['virtualmachine'][0],
+            open_json('tests/json/project.json')['project'][0],
+            open_json('tests/json/zone.json')['zone'][0]
+        )
+        self._patch_env({
+            'ACS_ENV_RMQ_CONSUMER': 'push', 'ACS_ENV_RMQ_ACK_BATCH': '50',
+            'ACS_ENV_RMQ_PREFETCH': '2'
+        })
+
+        self._create_driver().process_updates(lambda update: None)
+
+        self.assertEqual([
+            ((2,), {'multiple': True}), ((3,), {'multiple': True})
+        ], rabbit_client_mock.ack_message.call_args_list)
+
+    def test_process_updates_given_push_consumer_exception(self):
+        rabbit_client_mock = self._mock_rabbitmq_client()
+        event = open_json('tests/json/vm_create_event.json')
+        rabbit_client_mock.consume_deliveries.return_value = iter(self._deliveries(
+            [(event, 1), (event, 2), ({'id': 'x'}, 3)]))
+        cloudstack_mock = self._mock_cloudstack_service(
+            open_json('tests/json/vm.json')['virtualmachine'][0],
+            open_json('tests/json/project.json')['project'][0],
+            open_json('tests/json/zone.json')['zone'][0]
+        )
+        cloudstack_mock.get_virtual_machine.side_effect = [
+            open_json('tests/json/vm.json')['virtualmachine'][0],
+            Exception()
+        ]
+        self._patch_env({'ACS_ENV_RMQ_CONSUMER': 'push'})
+
+        with self.assertRaises(Exception):
+            self._create_driver().process_updates(lambda update: None)
+
+        rabbit_client_mock.ack_message.assert_called_once_with(
+            1, multiple=True)
+        rabbit_client_mock.nack_message.assert_called_once_with(2)
+
+    def test_process_updates_counts_messages(self):
+        rabbit_client_mock = self._mock_rabbitmq_client()
+        event = open_json('tests/json/vm_create_event.json')
+        rabbit_client_mock.consume_deliveries.return_value = iter(self._deliveries(
+            [(event, 1), (event, 2), (event, 3)]))
+        cloudstack_mock = self._mock_cloudstack_service(
+            open_json('tests/json/vm.json')['virtualmachine'][0],
+            open_json('tests/json/project.json')['project'][0],
+            open_json('tests/json/zone.json')['zone'][0]
+        )
+        cloudstack_mock.get_virtual_machine.side_effect = [
+            open_json('tests/json/vm.json')['virtualmachine'][0],
+            Exception()
+        ]
+        self._patch_env({'ACS_ENV_RMQ_CONSUMER': 'push'})
+        counters = [metrics.MESSAGES_CONSUMED, metrics.MESSAGES_ACKED,
+                    metrics.MESSAGES_NACKED]
+        before = [counter.get(event='VM.CREATE') for counter in counters]
+        comp_units = metrics.DOCUMENTS.get(collection='comp_unit')
+        callbacks = metrics.CALLBACK_SECONDS.get_count()
+
+        with self.assertRaises(Exception):
+            self._create_driver().process_updates(lambda update: None)
+
+        self.assertEqual([2, 1, 1], [
+            counter.get(event='VM.CREATE') - count
+            for counter, count in zip(counters, before)
+        ])
+        self.assertEqual(
+            1, metrics.DOCUMENTS.get(collection='comp_unit') - comp_units
+        )
+        self.assertEqual(12, metrics.CALLBACK_SECONDS.get_count() - callbacks)
+
+    def test_process_updates_traces_stages(self):
+        self._mock_rabbitmq_client(
+            open_json('tests/json/vm_create_event.json'))
+        self._mock_cloudstack_service(
+            open_json('tests/json/vm.json')['virtualmachine'][0],
+            open_json('tests/json/project.json')['project'][0],
+            open_json('tests/json/zone.json')['zone'][0]
+        )
+        driver = self._create_driver()
+        sink = Mock()
+        driver.tracer.add_sink(sink)
+
+        driver.process_updates(lambda update: None)
+
+        trace = sink.record.call_args[0][0]
+        self.assertEqual('event', trace.name)
+        self.assertEqual({
+            'create_updates', 'create_updates.acs_fetch',
+            'create_updates.project_lookup', 'create_updates.documents',
+            'create_updates.documents.zone_lookup', 'callback'
+        }, set(trace.stages()))
+
+    def test_create_tracer(self):
+        self._mock_rabbitmq_client()
+        self._mock_cloudstack_service(None, None, None)
+        self._patch_env({
+            'ACS_ENV_TRACE_SINKS': 'metrics',
+            'ACS_ENV_PROFILE_SAMPLE_RATE': '0.01'
+        })
+
+        tracer = self._create_driver().tracer
+
+        self.assertTrue(tracer.enabled)
+        self.assertEqual(1, len(tracer.sinks))
+        self.assertEqual(0.01, tracer.profile_rate)
+        self.assertEqual(1, tracer.profile_threshold)
+
+    def test_process_updates_skips_irrelevant_messages(self):
+        rabbit_client_mock = self._mock_rabbitmq_client()
+        event = open_json('tests/json/vm_power_state_event.json')
+        rabbit_client_mock.get_delivery.side_effect = self._deliveries(
+            [(dict(event, status='preStateTransitionEvent'), 1), (event, 2),
+             (None, None)],
+            'management-server.ResourceStateEvent.'
+            'OperationSucceeded.VirtualMachine.1'
+        )
+        self._mock_cloudstack_service(
+            open_json('tests/json/vm.json')['virtualmachine'][0],
+            open_json('tests/json/project.json')['project'][0],
+            open_json('tests/json/zone.json')['zone'][0]
+        )
+        driver = self._create_driver()
+        json_mock = patch(
+            'globomap_driver_acs.rabbitmq.Delivery.json',
+            autospec=True, side_effect=lambda delivery: event
+        ).start()
+
+        driver.process_updates(lambda update: None)
+
+        self.assertEqual(1, json_mock.call_count)
+        self.assertEqual(
+            [((1,), {}), ((2,), {})],
+            rabbit_client_mock.ack_message.call_args_list
+        )
+        self.assertEqual(
+            {'unrouted': 1, 'vm_power_state': 1}, driver.router.stats()
+        )
+
+    def test_process_updates_given_coalesce_window(self):
+        create_event = open_json('tests/json/vm_create_event.json')
+        power_event = open_json('tests/json/vm_power_state_event.json')
+        upgrade_event = open_json('tests/json/vm_upgrade_event.json')
+        rabbit_client_mock = self._mock_rabbitmq_client()
+        rabbit_client_mock.get_delivery.side_effect = self._deliveries([
+            (create_event, 1), (power_event, 2), (upgrade_event, 3),
+            (None, None)
+        ])
+        cloudstack_mock = self._mock_cloudstack_service(
+            open_json('tests/json/vm.json')['virtualmachine'][0],
+            open_json('tests/json/project.json')['project'][0],
+            open_json('tests/json/zone.json')['zone'][0]
+        )
+        self._patch_env({'ACS_ENV_COALESCE_WINDOW': '10'})
+        updates = []
+
+        self._create_driver().process_updates(updates.append)
+
+        cloudstack_mock.get_virtual_machine.assert_called_once_with(
+            '3018bdf1-4843-43b3-bdcf-ba1beb63c930')
+        collections = [update['collection'] for update in updates]
+        self.assertIn('custeio_process_comp_unit', collections)
+        rabbit_client_mock.ack_message.assert_called_once_with(
+            3, multiple=True)
+        self.assertEqual(0, rabbit_client_mock.nack_message.call_count)
+
+    def test_process_updates_given_coalesce_window_with_many_vms(self):
+        vm = open_json('tests/json/vm.json')['virtualmachine'][0]
+        event = open_json('tests/json/vm_power_state_event.json')
+        rabbit_client_mock = self._mock_rabbitmq_client()
+        rabbit_client_mock.get_delivery.side_effect = self._deliveries([
+            (event, 1), (dict(event, id='vm-b'), 2),
+            (dict(event, id='vm-c'), 3), (None, None)
+        ])
+        cloudstack_mock = self._mock_cloudstack_service(
+            vm,
+            open_json('tests/json/project.json')['project'][0],
+            open_json('tests/json/zone.json')['zone'][0]
+        )
+        cloudstack_mock.get_virtual_machines.return_value = {
+            vm['id']: vm, 'vm-b': dict(vm, id='vm-b')
+        }
+        self._patch_env({'ACS_ENV_COALESCE_WINDOW': '10'})
+        updates = []
+
+        self._create_driver().process_updates(updates.append)
+
+        cloudstack_mock.get_virtual_machines.assert_called_once_with(
+            [vm['id'], 'vm-b', 'vm-c'])
+        cloudstack_mock.get_virtual_machine.assert_called_once_with('vm-c')
+        comp_units = [update['key'] for update in updates
+                      if update['collection'] == 'comp_unit']
+        self.assertEqual(3, len(comp_units))
+
+    def test_process_updates_given_coalesce_window_and_push_consumer(self):
+        event = open_json('tests/json/vm_power_state_event.json')
+        rabbit_client_mock = self._mock_rabbitmq_client()
+        rabbit_client_mock.wait_delivery.side_effect = self._deliveries([
+            (event, 1), (dict(event, id='vm-b'), 2),
+            (dict(event, id='vm-c'), 3), (None, None), (None, None)
+        ])
+        cloudstack_mock = self._mock_cloudstack_service(
+            open_json('tests/json/vm.json')['virtualmachine'][0],
+            open_json('tests/json/project.json')['project'][0],
+            open_json('tests/json/zone.json')['zone'][0]
+        )
+        cloudstack_mock.get_virtual_machines.return_value = {}
+        self._patch_env({
+            'ACS_ENV_COALESCE_WINDOW': '10', 'ACS_ENV_RMQ_CONSUMER': 'push',
+            'ACS_ENV_RMQ_PREFETCH': '2'
+        })
+
+        self._create_driver().process_updates(lambda update: None)
+
+        rabbit_client_mock.set_prefetch.assert_called_once_with(2)
+        self.assertEqual([
+            ((2,), {'multiple': True}), ((3,), {'multiple': True})
+        ], rabbit_client_mock.ack_message.call_args_list)
+        timeouts = [call[0][0] for call in
+                    rabbit_client_mock.wait_delivery.call_args_list]
+        self.assertEqual([1, 1], [timeouts[0], timeouts[2]])
+        self.assertTrue(0 < timeouts[1] <= 10 and 0 < timeouts[3] <= 10)
+        self.assertEqual(1, timeouts[4])
+        self.assertFalse(rabbit_client_mock.get_delivery.called)
+        self.assertTrue(rabbit_client_mock.cancel_consumer.called)
+
+    def test_process_updates_given_coalesce_window_exception(self):
+        rabbit_client_mock = self._mock_rabbitmq_client()
+        rabbit_client_mock.get_delivery.side_effect = self._deliveries([
+            (open_json('tests/json/vm_destroy_event.json'), 1),
+            (open_json('tests/json/vm_create_event.json'), 2),
+            (None, None)
+        ])
+        self._mock_cloudstack_service(
+            open_json('tests/json/vm.json')['virtualmachine'][0],
+            open_json('tests/json/project.json')['project'][0],
+            open_json('tests/json/zone.json')['zone'][0]
+        )
+        self._patch_env({'ACS_ENV_COALESCE_WINDOW': '10'})
+
+        def callback(update):
+            if update['action'] == 'PATCH':
+                raise Exception()
+
+        with self.assertRaises(Exception):
+            self._create_driver().process_updates(callback)
+
+        rabbit_client_mock.ack_message.assert_called_once_with(1)
+        rabbit_client_mock.nack_message.assert_called_once_with(2)
+
+    def test_coalesce(self):
+        self._mock_rabbitmq_client()
+        create_event = open_json('tests/json/vm_create_event.json')
+        destroy_event = open_json('tests/json/vm_destroy_event.json')
+        power_event = open_json('tests/json/vm_power_state_event.json')
+        other_event = dict(power_event, id='other')
+
+        units = self._create_driver()._coalesce([
+            (create_event, 1), (other_event, 2), (power_event, 3),
+            (destroy_event, 4), (power_event, 5)
+        ])
+
+        self.assertEqual([[2], [1, 3], [4], [5]], [tags for _, tags in units])
+        merged = units[1][0]
+        self.assertEqual('VM.CREATE', merged['event'])
+        self.assertEqual(power_event.get('eventDateTime'),
+                         merged['eventDateTime'])
+        self.assertIs(power_event, units[3][0])
+
+    def test_process_updates_given_coalesce_window_and_destroyed_vm(self):
+        events = [
+            (open_json('tests/json/vm_create_event.json'), 1),
+            (open_json('tests/json/vm_destroy_event.json'), 2),
+            (open_json('tests/json/vm_power_state_event.json'), 3),
+            (None, None)
+        ]
+        rabbit_client_mock = self._mock_rabbitmq_client()
+        cloudstack_mock = self._mock_cloudstack_service(
+            open_json('tests/json/vm.json')['virtualmachine'][0],
+            open_json('tests/json/project.json')['project'][0],
+            open_json('tests/json/zone.json')['zone'][0]
+        )
+        cloudstack_mock.get_virtual_machines.return_value = {}
+        updates = []
+        coalesced_updates = []
+
+        rabbit_client_mock.get_delivery.side_effect = self._deliveries(events)
+        self._create_driver().process_updates(updates.append)
+        rabbit_client_mock.get_delivery.side_effect = self._deliveries(events)
+        self._patch_env({'ACS_ENV_COALESCE_WINDOW': '10'})
+        self._create_driver().process_updates(coalesced_updates.append)
+
+        def summary(updates):
+            return [(update['action'], update['collection'])
+                    for update in updates]
+
+        self.assertEqual(summary(updates), summary(coalesced_updates))
+        actions = [action for action, _ in summary(coalesced_updates)]
+        after_destroy = summary(coalesced_updates)[
+            len(actions) - actions[::-1].index('DELETE'):
+        ]
+        self.assertEqual(('PATCH', 'comp_unit'), after_destroy[0])
+        self.assertFalse([collection for _, collection in after_destroy
+                          if collection.startswith('custeio_')])
+
+    def test_create_updates_counts_dispatches(self):
+        self._mock_rabbitmq_client()
+        self._mock_cloudstack_service(
+            open_json('tests/json/vm.json')['virtualmachine'][0],
+            self.project,
+            open_json('tests/json/zone.json')['zone'][0]
+        )
+        driver = self._create_driver()
+
+        driver._create_updates(open_json('tests/json/vm_create_event.json'))
+        driver._create_updates(open_json('tests/json/vm_destroy_event.json'))
+        driver._create_updates(open_json('tests/json/vm_destroy_event.json'))
+        driver._create_updates({'event': 'USER.LOGIN'})
+
+        self.assertEqual(
+            {'vm_create': 1, 'vm_delete': 2, 'unrouted': 1},
+            driver.router.stats()
+        )
+
+    def test_create_updates_given_registered_handler(self):
+        self._mock_rabbitmq_client()
+        self._mock_cloudstack_service(None, None, None)
+        driver = self._create_driver()
+        handler = Mock(return_value=[{'action': 'UPDATE'}])
+        driver.router.register(handler, event='NETWORK.CREATE')
+
+        updates = driver._create_updates({'event': 'NETWORK.CREATE'})
+
+        self.assertEqual([{'action': 'UPDATE'}], updates)
+
+    def test_handlers_shared_between_messages(self):
+        self._mock_rabbitmq_client()
+        acs_service = self._mock_cloudstack_service(
+            open_json('tests/json/vm.json')['virtualmachine'][0],
+            self.project,
+            open_json('tests/json/zone.json')['zone'][0]
+        )
+        driver = self._create_driver()
+        vm_update_handler = driver.vm_update_handler
+
+        driver._create_updates(open_json('tests/json/vm_create_event.json'))
+        driver._create_updates(open_json('tests/json/vm_create_event.json'))
+
+        self.assertIs(vm_update_handler, driver.vm_update_handler)
+        self.assertIs(acs_service, driver.vm_update_handler.cloudstack_service)
+        self.assertIs(acs_service, driver.zone_handler.cloudstack_service)
+        self.assertIs(acs_service, driver.region_handler.cloudstack_service)
+
+    def test_reconnect(self):
+        self._mock_rabbitmq_client()
+        self._mock_cloudstack_service(None, None, None)
+        driver = self._create_driver()
+        acs_service = driver.acs_service
+        vm_update_handler = driver.vm_update_handler
+
+        driver.reconnect()
+
+        self.assertTrue(acs_service.cloudstack_client.close.called)
+        self.assertIsNot(vm_update_handler, driver.vm_update_handler)
+
+    def test_close(self):
+        rabbitmq = self._mock_rabbitmq_client()
+        self._mock_cloudstack_service(None, None, None)
+        driver = self._create_driver()
+
+        driver.close()
+
+        self.assertTrue(driver.acs_service.cloudstack_client.close.called)
+        self.assertTrue(rabbitmq.close.called)
+
     def test_get_updates_no_messages_found(self):
         self._mock_rabbitmq_client(None)
         self._mock_cloudstack_service(None, None, None)
@@ -350,6 +807,36 @@ class TestCloudstackDriver(unittest.TestCase):
         self.assertIsNotNone(
             self._create_vm_update_handler()._parse_date(None))
 
+    def test_parse_timestamp_same_as_dateutil(self):
+        dates = [
+            '2017-07-31 10:54:59 -0300',
+            '2017-07-31T10:54:59-0300',
+            '2017-07-31T10:54:59+02:00',
+            '2017-07-31 10:54:59',
+            '2017-07-31T10:54:59.123Z',
+            '2017-02-18 23:30:00 -0200',
+            'Mon Jul 31 10:54:59 2017'
+        ]
+        for date in dates:
+            expected = int(time.mktime(
+                parse(date).replace(tzinfo=None).timetuple()
+            ))
+            self.assertEqual(expected, parse_timestamp(date))
+
+    def test_parse_timestamp_given_unknown_format(self):
+        parse_mock = patch(
+            'globomap_driver_acs.update_handlers.parse',
+            wraps=parse
+        ).start()
+        parse_timestamp.cache_clear()
+
+        parse_timestamp('2017-07-31 10:54:59 -0300')
+        self.assertFalse(parse_mock.called)
+
+        parse_timestamp('31 Jul 2017 10:54:59')
+        parse_timestamp('31 Jul 2017 10:54:59')
+        self.assertEqual(1, parse_mock.call_count)
+
     def test_is_vm_create_event(self):
         self.assertTrue(EventTypeHandler.is_vm_create_event({
             'resource': 'com.cloud.vm.VirtualMachine',
@@ -436,7 +923,8 @@ class TestCloudstackDriver(unittest.TestCase):
         handler = self._create_dictionary_update_handler()
 
         updates = []
-        handler._create_client_update(updates, {'id': '123'})
+        handler._create_client_update(
+            updates, {'id': '123'}, handler.project)
         element = updates[0]['element']
 
         self.assertEqual(1, len(updates))
@@ -454,15 +942,27 @@ class TestCloudstackDriver(unittest.TestCase):
         handler.project = None
 
         updates = []
-        handler._create_client_update(updates, {'id': '123'})
+        handler._create_client_update(
+            updates, {'id': '123'}, handler.project)
         self.assertEqual(0, len(updates))
 
+    def test_create_dictionary_updates_given_project(self):
+        self._mock_rabbitmq_client()
+        handler = DictionaryEntitiesUpdateHandler('ENV', None, None)
+
+        updates = []
+        handler.create_dictionary_updates(updates, {'id': '123'}, self.project)
+
+        self.assertEqual(6, len(updates))
+        self.assertIsNone(handler.project)
+
     def test_create_business_service_update(self):
         self._mock_rabbitmq_client()
         handler = self._create_dictionary_update_handler()
 
         updates = []
-        handler._create_business_service_update(updates, {'id': '123'})
+        handler._create_business_service_update(
+            updates, {'id': '123'}, handler.project)
         element = updates[0]['element']
 
         self.assertEqual(1, len(updates))
@@ -482,7 +982,8 @@ class TestCloudstackDriver(unittest.TestCase):
         handler.project = None
 
         updates = []
-        handler._create_business_service_update(updates, {'id': '123'})
+        handler._create_business_service_update(
+            updates, {'id': '123'}, handler.project)
         self.assertEqual(0, len(updates))
 
     def test_create_component_update(self):
@@ -490,7 +991,8 @@ class TestCloudstackDriver(unittest.TestCase):
         handler = self._create_dictionary_update_handler()
 
         updates = []
-        handler._create_component_update(updates, {'id': '123'})
+        handler._create_component_update(
+            updates, {'id': '123'}, handler.project)
         element = updates[0]['element']
 
         self.assertEqual(1, len(updates))
@@ -510,7 +1012,8 @@ class TestCloudstackDriver(unittest.TestCase):
         handler.project = None
 
         updates = []
-        handler._create_component_update(updates, {'id': '123'})
+        handler._create_component_update(
+            updates, {'id': '123'}, handler.project)
         self.assertEqual(0, len(updates))
 
     def test_create_sub_component_update(self):
@@ -518,7 +1021,8 @@ class TestCloudstackDriver(unittest.TestCase):
         handler = self._create_dictionary_update_handler()
 
         updates = []
-        handler._create_sub_component_update(updates, {'id': '123'})
+        handler._create_sub_component_update(
+            updates, {'id': '123'}, handler.project)
         element = updates[0]['element']
 
         self.assertEqual(1, len(updates))
@@ -538,7 +1042,8 @@ class TestCloudstackDriver(unittest.TestCase):
         handler.project = None
 
         updates = []
-        handler._create_sub_component_update(updates, {'id': '123'})
+        handler._create_sub_component_update(
+            updates, {'id': '123'}, handler.project)
         self.assertEqual(0, len(updates))
 
     def test_create_product_update(self):
@@ -546,7 +1051,8 @@ class TestCloudstackDriver(unittest.TestCase):
         handler = self._create_dictionary_update_handler()
 
         updates = []
-        handler._create_product_update(updates, {'id': '123'})
+        handler._create_product_update(
+            updates, {'id': '123'}, handler.project)
         element = updates[0]['element']
 
         self.assertEqual(1, len(updates))
@@ -565,7 +1071,8 @@ class TestCloudstackDriver(unittest.TestCase):
         handler.project = None
 
         updates = []
-        handler._create_product_update(updates, {'id': '123'})
+        handler._create_product_update(
+            updates, {'id': '123'}, handler.project)
         self.assertEqual(0, len(updates))
 
     def test_create_host_update(self):
@@ -702,14 +1209,95 @@ class TestCloudstackDriver(unittest.TestCase):
         self.assertEqual({}, update['element'])
         self.assertEqual('KEY', update['key'])
 
+    def test_create_edge_document(self):
+        handler = self._create_vm_update_handler()
+
+        with patch('globomap_driver_acs.update_handlers.now_timestamp',
+                   return_value=1500000000):
+            update = handler.create_edge('1', 'edge', 'a/1', 'b/1')
+
+        self.assertEqual({
+            'action': 'UPDATE',
+            'collection': 'edge',
+            'type': 'edges',
+            'key': 'globomap_1',
+            'element': {
+                'id': '1',
+                'provider': 'globomap',
+                'timestamp': 1500000000,
+                'from': 'a/1',
+                'to': 'b/1',
+                'properties': {
+                    'environment': 'ENV',
+                    'iaas_provider': 'cloudstack'
+                },
+                'properties_metadata': {
+                    'environment': {'description': 'Cloudstack Region'},
+                    'iaas_provider': {'description': 'Iaas provider name'}
+                }
+            }
+        }, update)
+
+    def test_document_builder_batch_timestamp(self):
+        builder = DocumentBuilder.for_env('ENV')
+        now_timestamp = patch(
+            'globomap_driver_acs.update_handlers.now_timestamp',
+            side_effect=[1, 2, 3]
+        ).start()
+
+        with builder.batch():
+            with builder.batch():
+                first = builder.edge('1', 'a/1', 'b/1')
+            second = builder.region()
+
+        self.assertEqual(1, first['timestamp'])
+        self.assertEqual(1, second['timestamp'])
+        self.assertEqual(2, builder.timestamp())
+        self.assertEqual(2, now_timestamp.call_count)
+        self.assertIs(builder, DocumentBuilder.for_env('ENV'))
+
+    def test_create_vm_updates_share_timestamp(self):
+        self._mock_rabbitmq_client()
+        self._mock_cloudstack_service(
+            None, None, open_json('tests/json/zone.json')['zone'][0]
+        )
+        patch(
+            'globomap_driver_acs.update_handlers.now_timestamp',
+            side_effect=[1, 2]
+        ).start()
+        vm = open_json('tests/json/vm.json')['virtualmachine'][0]
+        event = open_json('tests/json/vm_create_event.json')
+
+        updates = self._create_driver()._create_vm_updates(
+            event, vm, self.project
+        )
+        timestamps = set(update['element']['timestamp']
+                         for update in updates[1:])
+
+        self.assertEqual({1}, timestamps)
+
+    def _patch_env(self, values):
+        # patch.stopall only stops patch.dict since Python 3.8
+        patcher = patch.dict('os.environ', values)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
     def _mock_rabbitmq_client(self, data=None):
         rabbit_mq_mock = patch(
             'globomap_driver_acs.driver.RabbitMQClient').start()
         rabbit = MagicMock()
         rabbit_mq_mock.return_value = rabbit
-        rabbit.get_message.side_effect = [(data, 1), (None, None)]
+        rabbit.get_delivery.side_effect = self._deliveries(
+            [(data, 1), (None, None)])
         return rabbit
 
+    def _deliveries(self, messages, routing_key=''):
+        return [
+            Delivery(tag, routing_key, {}, json.dumps(raw_msg).encode())
+            if raw_msg else None
+            for raw_msg, tag in messages
+        ]
+
     def _mock_cloudstack_service(self, vm, project, zone):
         patch('globomap_driver_acs.driver.CloudStackClient').start()
         mock = patch(
@@ -720,6 +1308,7 @@ class TestCloudstackDriver(unittest.TestCase):
         acs_service_mock.get_virtual_machine.return_value = vm
         acs_service_mock.get_project.return_value = project
         acs_service_mock.get_zone_by_name.return_value = zone
+        acs_service_mock.get_zone_by_id.return_value = zone
         return acs_service_mock
 
     def _mock_csv_reader(self, parsed_csv_file):
@@ -14,7 +14,11 @@
    limitations under the License.
 """
 import unittest
+import urllib.error
 from unittest.mock import Mock
+from unittest.mock import patch
+from globomap_driver_acs.cloudstack import ACSError
+from globomap_driver_acs.cloudstack import CloudStackClient
 from globomap_driver_acs.cloudstack import CloudstackService
 from tests.util import open_json
 
@@ -37,6 +41,26 @@ class TestCloudstackService(unittest.TestCase):
         self.assertIsNone(vm)
         self.assertTrue(mock.listVirtualMachines.called)
 
+    def test_get_virtual_machines(self):
+        vm = open_json('tests/json/vm.json')['virtualmachine'][0]
+        mock = self._mock_list_vm({'count': 1, 'virtualmachine': [vm]})
+        service = CloudstackService(mock)
+        ids = ['id-%s' % i for i in range(5)] + [vm['id'], None, 'id-0']
+
+        vms = service.get_virtual_machines(ids, chunk_size=4)
+
+        self.assertEqual({vm['id']: vm}, vms)
+        self.assertEqual(2, mock.listVirtualMachines.call_count)
+        self.assertEqual(
+            {'ids': 'id-4,%s' % vm['id'], 'listall': 'true'},
+            mock.listVirtualMachines.call_args[0][0])
+
+    def test_get_virtual_machines_given_acs_error(self):
+        mock = self._mock_list_vm(None)
+        service = CloudstackService(mock)
+
+        self.assertEqual({}, service.get_virtual_machines(['1', '2']))
+
     def test_get_project(self):
         mock = self._mock_list_projects(open_json('tests/json/project.json'))
         service = CloudstackService(mock)
@@ -53,6 +77,137 @@ class TestCloudstackService(unittest.TestCase):
         self.assertEqual(dict(), project)
         self.assertTrue(mock.listProjects.called)
 
+    def test_get_project_given_cached_project(self):
+        mock = self._mock_list_projects(open_json('tests/json/project.json'))
+        service = CloudstackService(mock)
+        service.get_project('unique_id')
+        project = service.get_project('unique_id')
+
+        self.assertEqual('project_name', project['name'])
+        self.assertEqual(1, mock.listProjects.call_count)
+        self.assertEqual(1, service.project_cache.hits)
+        self.assertEqual(1, service.project_cache.misses)
+
+    def test_get_project_given_cached_project_not_found(self):
+        mock = self._mock_list_projects(open_json('tests/json/empty_project.json'))
+        service = CloudstackService(mock)
+        service.get_project('unique_id')
+        project = service.get_project('unique_id')
+
+        self.assertEqual(dict(), project)
+        self.assertEqual(1, mock.listProjects.call_count)
+
+    def test_get_project_given_acs_error(self):
+        mock = self._mock_list_projects(None)
+        service = CloudstackService(mock)
+        service.get_project('unique_id')
+        project = service.get_project('unique_id')
+
+        self.assertEqual(dict(), project)
+        self.assertEqual(2, mock.listProjects.call_count)
+
+    def test_get_zone_by_name(self):
+        mock = self._mock_list_zones(open_json('tests/json/zone.json'))
+        service = CloudstackService(mock)
+
+        zone = service.get_zone_by_name('zone_a')
+        zone = service.get_zone_by_name('zone_a')
+
+        self.assertEqual('35ae56ee-273a-46da-8422-fe2b3490c76a', zone['id'])
+        self.assertEqual(1, mock.listZones.call_count)
+
+    def test_get_zone_by_id(self):
+        mock = self._mock_list_zones(open_json('tests/json/zone.json'))
+        service = CloudstackService(mock)
+        service.get_zone_by_name('zone_a')
+
+        zone = service.get_zone_by_id('35ae56ee-273a-46da-8422-fe2b3490c76a')
+
+        self.assertEqual('zone_a', zone['name'])
+        self.assertEqual(1, mock.listZones.call_count)
+
+    def test_get_zone_by_name_given_zone_not_indexed(self):
+        mock = self._mock_list_zones(open_json('tests/json/zone.json'))
+        service = CloudstackService(mock)
+        service.get_zone_by_name('zone_a')
+
+        zone = service.get_zone_by_name('zone_b')
+
+        self.assertIsNone(zone)
+        self.assertEqual(2, mock.listZones.call_count)
+
+    def test_refresh_zones(self):
+        mock = self._mock_list_zones(open_json('tests/json/zone.json'))
+        service = CloudstackService(mock)
+        service.get_zone_by_name('zone_a')
+
+        service.refresh_zones()
+        service.get_zone_by_name('zone_a')
+
+        self.assertEqual(2, mock.listZones.call_count)
+
+    def test_refresh_zones_given_acs_error(self):
+        mock = self._mock_list_zones(open_json('tests/json/zone.json'))
+        service = CloudstackService(mock)
+        service.get_zone_by_name('zone_a')
+        mock.listZones.return_value = None
+
+        with self.assertRaises(ACSError):
+            service.refresh_zones()
+        with self.assertRaises(ACSError):
+            service.get_zone_by_name('zone_b')
+
+        self.assertEqual('zone_a', service.get_zone_by_name('zone_a')['name'])
+        self.assertEqual(3, mock.listZones.call_count)
+
+    def test_iter_virtual_machines_by_project(self):
+        vm = open_json('tests/json/vm.json')['virtualmachine'][0]
+        mock = Mock()
+        mock.stream.side_effect = [iter([vm, vm]), iter([vm])]
+        service = CloudstackService(mock, page_size=2)
+
+        vms = list(service.iter_virtual_machines_by_project('1'))
+
+        self.assertEqual([vm, vm, vm], vms)
+        self.assertEqual(2, mock.stream.call_count)
+        command, args, key = mock.stream.call_args[0]
+        self.assertEqual('listVirtualMachines', command)
+        self.assertEqual('virtualmachine', key)
+        self.assertEqual({
+            'listall': 'true', 'projectid': '1', 'page': '2', 'pagesize': '2'
+        }, args)
+        self.assertEqual({'strict': True}, mock.stream.call_args[1])
+
+    @patch('globomap_driver_acs.cloudstack.iter_pages')
+    def test_iter_accounts_given_prefetch_pages(self, iter_pages_mock):
+        service = CloudstackService(Mock(), page_size=2, prefetch_pages=3)
+
+        service.iter_accounts()
+
+        self.assertEqual((2, 3), iter_pages_mock.call_args[0][1:])
+
+    def test_iter_projects(self):
+        mock = Mock()
+        mock.stream.return_value = iter([{'id': '1'}])
+
+        projects = list(CloudstackService(mock).iter_projects())
+
+        self.assertEqual([{'id': '1'}], projects)
+        self.assertEqual('500', mock.stream.call_args[0][1]['pagesize'])
+
+    def test_iter_projects_given_acs_error(self):
+        transport = Mock()
+        transport.open.side_effect = urllib.error.HTTPError(
+            'http://acs', 530, 'Error', {}, None
+        )
+        client = CloudStackClient('http://acs/client/api', 'key', 'secret',
+                                  transport=transport)
+
+        with self.assertRaises(ACSError) as context:
+            list(CloudstackService(client).iter_projects())
+
+        self.assertEqual(530, context.exception.status)
+
     def _mock_list_vm(self, vm_json):
         mock = Mock()
         mock.listVirtualMachines.return_value = vm_json
@@ -63,6 +218,11 @@ class TestCloudstackService(unittest.TestCase):
         mock.listProjects.return_value = project_json
         return mock
 
+    def _mock_list_zones(self, zone_json):
+        mock = Mock()
+        mock.listZones.return_value = zone_json
+        return mock
+
     def _mock_list_config(self, config_json):
         mock = Mock()
         mock.listConfigurations.return_value = config_json
@@ -0,0 +1,58 @@
+"""
+   Copyright 2017 Globo.com
+
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+
+       http://www.apache.org/licenses/LICENSE-2.0
+
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+"""
+import json
+import unittest
+from unittest.mock import patch
+
+from globomap_driver_acs import codec
+from tests.util import open_json
+
+
+class TestCodec(unittest.TestCase):
+
+    def tearDown(self):
+        patch.stopall()
+
+    def test_codecs_round_trip(self):
+        document = open_json('tests/json/vm.json')
+        document['name'] = 'máquina/1'
+
+        for json_codec in codec.available_codecs():
+            encoded = json_codec.dumps(document)
+            self.assertIsInstance(encoded, bytes)
+            self.assertEqual(document, json.loads(encoded))
+            self.assertEqual(document, json_codec.loads(encoded))
+            self.assertEqual(document, json_codec.loads(encoded.decode()))
+
+    def test_get_codec(self):
+        self.assertEqual('json', codec.get_codec('json').name)
+        self.assertEqual(
+            codec.available_codecs()[0].name, codec.get_codec().name
+        )
+
+    def test_get_codec_given_missing_backend(self):
+        patch(
+            'globomap_driver_acs.codec.importlib.import_module',
+            side_effect=ImportError()
+        ).start()
+
+        with self.assertRaises(ImportError):
+            codec.get_codec('orjson')
+        self.assertEqual([], codec.available_codecs())
+
+    def test_get_codec_given_unknown_backend(self):
+        with self.assertRaises(ValueError):
+            codec.get_codec('yaml')
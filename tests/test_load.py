@@ -13,10 +13,14 @@
    See the License for the specific language governing permissions and
    limitations under the License.
 """
+import json
+import os
+import tempfile
 import unittest
 from unittest.mock import Mock
 from unittest.mock import patch
 
+from globomap_driver_acs.cloudstack import ACSError
 from globomap_driver_acs.load import CloudstackDataLoader
 
 
@@ -35,9 +39,9 @@ class TestLoad(unittest.TestCase):
 
         CloudstackDataLoader('ENV', driver_mock).run()
 
-        self.assertEqual(1, acs_mock.list_projects.call_count)
+        self.assertEqual(1, acs_mock.iter_projects.call_count)
         self.assertEqual(
-            1, acs_mock.list_virtual_machines_by_project.call_count)
+            1, acs_mock.iter_virtual_machines_by_project.call_count)
         self.assertEqual(1, requests_mock.return_value.post.call_count)
 
     def test_vms_given_two_projects_found(self):
@@ -51,9 +55,9 @@ class TestLoad(unittest.TestCase):
 
         CloudstackDataLoader('ENV', driver_mock).run()
 
-        self.assertEqual(1, acs_mock.list_projects.call_count)
+        self.assertEqual(1, acs_mock.iter_projects.call_count)
         self.assertEqual(
-            2, acs_mock.list_virtual_machines_by_project.call_count)
+            2, acs_mock.iter_virtual_machines_by_project.call_count)
         self.assertEqual(1, requests_mock.return_value.post.call_count)
 
     def test_vms_given_one_vm_found(self):
@@ -66,9 +70,8 @@ class TestLoad(unittest.TestCase):
 
         CloudstackDataLoader('ENV', driver_mock).run()
 
-        self.assertEqual(1, acs_mock.list_projects.call_count)
-        acs_mock.list_virtual_machines_by_project.assert_called_once_with(
-            '4', 1, 500)
+        self.assertEqual(1, acs_mock.iter_projects.call_count)
+        acs_mock.iter_virtual_machines_by_project.assert_called_once_with('4')
         self.assertEqual(2, requests_mock.return_value.post.call_count)
 
     def test_vms_given_two_vms_found(self):
@@ -81,10 +84,34 @@ class TestLoad(unittest.TestCase):
 
         CloudstackDataLoader('ENV', driver_mock).run()
 
-        self.assertEqual(1, acs_mock.list_projects.call_count)
-        acs_mock.list_virtual_machines_by_project.assert_called_once_with(
-            '3', 1, 500)
-        self.assertEqual(3, requests_mock.return_value.post.call_count)
+        self.assertEqual(1, acs_mock.iter_projects.call_count)
+        acs_mock.iter_virtual_machines_by_project.assert_called_once_with('3')
+        self.assertEqual(2, requests_mock.return_value.post.call_count)
+        self.assertEqual(
+            2, len(json.loads(
+                requests_mock.return_value.post.call_args_list[0][0][0])))
+
+    def test_vms_given_listed_vm_updates(self):
+        projects = [{'id': '3', 'name': 'project A', 'vmtotal': 2}]
+        accounts = []
+        vms = [{'id': '1', 'projectid': '3'}, {'id': '2', 'projectid': '3'}]
+        acs_mock = self._mock_cloudstack_service(projects, accounts, vms)
+        acs_mock.get_project.return_value = projects[0]
+        self._mock_requests()
+        driver_mock = Mock(side_effect=Exception())
+        vm_updates_mock = Mock(return_value=[])
+
+        CloudstackDataLoader('ENV', driver_mock, vm_updates_mock).run()
+
+        self.assertFalse(driver_mock.called)
+        self.assertFalse(acs_mock.get_virtual_machine.called)
+        self.assertEqual(2, vm_updates_mock.call_count)
+        event, vm, project = vm_updates_mock.call_args[0]
+        self.assertEqual('VM.CREATE', event['event'])
+        self.assertEqual('2', event['id'])
+        self.assertEqual(vms[1], vm)
+        self.assertEqual(projects[0], project)
+        acs_mock.get_project.assert_called_with('3')
 
     def test_load_vm_data_given_no_projects_found(self):
         projects = []
@@ -96,11 +123,248 @@ class TestLoad(unittest.TestCase):
 
         CloudstackDataLoader('ENV', driver_mock).run()
 
-        self.assertEqual(1, acs_mock.list_projects.call_count)
+        self.assertEqual(1, acs_mock.iter_projects.call_count)
         self.assertEqual(
-            0, acs_mock.list_virtual_machines_by_project.call_count)
+            0, acs_mock.iter_virtual_machines_by_project.call_count)
         self.assertEqual(1, requests_mock.return_value.post.call_count)
 
+    def test_vms_given_full_batch(self):
+        projects = [{'id': '3', 'name': 'project A', 'vmtotal': 3}]
+        vms = [{'id': '1'}, {'id': '2'}, {'id': '3'}]
+        self._mock_cloudstack_service(projects, [], vms)
+        requests_mock = self._mock_requests()
+        self._patch_env({'ACS_ENV_LOADER_BATCH_SIZE': '2'})
+
+        CloudstackDataLoader('ENV', self._mock_driver()).run()
+
+        posts = requests_mock.return_value.post.call_args_list
+        self.assertEqual(3, len(posts))
+        self.assertEqual(2, len(json.loads(posts[0][0][0])))
+        self.assertEqual(1, len(json.loads(posts[1][0][0])))
+        self.assertEqual('CLEAR', json.loads(posts[2][0][0])[0]['action'])
+
+    def test_vms_given_workers(self):
+        projects = [{'id': '1', 'name': 'project A', 'vmtotal': 1000},
+                    {'id': '2', 'name': 'project B', 'vmtotal': 1}]
+        accounts = [{'id': '3', 'name': 'account A', 'vmtotal': 1}]
+        vms = [{'id': '1'}]
+        acs_mock = self._mock_cloudstack_service(projects, accounts, vms)
+        requests_mock = self._mock_requests()
+        self._patch_env({'ACS_ENV_LOADER_WORKERS': '4'})
+
+        CloudstackDataLoader('ENV', self._mock_driver()).run()
+
+        self.assertEqual(
+            2, acs_mock.iter_virtual_machines_by_project.call_count)
+        self.assertEqual(
+            1, acs_mock.iter_virtual_machines_by_account.call_count)
+        posts = requests_mock.return_value.post.call_args_list
+        self.assertEqual(3, len(json.loads(posts[0][0][0])))
+        self.assertEqual('CLEAR', json.loads(posts[-1][0][0])[0]['action'])
+
+    def test_vms_given_worker_error(self):
+        projects = [{'id': '1', 'name': 'project A', 'vmtotal': 1},
+                    {'id': '2', 'name': 'project B', 'vmtotal': 1}]
+        acs_mock = self._mock_cloudstack_service(projects, [], [])
+        acs_mock.iter_virtual_machines_by_project.side_effect = [
+            [], Exception('ACS unavailable')
+        ]
+        requests_mock = self._mock_requests()
+        self._patch_env({'ACS_ENV_LOADER_WORKERS': '2'})
+
+        with self.assertRaises(Exception):
+            CloudstackDataLoader('ENV', self._mock_driver()).run()
+
+        self.assertEqual(0, requests_mock.return_value.post.call_count)
+
+    def test_vms_given_acs_error_listing_projects(self):
+        accounts = [{'id': '3', 'name': 'account A', 'vmtotal': 1}]
+        acs_mock = self._mock_cloudstack_service([], accounts, [{'id': '1'}])
+        acs_mock.iter_projects.side_effect = ACSError('listProjects', 530)
+        requests_mock = self._mock_requests()
+
+        with self.assertRaises(ACSError):
+            CloudstackDataLoader('ENV', self._mock_driver()).run()
+
+        posts = requests_mock.return_value.post.call_args_list
+        self.assertEqual(1, len(posts))
+        self.assertEqual([{'type': 'collections', 'collection': 'comp_unit'}],
+                         json.loads(posts[0][0][0]))
+
+    def test_vms_given_project_without_vms(self):
+        projects = [{'id': '1', 'name': 'project A', 'vmtotal': 0}]
+        acs_mock = self._mock_cloudstack_service(projects, [], [{'id': '1'}])
+        self._mock_requests()
+
+        CloudstackDataLoader('ENV', self._mock_driver()).run()
+
+        self.assertFalse(acs_mock.iter_virtual_machines_by_project.called)
+
+    def test_vms_given_memory_report(self):
+        projects = [{'id': '3', 'name': 'project A', 'vmtotal': 3}]
+        accounts = [{'id': '4', 'name': 'account A', 'vmtotal': 3}]
+        vms = [{'id': '1'}, {'id': '2'}, {'id': '3'}]
+        self._mock_cloudstack_service(projects, accounts, vms)
+        self._mock_requests()
+        with tempfile.TemporaryDirectory() as report_dir:
+            report_path = os.path.join(report_dir, 'report')
+            self._patch_env({
+                'ACS_ENV_MEMORY_REPORT': report_path,
+                'ACS_ENV_API_PAGE_SIZE': '2'
+            })
+            loader = CloudstackDataLoader('ENV', self._mock_driver())
+
+            loader.run()
+
+            with open(report_path) as report_file:
+                self.assertIn('4 pages', report_file.read())
+        self.assertEqual(
+            ['accounts', 'projects', 'clear'],
+            [phase.name for phase in loader.memory_profiler.phases]
+        )
+        self.assertEqual(
+            ['4 page 1', '4 page 2', '3 page 1', '3 page 2'],
+            [page.name for page in loader.memory_profiler.pages]
+        )
+
+    def test_vms_given_state_file(self):
+        projects = [{'id': '3', 'name': 'project A', 'vmtotal': 2}]
+        vms = [{'id': '1'}, {'id': '2'}]
+        self._mock_cloudstack_service(projects, [], vms)
+        requests_mock = self._mock_requests()
+        post = requests_mock.return_value.post
+
+        def create_updates(event):
+            return [{
+                'action': 'PATCH', 'collection': 'comp_unit',
+                'type': 'collections', 'key': event['id'],
+                'element': {'id': event['id'], 'timestamp': 1}
+            }]
+
+        with tempfile.TemporaryDirectory() as state_dir:
+            self._patch_env({
+                'ACS_ENV_LOADER_STATE_FILE': os.path.join(state_dir, 'state')
+            })
+
+            CloudstackDataLoader('ENV', create_updates).run()
+            first_load = json.loads(post.call_args_list[0][0][0])
+            CloudstackDataLoader('ENV', create_updates).run()
+            second_load = json.loads(post.call_args_list[2][0][0])
+            CloudstackDataLoader('ENV', create_updates, force_full=True).run()
+            forced_load = json.loads(post.call_args_list[4][0][0])
+
+        self.assertEqual({'id': '1', 'timestamp': 1}, first_load[0]['element'])
+        self.assertEqual({'timestamp': 1}, second_load[0]['element'])
+        self.assertEqual(first_load, forced_load)
+
+    def test_state_max_age_defaults_to_a_day(self):
+        self._mock_requests()
+        self._patch_env({'ACS_ENV_LOADER_STATE_FILE': '/tmp/state'})
+
+        loader = CloudstackDataLoader('ENV', None)
+
+        self.assertEqual(86400, loader.state.max_age)
+
+    def test_vms_given_state_file_and_failed_post(self):
+        projects = [{'id': '3', 'name': 'project A', 'vmtotal': 1}]
+        self._mock_cloudstack_service(projects, [], [{'id': '1'}])
+        requests_mock = self._mock_requests()
+        requests_mock.return_value.post.side_effect = Exception()
+
+        with tempfile.TemporaryDirectory() as state_dir:
+            self._patch_env({
+                'ACS_ENV_LOADER_STATE_FILE': os.path.join(state_dir, 'state')
+            })
+            loader = CloudstackDataLoader('ENV', lambda event: [{
+                'action': 'PATCH', 'collection': 'comp_unit',
+                'type': 'collections', 'key': event['id'], 'element': {}
+            }])
+
+            loader.run()
+
+        self.assertEqual(
+            {'changed': 1, 'unchanged': 0, 'duplicated': 0, 'deleted': 0},
+            loader.state.stats
+        )
+        self.assertEqual({('collections', 'comp_unit', '1'): ''},
+                         loader.state.current)
+        self.assertIsNone(loader.state.cleared)
+
+    def test_vms_given_clear_interval(self):
+        projects = [{'id': '3', 'name': 'project A', 'vmtotal': 3}]
+        vms = [{'id': '1'}, {'id': '2'}, {'id': '3'}]
+        self._mock_cloudstack_service(projects, [], vms)
+        requests_mock = self._mock_requests()
+        post = requests_mock.return_value.post
+
+        def create_updates(event):
+            return [{
+                'action': 'PATCH', 'collection': 'comp_unit',
+                'type': 'collections', 'key': event['id'],
+                'element': {'id': event['id'], 'timestamp': 1}
+            }]
+
+        with tempfile.TemporaryDirectory() as state_dir:
+            self._patch_env({
+                'ACS_ENV_LOADER_STATE_FILE': os.path.join(state_dir, 'state'),
+                'ACS_ENV_LOADER_CLEAR_INTERVAL': '3600'
+            })
+
+            CloudstackDataLoader('ENV', create_updates).run()
+            self.assertEqual(2, post.call_count)
+            del vms[1]
+            projects[0]['vmtotal'] = 2
+            loader = CloudstackDataLoader('ENV', create_updates)
+            loader.run()
+
+        self.assertFalse(loader.state.needs_clear)
+        self.assertEqual(3, post.call_count)
+        self.assertEqual([{
+            'action': 'DELETE', 'collection': 'comp_unit',
+            'type': 'collections', 'key': '2', 'element': {}
+        }], json.loads(post.call_args_list[2][0][0]))
+
+    def test_vms_given_clear_interval_and_failed_delete(self):
+        projects = [{'id': '3', 'name': 'project A', 'vmtotal': 3}]
+        vms = [{'id': '1'}, {'id': '2'}, {'id': '3'}]
+        self._mock_cloudstack_service(projects, [], vms)
+        requests_mock = self._mock_requests()
+        post = requests_mock.return_value.post
+
+        def create_updates(event):
+            return [{
+                'action': 'PATCH', 'collection': 'comp_unit',
+                'type': 'collections', 'key': event['id'],
+                'element': {'id': event['id'], 'timestamp': 1}
+            }]
+
+        def fail_deletions(body):
+            if b'DELETE' in body:
+                raise Exception()
+
+        with tempfile.TemporaryDirectory() as state_dir:
+            self._patch_env({
+                'ACS_ENV_LOADER_STATE_FILE': os.path.join(state_dir, 'state'),
+                'ACS_ENV_LOADER_CLEAR_INTERVAL': '3600'
+            })
+
+            CloudstackDataLoader('ENV', create_updates).run()
+            del vms[1]
+            projects[0]['vmtotal'] = 2
+            post.side_effect = fail_deletions
+            CloudstackDataLoader('ENV', create_updates).run()
+            post.side_effect = None
+            CloudstackDataLoader('ENV', create_updates).run()
+
+        self.assertEqual(4, post.call_count)
+        self.assertEqual(
+            post.call_args_list[2][0][0], post.call_args_list[3][0][0]
+        )
+        self.assertEqual([{
+            'action': 'DELETE', 'collection': 'comp_unit',
+            'type': 'collections', 'key': '2', 'element': {}
+        }], json.loads(post.call_args_list[3][0][0]))
+
     def test_get_clear_request(self):
         self._mock_requests()
         clear_request = CloudstackDataLoader('ENV', None)._clear(
@@ -110,6 +374,12 @@ class TestLoad(unittest.TestCase):
         self.assertEqual('comp_unit', clear_request['collection'])
         self.assertEqual('collections', clear_request['type'])
 
+    def _patch_env(self, values):
+        # patch.stopall only stops patch.dict since Python 3.8
+        patcher = patch.dict('os.environ', values)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
     def _mock_cloudstack_service(self, projects, accounts, vms):
         patch('globomap_driver_acs.load.CloudStackClient').start()
         mock = patch(
@@ -117,9 +387,10 @@ class TestLoad(unittest.TestCase):
         ).start()
         acs_service_mock = Mock()
         mock.return_value = acs_service_mock
-        acs_service_mock.list_projects.return_value = projects
-        acs_service_mock.list_accounts.return_value = accounts
-        acs_service_mock.list_virtual_machines_by_project.return_value = vms
+        acs_service_mock.iter_projects.return_value = projects
+        acs_service_mock.iter_accounts.return_value = accounts
+        acs_service_mock.iter_virtual_machines_by_project.return_value = vms
+        acs_service_mock.iter_virtual_machines_by_account.return_value = vms
         return acs_service_mock
 
     def _mock_requests(self, status_code=202, content=None):
@@ -135,5 +406,5 @@ class TestLoad(unittest.TestCase):
 
     def _mock_driver(self):
         def driver_mock(event):
-            return [{}]
+            return [{'type': 'collections', 'collection': 'comp_unit'}]
         return driver_mock
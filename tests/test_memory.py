@@ -0,0 +1,103 @@
+"""
+   Copyright 2017 Globo.com
+
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+
+       http://www.apache.org/licenses/LICENSE-2.0
+
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+"""
+import os
+import tempfile
+import tracemalloc
+import unittest
+from unittest.mock import patch
+
+from globomap_driver_acs.memory import MemoryProfiler
+
+
+class TestMemoryProfiler(unittest.TestCase):
+
+    def setUp(self):
+        self.profiler = MemoryProfiler(top=5)
+        self.profiler.start()
+
+    def tearDown(self):
+        self.profiler.stop()
+
+    def test_phase(self):
+        with self.profiler.phase('accounts'):
+            retained = [bytearray(1024 * 1024)]
+            bytearray(4 * 1024 * 1024)
+
+        phase = self.profiler.phases[0]
+        self.assertEqual('accounts', phase.name)
+        self.assertGreater(phase.peak, 5 * 1024 * 1024)
+        self.assertGreater(phase.retained, 1024 * 1024)
+        self.assertLess(phase.retained, phase.peak)
+        self.assertEqual(__file__, phase.top[0].traceback[0].filename)
+        self.assertEqual(1, len(retained))
+
+    def test_pages(self):
+        with self.profiler.phase('projects'):
+            bytearray(2 * 1024 * 1024)
+            self.profiler.page('1 page 1')
+            bytearray(1024 * 1024)
+            self.profiler.page('1 page 2')
+
+        self.assertEqual(
+            ['1 page 1', '1 page 2'],
+            [page.name for page in self.profiler.pages]
+        )
+        self.assertIs(self.profiler.pages[0], self.profiler.largest_page)
+        self.assertGreater(
+            self.profiler.pages[0].peak, self.profiler.pages[1].peak
+        )
+        self.assertGreaterEqual(
+            self.profiler.phases[0].peak, self.profiler.pages[0].peak
+        )
+
+    @patch('globomap_driver_acs.memory.RESETS_PEAK', False)
+    def test_pages_without_reset_peak(self):
+        with self.profiler.phase('projects'):
+            bytearray(2 * 1024 * 1024)
+            self.profiler.page('1 page 1')
+            bytearray(1024 * 1024)
+            self.profiler.page('1 page 2')
+
+        first, second = self.profiler.pages
+        self.assertGreater(first.peak, 2 * 1024 * 1024)
+        self.assertEqual(second.retained, second.peak)
+        self.assertEqual(first.peak, self.profiler.phases[0].peak)
+
+    def test_report(self):
+        with self.profiler.phase('clear'):
+            self.profiler.page('1 page 1')
+
+        report = self.profiler.report()
+
+        self.assertIn('clear', report)
+        self.assertIn('1 pages', report)
+        self.assertIn('Top allocation sites retained after clear:', report)
+
+    def test_write_report(self):
+        with tempfile.TemporaryDirectory() as report_dir:
+            self.profiler.report_path = os.path.join(report_dir, 'report')
+
+            with self.profiler.phase('accounts'):
+                pass
+
+            with open(self.profiler.report_path) as report_file:
+                self.assertIn('accounts', report_file.read())
+            self.profiler.report_path = None
+
+    def test_stop(self):
+        self.profiler.stop()
+
+        self.assertFalse(tracemalloc.is_tracing())
@@ -0,0 +1,103 @@
+"""
+   Copyright 2017 Globo.com
+
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+
+       http://www.apache.org/licenses/LICENSE-2.0
+
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+"""
+import unittest
+import urllib.request
+
+from globomap_driver_acs import metrics
+
+
+class TestMetrics(unittest.TestCase):
+
+    def setUp(self):
+        self.registry = metrics.Registry()
+
+    def test_counter(self):
+        counter = self.registry.counter('events_total', 'Events', ('event',))
+        counter.inc(event='VM.CREATE')
+        counter.inc(2, event='VM.CREATE')
+        counter.inc(event='VM.DESTROY')
+
+        self.assertEqual(3, counter.get(event='VM.CREATE'))
+        self.assertEqual([
+            '# HELP events_total Events',
+            '# TYPE events_total counter',
+            'events_total{event="VM.CREATE"} 3',
+            'events_total{event="VM.DESTROY"} 1'
+        ], counter.render())
+
+    def test_counter_given_wrong_labels(self):
+        counter = self.registry.counter('events_total', 'Events', ('event',))
+
+        with self.assertRaises(ValueError):
+            counter.inc(status='Completed')
+
+    def test_gauge_given_function(self):
+        gauge = self.registry.gauge('ratio', 'Ratio', ('cache',))
+        gauge.set_function(lambda: 0.5, cache='project')
+
+        self.assertEqual(0.5, gauge.get(cache='project'))
+        self.assertEqual('ratio{cache="project"} 0.5', gauge.render()[-1])
+
+    def test_histogram(self):
+        histogram = self.registry.histogram(
+            'latency_seconds', 'Latency', ('command',), buckets=(.1, 1)
+        )
+        histogram.observe(.05, command='listZones')
+        histogram.observe(.5, command='listZones')
+        histogram.observe(5, command='listZones')
+
+        self.assertEqual(3, histogram.get_count(command='listZones'))
+        self.assertEqual([
+            'latency_seconds_bucket{command="listZones",le="0.1"} 1',
+            'latency_seconds_bucket{command="listZones",le="1"} 2',
+            'latency_seconds_bucket{command="listZones",le="+Inf"} 3',
+            'latency_seconds_sum{command="listZones"} 5.55',
+            'latency_seconds_count{command="listZones"} 3'
+        ], histogram.render()[2:])
+
+    def test_register_given_duplicate_name(self):
+        self.registry.counter('events_total', 'Events')
+
+        with self.assertRaises(ValueError):
+            self.registry.gauge('events_total', 'Events')
+
+    def test_render_escapes_label_values(self):
+        counter = self.registry.counter('events_total', 'Events', ('event',))
+        counter.inc(event='a "b"\n')
+
+        self.assertEqual(
+            'events_total{event="a \\"b\\"\\n"} 1\n',
+            self.registry.render().split('\n', 2)[2]
+        )
+
+    def test_exporter(self):
+        self.registry.counter('events_total', 'Events').inc()
+        server = metrics.start_exporter(
+            port=0, address='127.0.0.1', metrics_registry=self.registry
+        )
+        try:
+            self.assertIs(server, metrics.start_exporter(port=0))
+            response = urllib.request.urlopen(
+                'http://127.0.0.1:%s/metrics' % server.server_port
+            )
+            self.assertEqual(metrics.CONTENT_TYPE,
+                             response.headers['Content-Type'])
+            self.assertIn(b'events_total 1\n', response.read())
+        finally:
+            metrics.stop_exporter()
+
+    def test_exporter_given_no_port(self):
+        self.assertIsNone(metrics.start_exporter())
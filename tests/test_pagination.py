@@ -0,0 +1,148 @@
+"""
+   Copyright 2017 Globo.com
+
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+
+       http://www.apache.org/licenses/LICENSE-2.0
+
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+"""
+import threading
+import time
+import unittest
+
+from globomap_driver_acs.pagination import iter_pages
+
+
+class TestIterPages(unittest.TestCase):
+
+    def test_iter_pages(self):
+        pages = {1: [1, 2], 2: [3, 4], 3: [5]}
+        fetched = []
+
+        def fetch_page(page):
+            fetched.append(page)
+            return pages[page]
+
+        self.assertEqual([1, 2, 3, 4, 5], list(iter_pages(fetch_page, 2)))
+        self.assertEqual([1, 2, 3], fetched)
+
+    def test_iter_pages_given_empty_last_page(self):
+        pages = {1: [1, 2], 2: []}
+
+        self.assertEqual([1, 2], list(iter_pages(pages.get, 2)))
+
+    def test_iter_pages_prefetches_next_page(self):
+        second_page_fetched = threading.Event()
+
+        def fetch_page(page):
+            if page == 2:
+                second_page_fetched.set()
+                return []
+            return [1, 2]
+
+        items = iter_pages(fetch_page, 2)
+        next(items)
+
+        self.assertTrue(second_page_fetched.wait(5))
+        items.close()
+
+    def test_iter_pages_buffers_prefetch_pages(self):
+        fetched = []
+        closed = []
+
+        def fetch_page(page):
+            fetched.append(page)
+            try:
+                yield from range(4)
+            finally:
+                closed.append(page)
+
+        items = iter_pages(fetch_page, 4, prefetch_pages=2)
+        next(items)
+        time.sleep(0.2)
+
+        # One page taken, two queued and one waiting to be queued, all of
+        # them read whole and released
+        self.assertEqual([1, 2, 3, 4], fetched)
+        self.assertEqual(fetched, closed)
+        items.close()
+
+    def test_iter_pages_without_prefetch(self):
+        read = []
+
+        def fetch_page(page):
+            for item in range(4):
+                read.append(item)
+                yield item
+
+        items = iter_pages(fetch_page, 4, prefetch_pages=0)
+
+        self.assertEqual(0, next(items))
+        self.assertEqual([0], read)
+        self.assertEqual([1, 2, 3, 0], [next(items) for _ in range(4)])
+        items.close()
+
+    def test_iter_pages_closes_page_left_unread(self):
+        closed = threading.Event()
+
+        def fetch_page(page):
+            try:
+                for item in range(4):
+                    yield item
+            finally:
+                closed.set()
+
+        items = iter_pages(fetch_page, 1, prefetch_pages=0)
+        next(items)
+        items.close()
+
+        self.assertTrue(closed.is_set())
+
+    def test_iter_pages_closes_page_given_error(self):
+        closed = threading.Event()
+
+        def fetch_page(page):
+            try:
+                yield 1
+                raise IOError('connection reset')
+            finally:
+                closed.set()
+
+        with self.assertRaises(IOError):
+            list(iter_pages(fetch_page, 2))
+
+        self.assertTrue(closed.is_set())
+
+    def test_iter_pages_given_error(self):
+        def fetch_page(page):
+            if page == 2:
+                raise IOError('ACS unavailable')
+            return [1]
+
+        items = iter_pages(fetch_page, 1)
+
+        self.assertEqual(1, next(items))
+        with self.assertRaises(IOError):
+            next(items)
+
+    def test_iter_pages_given_closed_before_end(self):
+        fetched = []
+
+        def fetch_page(page):
+            fetched.append(page)
+            return [page]
+
+        items = iter_pages(fetch_page, 1)
+        next(items)
+        items.close()
+        count = len(fetched)
+
+        self.assertLessEqual(count, 3)
+        self.assertEqual(count, len(fetched))
@@ -0,0 +1,96 @@
+"""
+   Copyright 2017 Globo.com
+
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+
+       http://www.apache.org/licenses/LICENSE-2.0
+
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+"""
+import json
+import unittest
+from unittest.mock import Mock
+
+from globomap_driver_acs.publisher import BatchPublisher
+
+
+class TestBatchPublisher(unittest.TestCase):
+
+    def setUp(self):
+        self.now = 0
+
+    def test_publish_given_max_documents(self):
+        send = Mock()
+        publisher = BatchPublisher(send, max_documents=3)
+
+        publisher.publish([self._doc('comp_unit'), self._doc('zone')])
+        self.assertFalse(send.called)
+
+        publisher.publish([self._doc('comp_unit'), self._doc('zone')])
+        self.assertEqual(1, send.call_count)
+        self.assertEqual(4, len(send.call_args[0][0]))
+
+    def test_publish_given_max_bytes(self):
+        send = Mock()
+        publisher = BatchPublisher(send, max_bytes=100)
+
+        publisher.publish([self._doc('comp_unit', 'x' * 100)])
+
+        self.assertEqual(1, send.call_count)
+
+    def test_publish_given_linger_elapsed(self):
+        send = Mock()
+        publisher = BatchPublisher(send, linger=5, clock=lambda: self.now)
+
+        publisher.publish([self._doc('comp_unit')])
+        self.now = 6
+        publisher.publish([self._doc('comp_unit')])
+
+        self.assertEqual(1, send.call_count)
+        self.assertEqual(2, len(send.call_args[0][0]))
+
+    def test_flush_groups_by_type_and_collection(self):
+        send = Mock()
+        publisher = BatchPublisher(send)
+
+        publisher.publish([
+            self._doc('host_comp_unit', type='edges'),
+            self._doc('zone'),
+            self._doc('comp_unit', 'a'),
+            self._doc('host_comp_unit', 'b', type='edges'),
+            self._doc('comp_unit', 'c'),
+        ])
+        publisher.flush()
+
+        sent = [(doc['collection'], doc['element']) for doc in send.call_args[0][0]]
+        self.assertEqual([
+            ('comp_unit', 'a'), ('comp_unit', 'c'), ('zone', ''),
+            ('host_comp_unit', ''), ('host_comp_unit', 'b')
+        ], sent)
+
+    def test_flush_sends_encoded_batch(self):
+        send = Mock()
+        publisher = BatchPublisher(send)
+        documents = [self._doc('zone', 'a'), self._doc('comp_unit', 'b')]
+
+        publisher.publish(documents)
+        publisher.flush()
+
+        sent, body = send.call_args[0]
+        self.assertEqual([documents[1], documents[0]], sent)
+        self.assertEqual(sent, json.loads(body.decode('utf-8')))
+
+    def test_flush_given_empty_batch(self):
+        send = Mock()
+        BatchPublisher(send).flush()
+
+        self.assertFalse(send.called)
+
+    def _doc(self, collection, element='', type='collections'):
+        return {'collection': collection, 'type': type, 'element': element}
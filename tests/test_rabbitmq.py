@@ -39,6 +39,69 @@ class TestRabbitMQClient(unittest.TestCase):
         self.assertIsNotNone(message)
         self.pika_mock.basic_get.assert_called_once_with('queue_name')
 
+    def test_get_delivery(self):
+        msg = b'{"event": "VM.CREATE"}'
+        self.pika_mock.basic_get.return_value = (
+            MagicMock(delivery_tag=1, routing_key='key'),
+            MagicMock(headers={'a': 'b'}),
+            msg
+        )
+        rabbitmq = RabbitMQClient('', '', '', '', '', 'queue_name')
+
+        delivery = rabbitmq.get_delivery()
+
+        self.assertEqual(1, delivery.delivery_tag)
+        self.assertEqual('key', delivery.routing_key)
+        self.assertEqual({'a': 'b'}, delivery.headers)
+        self.assertEqual(msg, delivery.body)
+        self.assertEqual({'event': 'VM.CREATE'}, delivery.json())
+
+    def test_get_delivery_given_empty_queue(self):
+        self.pika_mock.basic_get.return_value = (None, None, None)
+        rabbitmq = RabbitMQClient('', '', '', '', '', 'queue_name')
+
+        self.assertIsNone(rabbitmq.get_delivery())
+        self.assertEqual((None, None), rabbitmq.get_message())
+
+    def test_consume_deliveries(self):
+        self.pika_mock.consume.return_value = iter([
+            (MagicMock(delivery_tag=1, routing_key='key'),
+             MagicMock(headers=None), b'{}'),
+            (None, None, None),
+        ])
+        rabbitmq = RabbitMQClient('', '', '', '', '', 'queue_name')
+
+        deliveries = list(rabbitmq.consume_deliveries(prefetch_count=10))
+
+        self.assertEqual(1, len(deliveries))
+        self.assertEqual('key', deliveries[0].routing_key)
+        self.assertEqual({}, deliveries[0].headers)
+        self.pika_mock.basic_qos.assert_called_once_with(prefetch_count=10)
+        self.pika_mock.consume.assert_called_once_with(
+            'queue_name', inactivity_timeout=1)
+        self.assertTrue(self.pika_mock.cancel.called)
+
+    def test_wait_delivery(self):
+        self.pika_mock.consume.return_value = iter([
+            (MagicMock(delivery_tag=1, routing_key='key'), None, b'{}'),
+            (None, None, None),
+        ])
+        rabbitmq = RabbitMQClient('', '', '', '', '', 'queue_name')
+
+        self.assertEqual(1, rabbitmq.wait_delivery(0.5).delivery_tag)
+        self.assertIsNone(rabbitmq.wait_delivery(-1))
+        self.assertEqual([
+            (('queue_name',), {'inactivity_timeout': 0.5}),
+            (('queue_name',), {'inactivity_timeout': 0})
+        ], self.pika_mock.consume.call_args_list)
+        self.assertFalse(self.pika_mock.cancel.called)
+
+    def test_ack_multiple_messages(self):
+        rabbitmq = RabbitMQClient('', '', '', '', '', 'queue_name')
+
+        rabbitmq.ack_message(5, multiple=True)
+        self.pika_mock.basic_ack.assert_called_once_with(5, multiple=True)
+
     def test_ack_message(self):
         rabbitmq = RabbitMQClient('', '', '', '', '', 'queue_name')
 
@@ -51,6 +114,12 @@ class TestRabbitMQClient(unittest.TestCase):
         rabbitmq.nack_message(1)
         self.pika_mock.basic_nack.assert_called_once_with(1)
 
+    def test_close(self):
+        rabbitmq = RabbitMQClient('', '', '', '', '', 'queue_name')
+
+        rabbitmq.close()
+        self.assertTrue(rabbitmq.connection.close.called)
+
     def test_bind_routing_keys(self):
         pika_mock = self._mock_pika()
         rabbitmq = RabbitMQClient(
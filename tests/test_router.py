@@ -0,0 +1,58 @@
+"""
+   Copyright 2017 Globo.com
+
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+
+       http://www.apache.org/licenses/LICENSE-2.0
+
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+"""
+import unittest
+from unittest.mock import Mock
+
+from globomap_driver_acs.router import EventRouter
+
+
+class TestEventRouter(unittest.TestCase):
+
+    def test_dispatch(self):
+        router = EventRouter()
+        handler = Mock(return_value=['update'])
+        router.register(handler, event='VM.CREATE', name='create')
+        msg = {'event': 'VM.CREATE', 'resource': 'r', 'status': 's'}
+
+        self.assertEqual(['update'], router.dispatch(msg, 'arg'))
+        handler.assert_called_once_with(msg, 'arg')
+        self.assertEqual({'create': 1}, router.stats())
+
+    def test_dispatch_to_most_specific_handler(self):
+        router = EventRouter()
+        router.register(Mock(return_value='event'), event='A')
+        router.register(Mock(return_value='status'), status='S')
+        router.register(Mock(return_value='both'), event='A', status='S')
+        router.register(Mock(return_value='any'))
+
+        self.assertEqual('both', router.dispatch({'event': 'A', 'status': 'S'}))
+        self.assertEqual('event', router.dispatch({'event': 'A'}))
+        self.assertEqual('status', router.dispatch({'status': 'S'}))
+        self.assertEqual('any', router.dispatch({'event': 'B'}))
+
+    def test_dispatch_given_no_handler(self):
+        router = EventRouter()
+        router.register(Mock(), event='A', name='a')
+
+        self.assertIsNone(router.dispatch({'event': 'B'}))
+        self.assertEqual({'unrouted': 1}, router.stats())
+
+    def test_register_duplicated_key(self):
+        router = EventRouter()
+        router.register(Mock(), event='A', name='a')
+
+        with self.assertRaises(ValueError):
+            router.register(Mock(), event='A', name='b')
@@ -0,0 +1,228 @@
+"""
+   Copyright 2017 Globo.com
+
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+
+       http://www.apache.org/licenses/LICENSE-2.0
+
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+"""
+import os
+import shutil
+import tempfile
+import unittest
+
+from globomap_driver_acs.state import content_hash
+from globomap_driver_acs.state import LoadState
+
+
+def create_document(key, state='Running', timestamp=1, action='PATCH'):
+    return {
+        'action': action,
+        'collection': 'comp_unit',
+        'type': 'collections',
+        'key': key,
+        'element': {
+            'id': key, 'timestamp': timestamp, 'properties': {'state': state}
+        }
+    }
+
+
+class TestLoadState(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, 'state', 'ENV.json')
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_content_hash_ignores_timestamp(self):
+        self.assertEqual(
+            content_hash(create_document('a', timestamp=1)),
+            content_hash(create_document('a', timestamp=2))
+        )
+        self.assertNotEqual(
+            content_hash(create_document('a')),
+            content_hash(create_document('a', state='Stopped'))
+        )
+
+    def test_filter_given_no_state(self):
+        state = LoadState(self.path)
+        documents = [create_document('a'), create_document('b')]
+
+        self.assertTrue(state.force_full)
+        self.assertEqual(documents, state.filter(documents))
+
+    def test_filter_given_unchanged_documents(self):
+        self._save_state([create_document('a'), create_document('b')])
+        state = LoadState(self.path)
+
+        published = state.filter([
+            create_document('a', timestamp=2),
+            create_document('b', state='Stopped', timestamp=2),
+            create_document('c', timestamp=2)
+        ])
+
+        self.assertFalse(state.force_full)
+        self.assertEqual([{
+            'action': 'PATCH', 'collection': 'comp_unit',
+            'type': 'collections', 'key': 'a',
+            'element': {'timestamp': 2}
+        }, create_document('b', state='Stopped', timestamp=2),
+            create_document('c', timestamp=2)], published)
+        self.assertEqual(
+            {'changed': 2, 'unchanged': 1, 'duplicated': 0, 'deleted': 0},
+            state.stats
+        )
+
+    def test_filter_given_clear_interval(self):
+        self._save_state([create_document('a')], cleared=True)
+        state = LoadState(self.path, clear_interval=60, clock=lambda: 1030)
+
+        published = state.filter([
+            create_document('a', timestamp=2), create_document('b')
+        ])
+
+        self.assertFalse(state.needs_clear)
+        self.assertEqual([create_document('b')], published)
+        self.assertEqual(1, state.stats['unchanged'])
+
+    def test_filter_given_clear_due(self):
+        self._save_state([create_document('a')], cleared=True)
+        state = LoadState(self.path, clear_interval=60, clock=lambda: 1060)
+
+        published = state.filter([create_document('a', timestamp=2)])
+
+        self.assertTrue(state.needs_clear)
+        self.assertEqual({'timestamp': 2}, published[0]['element'])
+
+    def test_filter_given_clear_interval_and_never_cleared(self):
+        self._save_state([create_document('a')])
+
+        state = LoadState(self.path, clear_interval=60, clock=lambda: 1030)
+
+        self.assertTrue(state.needs_clear)
+
+    def test_deletions(self):
+        self._save_state([create_document(key) for key in 'abc'])
+        state = LoadState(self.path)
+        state.filter([create_document('a'), create_document('c')])
+
+        self.assertEqual([{
+            'action': 'DELETE', 'type': 'collections',
+            'collection': 'comp_unit', 'key': 'b', 'element': {}
+        }], state.deletions())
+        self.assertEqual(1, state.stats['deleted'])
+
+    def test_deletions_given_most_documents_missing(self):
+        self._save_state([create_document(key) for key in 'abc'])
+        state = LoadState(self.path)
+        state.filter([create_document('a')])
+
+        self.assertEqual([], state.deletions())
+        self.assertEqual(
+            ['a', 'b', 'c'], sorted(key[2] for key in state.current)
+        )
+        self.assertEqual(0, state.stats['deleted'])
+
+    def test_deletions_given_discarded_documents(self):
+        self._save_state([create_document('a'), create_document('b')])
+        state = LoadState(self.path)
+        state.filter([create_document('a'), create_document('b')])
+        state.discard([create_document('a')])
+
+        self.assertEqual([], state.deletions())
+        self.assertEqual('', state.current[('collections', 'comp_unit', 'a')])
+
+    def test_deletions_given_failed_deletions(self):
+        self._save_state([create_document(key) for key in 'abc'])
+        state = LoadState(self.path)
+        state.filter([create_document('a'), create_document('c')])
+        state.discard(state.deletions())
+        state.save()
+
+        state = LoadState(self.path)
+        state.filter([create_document('a'), create_document('c')])
+
+        self.assertEqual(['b'], [
+            document['key'] for document in state.deletions()
+        ])
+
+    def test_filter_given_duplicated_documents(self):
+        state = LoadState(self.path)
+
+        published = state.filter([create_document('a'), create_document('a')])
+
+        self.assertEqual([create_document('a')], published)
+        self.assertEqual(1, state.stats['duplicated'])
+
+    def test_filter_given_delete_or_unkeyed_documents(self):
+        state = LoadState(self.path)
+        state.filter([create_document('a')])
+        documents = [
+            create_document('a', action='DELETE'),
+            {'action': 'CLEAR', 'collection': 'comp_unit', 'element': []}
+        ]
+
+        self.assertEqual(documents, state.filter(documents))
+        self.assertEqual({}, state.current)
+
+    def test_filter_given_force_full(self):
+        self._save_state([create_document('a')])
+        state = LoadState(self.path, force_full=True)
+
+        self.assertEqual(
+            [create_document('a')], state.filter([create_document('a')])
+        )
+
+    def test_filter_given_expired_state(self):
+        self._save_state([create_document('a')])
+
+        state = LoadState(self.path, max_age=60, clock=lambda: 1000 + 60)
+
+        self.assertTrue(state.force_full)
+        self.assertEqual(1060, state.created)
+
+    def test_discard(self):
+        state = LoadState(self.path)
+        state.filter([create_document('a'), create_document('b')])
+        state.discard([create_document('a')])
+        state.save()
+
+        state = LoadState(self.path)
+        published = state.filter([create_document('a'), create_document('b')])
+
+        self.assertEqual(create_document('a'), published[0])
+        self.assertEqual({'timestamp': 1}, published[1]['element'])
+
+    def test_save_keeps_only_current_documents(self):
+        self._save_state([create_document('a'), create_document('b')])
+        state = LoadState(self.path)
+        state.filter([create_document('b')])
+        state.save()
+
+        self.assertEqual(
+            [('collections', 'comp_unit', 'b')],
+            list(LoadState(self.path).previous)
+        )
+
+    def test_load_given_unreadable_state(self):
+        os.makedirs(os.path.dirname(self.path))
+        with open(self.path, 'w') as state_file:
+            state_file.write('{')
+
+        self.assertTrue(LoadState(self.path).force_full)
+
+    def _save_state(self, documents, cleared=False):
+        state = LoadState(self.path, clock=lambda: 1000)
+        state.filter(documents)
+        if cleared:
+            state.mark_cleared()
+        state.save()
@@ -0,0 +1,64 @@
+"""
+   Copyright 2017 Globo.com
+
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+
+       http://www.apache.org/licenses/LICENSE-2.0
+
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+"""
+import io
+import json
+import unittest
+
+from globomap_driver_acs.streaming import JSONArrayStream
+from globomap_driver_acs.streaming import iter_json_array
+from tests.util import open_json
+
+
+class TestJSONArrayStream(unittest.TestCase):
+
+    def test_iter_items(self):
+        vm = open_json('tests/json/vm.json')['virtualmachine'][0]
+        vms = [dict(vm, id=str(index), name='máquina "%s"' % index)
+               for index in range(50)]
+        body = json.dumps({'listvirtualmachinesresponse': {
+            'count': len(vms), 'virtualmachine': vms
+        }}, ensure_ascii=False).encode()
+
+        for chunk_size in (1, 13, 1024, len(body)):
+            stream = io.BytesIO(body)
+            items = list(iter_json_array(
+                stream, 'virtualmachine', chunk_size=chunk_size
+            ))
+            self.assertEqual(vms, items)
+            self.assertEqual(len(body), stream.tell())
+
+    def test_iter_items_given_key_at_other_depth(self):
+        body = b'{"r": {"x": {"zone": [1]}, "zone": [{"id": "1"}]}}'
+
+        self.assertEqual(
+            [{'id': '1'}], list(iter_json_array(io.BytesIO(body), 'zone'))
+        )
+
+    def test_iter_items_given_empty_response(self):
+        stream = JSONArrayStream(
+            io.BytesIO(b'{"listzonesresponse": {}}'), 'zone'
+        )
+
+        self.assertEqual([], list(stream))
+        self.assertTrue(stream.completed)
+
+    def test_iter_items_given_truncated_body(self):
+        body = b'{"r": {"zone": [{"id": "1"}, {"id": '
+        items = iter_json_array(io.BytesIO(body), 'zone')
+
+        self.assertEqual({'id': '1'}, next(items))
+        with self.assertRaises(ValueError):
+            next(items)
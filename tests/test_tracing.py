@@ -0,0 +1,165 @@
+"""
+   Copyright 2017 Globo.com
+
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+
+       http://www.apache.org/licenses/LICENSE-2.0
+
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+"""
+import os
+import tempfile
+import unittest
+from unittest.mock import Mock
+
+from globomap_driver_acs import metrics
+from globomap_driver_acs import tracing
+
+
+class TestTracer(unittest.TestCase):
+
+    def test_trace(self):
+        sink = Mock()
+        tracer = tracing.Tracer([sink])
+
+        with tracer.trace('event', id='1'):
+            with tracing.span('fetch'):
+                with tracing.span('parse'):
+                    pass
+            with tracing.span('fetch'):
+                pass
+            with tracer.trace('create_updates'):
+                pass
+
+        trace = sink.record.call_args[0][0]
+        self.assertEqual('event', trace.name)
+        self.assertEqual({'id': '1'}, trace.attributes)
+        self.assertEqual(
+            ['fetch.parse', 'fetch', 'fetch', 'create_updates'],
+            [path for path, _ in trace.spans]
+        )
+        self.assertEqual(
+            {'fetch', 'fetch.parse', 'create_updates'},
+            set(trace.stages())
+        )
+        self.assertGreaterEqual(trace.duration, trace.stages()['fetch'])
+        self.assertIsNone(trace.profile)
+        self.assertIsNone(tracing.current_trace())
+
+    def test_span_outside_trace(self):
+        with tracing.span('fetch'):
+            self.assertIsNone(tracing.current_trace())
+
+    def test_trace_given_disabled_tracer(self):
+        with tracing.Tracer().trace('event'):
+            self.assertIsNone(tracing.current_trace())
+
+    def test_trace_given_exception(self):
+        sink = Mock()
+
+        with self.assertRaises(ValueError):
+            with tracing.Tracer([sink]).trace('event'):
+                with tracing.span('fetch'):
+                    raise ValueError()
+
+        self.assertEqual(
+            ['fetch'], list(sink.record.call_args[0][0].stages())
+        )
+        self.assertIsNone(tracing.current_trace())
+
+    def test_trace_given_failing_sink(self):
+        sink = Mock()
+        failing_sink = Mock()
+        failing_sink.record.side_effect = Exception()
+
+        with tracing.Tracer([failing_sink, sink]).trace('event'):
+            pass
+
+        self.assertTrue(sink.record.called)
+
+    def test_profile_given_slow_trace(self):
+        sink = Mock()
+        tracer = tracing.Tracer(
+            [sink], profile_threshold=0, profile_rate=0.5,
+            sample=Mock(return_value=0.1)
+        )
+
+        with tracer.trace('event'):
+            sorted(range(1000))
+
+        self.assertIn('sorted', sink.record.call_args[0][0].profile)
+
+    def test_profile_given_profile_dir(self):
+        sink = Mock()
+        with tempfile.TemporaryDirectory() as profile_dir:
+            tracer = tracing.Tracer(
+                [sink], profile_threshold=0, profile_rate=1,
+                profile_dir=profile_dir
+            )
+
+            with tracer.trace('event'):
+                pass
+
+            path = sink.record.call_args[0][0].profile
+            self.assertEqual(profile_dir, os.path.dirname(path))
+            self.assertTrue(os.path.exists(path))
+
+    def test_profile_not_kept_given_fast_trace(self):
+        sink = Mock()
+        tracer = tracing.Tracer([sink], profile_threshold=60, profile_rate=1)
+
+        with tracer.trace('event'):
+            pass
+
+        self.assertIsNone(sink.record.call_args[0][0].profile)
+
+    def test_profile_not_sampled(self):
+        sink = Mock()
+        tracer = tracing.Tracer(
+            [sink], profile_threshold=0, profile_rate=0.5,
+            sample=Mock(return_value=0.9)
+        )
+
+        with tracer.trace('event'):
+            pass
+
+        self.assertIsNone(sink.record.call_args[0][0].profile)
+
+
+class TestSinks(unittest.TestCase):
+
+    def test_metrics_sink(self):
+        count = metrics.STAGE_SECONDS.get_count(trace='test', stage='fetch')
+
+        with tracing.Tracer([tracing.MetricsSink()]).trace('test'):
+            with tracing.span('fetch'):
+                pass
+
+        self.assertEqual(1, metrics.STAGE_SECONDS.get_count(
+            trace='test', stage='fetch') - count)
+
+    def test_logging_sink(self):
+        with self.assertLogs('globomap_driver_acs.tracing') as logs:
+            with tracing.Tracer([tracing.LoggingSink()]).trace('event'):
+                with tracing.span('fetch'):
+                    pass
+
+        self.assertIn('fetch=', logs.output[0])
+
+    def test_create_sinks(self):
+        sinks = tracing.create_sinks('log, metrics', log_threshold=2)
+
+        self.assertIsInstance(sinks[0], tracing.LoggingSink)
+        self.assertEqual(2, sinks[0].threshold)
+        self.assertIsInstance(sinks[1], tracing.MetricsSink)
+        self.assertEqual([], tracing.create_sinks(None))
+
+    def test_create_sinks_given_unknown_sink(self):
+        with self.assertRaises(ValueError):
+            tracing.create_sinks('statsd')